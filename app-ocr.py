@@ -1,14 +1,20 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import cv2
-import numpy as np
-from PIL import Image
-import fitz  # PyMuPDF
 import os
-from pathlib import Path
 import threading
 
+# Solo lo ligero: el motor de limpieza (OpenCV, PyMuPDF) se carga en el hilo
+# de trabajo al pulsar Procesar, y la ventana aparece sin esperarlo
+from retoque import (BATCH_DONE, CANCELLED_ERROR, FILE_DONE, FILE_STARTED, PAGE_DONE,
+                     CleaningOptions, ProgressChannel, ProgressEvent, default_cache_dir,
+                     default_journal_dir, format_event)
+
+# Cada cuánto recoge la interfaz los eventos del hilo de limpieza
+PROGRESS_POLL_MS = 100
+# Segundos como máximo por página: una página rebelde no bloquea el resto
+PAGE_TIME_LIMIT = 180
+
 class WatermarkRemoverApp:
     def __init__(self, root):
         self.root = root
@@ -17,9 +23,18 @@ class WatermarkRemoverApp:
         self.root.configure(bg='#f0f4f8')
         
         self.files = []
-        self.output_pdf = None
+        # Un PDF limpio por cada archivo de entrada, todos en esta carpeta
+        self.output_dir = os.path.join(os.path.expanduser("~"), "Downloads", "limpios")
+        self.outputs = []
+        self.failed = []
+        self.options = None
+        # El hilo de limpieza solo publica eventos; los widgets se tocan desde aquí
+        self.events = ProgressChannel()
+        # Se activa con el botón Cancelar; el motor lo comprueba entre etapas
+        self.cancel = threading.Event()
         
         self.setup_ui()
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
         
     def setup_ui(self):
         # Título
@@ -50,6 +65,12 @@ class WatermarkRemoverApp:
                               padx=20, pady=10, relief=tk.FLAT, cursor='hand2')
         btn_select.pack(pady=15)
         
+        btn_output = tk.Button(drop_frame, text="📂 Carpeta de salida",
+                              command=self.select_output_dir,
+                              bg='#e0e7ff', fg='#4f46e5', font=('Helvetica', 10),
+                              relief=tk.FLAT, cursor='hand2')
+        btn_output.pack()
+        
         # Lista de archivos
         self.files_listbox = tk.Listbox(drop_frame, height=6, bg='white', 
                                         font=('Helvetica', 10), relief=tk.FLAT)
@@ -92,6 +113,13 @@ class WatermarkRemoverApp:
                                       state=tk.DISABLED)
         self.btn_download.pack(side=tk.LEFT, padx=10)
         
+        self.btn_cancel = tk.Button(action_frame, text="⏹ Cancelar",
+                                    command=self.cancel_processing,
+                                    bg='#ef4444', fg='white', font=('Helvetica', 12, 'bold'),
+                                    padx=30, pady=12, relief=tk.FLAT, cursor='hand2',
+                                    state=tk.DISABLED)
+        self.btn_cancel.pack(side=tk.LEFT, padx=10)
+        
         # Barra de progreso
         self.progress = ttk.Progressbar(self.root, mode='indeterminate')
         self.progress.pack(pady=10, padx=40, fill=tk.X)
@@ -112,6 +140,12 @@ class WatermarkRemoverApp:
         )
         self.add_files(files)
         
+    def select_output_dir(self):
+        directory = filedialog.askdirectory(title="Carpeta de salida", initialdir=self.output_dir)
+        if directory:
+            self.output_dir = directory
+            self.status_label.config(text=f"Los PDF limpios se guardarán en {directory}")
+        
     def add_files(self, files):
         for file in files:
             if file not in self.files:
@@ -123,241 +157,78 @@ class WatermarkRemoverApp:
             self.btn_process.config(state=tk.NORMAL)
             self.status_label.config(text=f"{len(self.files)} archivo(s) cargado(s)")
     
-    def remove_blue_lines_from_image(self, img):
-        """Detectar y remover líneas azules (horizontales principalmente)"""
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Rango para detectar líneas azules (ajustado para varios tonos de azul)
-        lower_blue = np.array([90, 50, 50])
-        upper_blue = np.array([130, 255, 255])
-        
-        mask_blue = cv2.inRange(hsv, lower_blue, upper_blue)
-        
-        # Morfología para conectar líneas
-        kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1))
-        mask_blue = cv2.morphologyEx(mask_blue, cv2.MORPH_CLOSE, kernel_horizontal)
-        
-        # Dilatar para cubrir toda la línea
-        kernel_dilate = np.ones((3, 3), np.uint8)
-        mask_blue = cv2.dilate(mask_blue, kernel_dilate, iterations=2)
-        
-        # Inpainting para rellenar
-        result = cv2.inpaint(img, mask_blue, 7, cv2.INPAINT_TELEA)
-        
-        return result
-    
-    def remove_circular_seals(self, img):
-        """Detectar y remover sellos circulares o semicirculares"""
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Detectar bordes
-        edges = cv2.Canny(gray, 50, 150)
-        
-        # Detectar círculos (sellos circulares)
-        circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1, minDist=50,
-                                   param1=50, param2=30, minRadius=20, maxRadius=150)
-        
-        mask = np.zeros(gray.shape, dtype=np.uint8)
-        
-        if circles is not None:
-            circles = np.uint16(np.around(circles))
-            for circle in circles[0, :]:
-                center = (circle[0], circle[1])
-                radius = circle[2]
-                # Dibujar círculo relleno en la máscara
-                cv2.circle(mask, center, radius + 10, 255, -1)
-        
-        # Detectar también áreas con mucho contenido rojo/azul (sellos comunes)
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        
-        # Rojo (sellos rojos)
-        lower_red1 = np.array([0, 100, 100])
-        upper_red1 = np.array([10, 255, 255])
-        lower_red2 = np.array([160, 100, 100])
-        upper_red2 = np.array([180, 255, 255])
-        
-        mask_red1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        mask_red2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        mask_red = cv2.bitwise_or(mask_red1, mask_red2)
-        
-        # Combinar con la máscara de círculos
-        mask = cv2.bitwise_or(mask, mask_red)
-        
-        # Morfología para limpiar
-        kernel = np.ones((5, 5), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-        mask = cv2.dilate(mask, kernel, iterations=2)
-        
-        # Inpainting
-        result = cv2.inpaint(img, mask, 7, cv2.INPAINT_TELEA)
-        
-        return result
-    
-    def remove_handwritten_signatures(self, img):
-        """Detectar y remover firmas manuscritas"""
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Umbral adaptativo para detectar texto/trazos
-        thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-                                       cv2.THRESH_BINARY_INV, 11, 2)
-        
-        # Morfología para conectar trazos de firma
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
-        morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
-        
-        # Encontrar contornos
-        contours, _ = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
-        mask = np.zeros(gray.shape, dtype=np.uint8)
-        
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            x, y, w, h = cv2.boundingRect(contour)
-            aspect_ratio = w / float(h) if h > 0 else 0
-            
-            # Filtrar características típicas de firmas:
-            # - Área media (no muy pequeña ni muy grande)
-            # - Relación de aspecto horizontal (firmas son más anchas)
-            # - No es texto regular (más irregular)
-            if 500 < area < 15000 and 1.5 < aspect_ratio < 8:
-                # Verificar densidad de píxeles (firmas tienen densidad media)
-                roi = thresh[y:y+h, x:x+w]
-                density = np.sum(roi > 0) / (w * h) if (w * h) > 0 else 0
-                
-                if 0.05 < density < 0.4:  # Firmas tienen densidad característica
-                    cv2.drawContours(mask, [contour], -1, 255, -1)
-                    # Expandir un poco la máscara
-                    cv2.rectangle(mask, (x-5, y-5), (x+w+5, y+h+5), 255, -1)
-        
-        # Dilatar para cubrir toda la firma
-        kernel_dilate = np.ones((3, 3), np.uint8)
-        mask = cv2.dilate(mask, kernel_dilate, iterations=2)
-        
-        # Inpainting
-        result = cv2.inpaint(img, mask, 7, cv2.INPAINT_TELEA)
-        
-        return result
-    
-    def clean_document(self, image_path):
-        """Limpieza completa del documento según opciones seleccionadas"""
-        img = cv2.imread(image_path)
-        if img is None:
-            return None
-        
-        result = img.copy()
-        
-        # Aplicar filtros según selección del usuario
-        if self.remove_blue_lines.get():
-            result = self.remove_blue_lines_from_image(result)
-        
-        if self.remove_seals.get():
-            result = self.remove_circular_seals(result)
-        
-        if self.remove_signatures.get():
-            result = self.remove_handwritten_signatures(result)
-        
-        # Mejora final: suavizar y mejorar contraste
-        result = cv2.bilateralFilter(result, 5, 75, 75)
-        
-        return result
+    def build_options(self):
+        """Leer las opciones seleccionadas en la interfaz"""
+        return CleaningOptions(
+            remove_blue_lines=self.remove_blue_lines.get(),
+            remove_seals=self.remove_seals.get(),
+            remove_signatures=self.remove_signatures.get(),
+            # Alta resolución para mejor detección (216 ppp = zoom 3); las páginas
+            # muy grandes se limitan a max_page_megapixels
+            target_dpi=216,
+            # Reutilizar las páginas ya limpiadas si se vuelve a cargar el mismo documento
+            cache_dir=default_cache_dir(),
+            # Si se cierra a medias, al volver a procesar los mismos archivos
+            # se reanuda desde la última página escrita
+            journal_dir=default_journal_dir(),
+            # Dos archivos a la vez: mientras uno se codifica o se lee, el otro se limpia
+            file_workers=2,
+            page_time_limit=PAGE_TIME_LIMIT,
+            # Las páginas sin color se limpian en gris, con un tercio de la memoria
+            gray_pages=True,
+        )
     
-    def process_pdf(self, pdf_path):
-        """Procesar PDF: extraer páginas, limpiar y reconstruir"""
-        doc = fitz.open(pdf_path)
-        processed_images = []
-        temp_dir = os.path.join(os.path.expanduser("~"), "temp_watermark")
-        os.makedirs(temp_dir, exist_ok=True)
-        
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            # Alta resolución para mejor detección
-            pix = page.get_pixmap(matrix=fitz.Matrix(3, 3))
-            
-            # Guardar temporalmente
-            temp_img_path = os.path.join(temp_dir, f"page_{page_num}.png")
-            pix.save(temp_img_path)
-            
-            # Limpiar imagen
-            cleaned_img = self.clean_document(temp_img_path)
-            
-            if cleaned_img is not None:
-                processed_images.append(cleaned_img)
-            
-            # Limpiar archivo temporal
-            if os.path.exists(temp_img_path):
-                os.remove(temp_img_path)
-        
-        doc.close()
-        
-        # Limpiar directorio temporal
-        try:
-            os.rmdir(temp_dir)
-        except:
-            pass
-            
-        return processed_images
+    def poll_progress(self):
+        """Mostrar los eventos pendientes del hilo de limpieza"""
+        for event in self.events.drain():
+            self.show_event(event)
+        self.root.after(PROGRESS_POLL_MS, self.poll_progress)
     
-    def create_pdf_from_images(self, images, output_path):
-        """Crear PDF desde imágenes procesadas"""
-        if not images:
-            return False
-        
-        # Convertir imágenes a PIL
-        pil_images = []
-        for img in images:
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            pil_img = Image.fromarray(rgb_img)
-            pil_images.append(pil_img)
-        
-        # Guardar como PDF con alta calidad
-        if pil_images:
-            pil_images[0].save(output_path, "PDF", resolution=300.0, 
-                             save_all=True, append_images=pil_images[1:] if len(pil_images) > 1 else [])
-            return True
-        
-        return False
+    def show_event(self, event):
+        if event.kind == FILE_STARTED:
+            self.status_label.config(text=f"🔄 Limpiando {os.path.basename(event.file)}...")
+        elif event.kind == PAGE_DONE:
+            self.status_label.config(text=f"🔄 {format_event(event)}")
+        elif event.kind == FILE_DONE:
+            if event.error:
+                self.failed.append(f"{os.path.basename(event.file)}: {event.error}")
+        elif event.kind == BATCH_DONE:
+            self.progress.stop()
+            self.btn_cancel.config(state=tk.DISABLED)
+            if event.error == CANCELLED_ERROR:
+                self.status_label.config(text="⏹ Procesamiento cancelado")
+                self.btn_process.config(state=tk.NORMAL)
+                return
+            if event.error or not event.pages:
+                self.status_label.config(text="❌ Error en el procesamiento")
+                error = event.error or "\n".join(self.failed)
+                messagebox.showerror("Error", f"Error: {error}")
+                return
+            if self.failed:
+                messagebox.showwarning("Advertencia", "No se pudieron limpiar:\n" + "\n".join(self.failed))
+            options = self.options
+            self.status_label.config(text="✅ ¡Documento limpio creado exitosamente!")
+            self.btn_download.config(state=tk.NORMAL)
+            messagebox.showinfo("Éxito", 
+                "¡Documento limpiado exitosamente!\n\nSe removieron:\n" +
+                ("✓ Líneas azules\n" if options.remove_blue_lines else "") +
+                ("✓ Sellos\n" if options.remove_seals else "") +
+                ("✓ Firmas manuscritas\n" if options.remove_signatures else ""))
     
-    def process_files_thread(self):
-        """Procesar archivos en thread separado"""
-        self.progress.start()
-        self.status_label.config(text="🔄 Limpiando documentos con IA...")
-        
-        processed_images = []
-        
+    def process_files_thread(self, options):
+        """Procesar archivos en thread separado; el avance se publica en self.events
+
+        Cada entrada se escribe en su propio PDF dentro de self.output_dir.
+        """
+        from retoque import clean_batch
+
         try:
-            for file_path in self.files:
-                ext = Path(file_path).suffix.lower()
-                
-                if ext == '.pdf':
-                    # Procesar PDF
-                    images = self.process_pdf(file_path)
-                    processed_images.extend(images)
-                else:
-                    # Procesar imagen
-                    cleaned_img = self.clean_document(file_path)
-                    if cleaned_img is not None:
-                        processed_images.append(cleaned_img)
-            
-            # Crear PDF de salida
-            output_dir = os.path.join(os.path.expanduser("~"), "Downloads")
-            self.output_pdf = os.path.join(output_dir, "documento_limpio.pdf")
-            
-            if self.create_pdf_from_images(processed_images, self.output_pdf):
-                self.progress.stop()
-                self.status_label.config(text="✅ ¡Documento limpio creado exitosamente!")
-                self.btn_download.config(state=tk.NORMAL)
-                self.root.after(0, lambda: messagebox.showinfo("Éxito", 
-                    "¡Documento limpiado exitosamente!\n\nSe removieron:\n" +
-                    ("✓ Líneas azules\n" if self.remove_blue_lines.get() else "") +
-                    ("✓ Sellos\n" if self.remove_seals.get() else "") +
-                    ("✓ Firmas manuscritas\n" if self.remove_signatures.get() else "")))
-            else:
-                raise Exception("Error al crear PDF")
-                
+            results = clean_batch(self.files, self.output_dir, options, events=self.events,
+                                  cancel=self.cancel)
+            self.outputs = [result.output_path for result in results if result.ok]
         except Exception as e:
-            self.progress.stop()
-            self.status_label.config(text="❌ Error en el procesamiento")
-            self.root.after(0, lambda: messagebox.showerror("Error", f"Error: {str(e)}"))
+            print(f"Error en process_files_thread: {e}")
+            self.events.publish(ProgressEvent(BATCH_DONE, error=str(e)))
     
     def process_files(self):
         """Iniciar procesamiento en thread"""
@@ -367,15 +238,29 @@ class WatermarkRemoverApp:
         
         self.btn_process.config(state=tk.DISABLED)
         self.btn_download.config(state=tk.DISABLED)
-        thread = threading.Thread(target=self.process_files_thread)
+        self.progress.start()
+        self.status_label.config(text="🔄 Limpiando documentos con IA...")
+        self.options = self.build_options()
+        self.outputs = []
+        self.failed = []
+        self.cancel = threading.Event()
+        self.btn_cancel.config(state=tk.NORMAL)
+        thread = threading.Thread(target=self.process_files_thread, args=(self.options,))
         thread.daemon = True
         thread.start()
     
+    def cancel_processing(self):
+        """Pedir al hilo de limpieza que se detenga; lo ya hecho queda en el diario"""
+        self.cancel.set()
+        self.btn_cancel.config(state=tk.DISABLED)
+        self.status_label.config(text="⏹ Cancelando...")
+    
     def download_pdf(self):
-        """Abrir ubicación del PDF generado"""
-        if self.output_pdf and os.path.exists(self.output_pdf):
-            os.startfile(os.path.dirname(self.output_pdf))
-            messagebox.showinfo("Descarga", f"PDF guardado en:\n{self.output_pdf}")
+        """Abrir la carpeta con los PDF generados"""
+        outputs = [path for path in self.outputs if os.path.exists(path)]
+        if outputs:
+            os.startfile(self.output_dir)
+            messagebox.showinfo("Descarga", f"{len(outputs)} PDF guardado(s) en:\n{self.output_dir}")
         else:
             messagebox.showerror("Error", "No se encontró el archivo PDF")
 
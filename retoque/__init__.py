@@ -0,0 +1,99 @@
+"""Motor de limpieza de documentos escaneados, sin dependencias de interfaz gráfica
+
+Los nombres públicos se cargan al primer uso (PEP 562): `import retoque` o
+`from retoque import CleaningOptions` no arrastran OpenCV, NumPy ni PyMuPDF,
+que solo se importan cuando se pide algo del motor. Así la línea de órdenes,
+las interfaces y cada proceso de trabajo arrancan sin pagar lo que no usan.
+"""
+import importlib
+
+# Submódulo que define cada nombre público
+_EXPORTS = {
+    '.options': (
+        'CleaningOptions', 'ENCODERS', 'OUTPUT_MODES', 'SMOOTHING_MODES', 'default_cache_dir',
+        'default_journal_dir',
+    ),
+    '.filters': (
+        'apply_cleaning_filters',
+        'blue_lines_mask',
+        'build_cleaning_mask',
+        'clean_image',
+        'final_smoothing',
+        'inpaint_mask',
+        'inpaint_regions',
+        'remove_blue_lines_from_image',
+        'remove_circular_seals',
+        'remove_handwritten_signatures',
+        'seals_mask',
+        'signatures_mask',
+        'smooth_band',
+    ),
+    '.engine': (
+        'PAGE_CACHED',
+        'PAGE_CLEANED',
+        'PAGE_ORIGINAL',
+        'PAGE_RESUMED',
+        'PAGE_SKIPPED',
+        'PAGE_TIMED_OUT',
+        'CANCELLED_ERROR',
+        'FileResult',
+        'clean_batch',
+        'clean_document',
+        'clean_file_to_path',
+        'clean_file_to_writer',
+        'clean_image_cached',
+        'clean_loaded_page',
+        'clean_pdf_page',
+        'clean_pdf_page_patches',
+        'collect_input_files',
+        'create_page_pool',
+        'iter_pdf_pages',
+        'output_name_for',
+        'output_path_for',
+        'page_cache_for',
+        'patch_pdf_to_writer',
+        'process_file',
+        'process_pdf',
+        'run_page_function',
+    ),
+    '.render': ('page_memory_bytes', 'page_render_scale', 'render_page', 'render_thumbnail'),
+    '.budget': ('Cancelled', 'PageBudget', 'page_budget', 'stage_allowed'),
+    '.cache': ('PageCache',),
+    '.journal': ('JobJournal',),
+    '.metrics': ('MetricsRecorder', 'PageMetrics', 'measure_page', 'measuring', 'stage'),
+    '.progress': (
+        'BATCH_DONE',
+        'FILE_DONE',
+        'FILE_STARTED',
+        'PAGE_DONE',
+        'ProgressChannel',
+        'ProgressEvent',
+        'ProgressLog',
+        'format_event',
+    ),
+    '.encoders': ('EncodedPage', 'choose_encoder', 'encode_page'),
+    '.patches': ('PagePatch', 'PdfPatchWriter', 'extract_patches'),
+    '.templates': ('MaskTemplate', 'document_template', 'start_document'),
+    '.tiles': ('clean_image_tiled', 'page_tiles', 'tile_halo'),
+    '.triage': ('is_gray', 'thumbnail', 'triage_page'),
+    '.watch': ('FolderWatcher',),
+    '.writer': ('PdfPageWriter', 'create_pdf_from_images'),
+}
+
+_MODULE_OF = {name: module for module, names in _EXPORTS.items() for name in names}
+
+__all__ = sorted(_MODULE_OF)
+
+
+def __getattr__(name):
+    module = _MODULE_OF.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    # Guardarlo en el paquete: los siguientes accesos ya no pasan por aquí
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,477 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import asdict, replace
+from datetime import datetime, timezone
+from pathlib import Path
+from queue import Empty
+
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+
+from .cli import add_option_arguments, options_from_args
+from .engine import clean_batch
+from .metrics import peak_rss_mb
+from .options import SMOOTHING_MODES
+
+BENCHMARK_VERSION = 1
+# PDFs de ejemplo incluidos en el repositorio
+SAMPLE_PDFS = ('Scan test pdf_0001.pdf', 'ejercicio pdf_0001.pdf')
+SAMPLES_DIR = Path(__file__).resolve().parent.parent
+
+# Módulos que deben importarse sin arrastrar las bibliotecas pesadas: son los
+# que cargan la línea de órdenes (hasta parsear los argumentos) y las interfaces
+LIGHT_IMPORTS = ('retoque', 'retoque.options', 'retoque.progress', 'retoque.cli')
+HEAVY_MODULES = ('cv2', 'numpy', 'fitz', 'pymupdf', 'PIL', 'tkinter')
+# Lo que importa cada proceso de trabajo antes de su primera página
+WORKER_IMPORT = 'retoque.engine'
+IMPORT_REPEATS = 3
+# Cada cuántos segundos se comprueba que el proceso de un caso sigue vivo
+CASE_POLL_SECONDS = 5
+# Tamaño A4 en pulgadas y en puntos PDF
+A4_INCHES = (8.27, 11.69)
+A4_POINTS = (595, 842)
+# Suavizado con el que se comparan los demás en --compare-smoothing
+REFERENCE_SMOOTHING = 'bilateral'
+
+
+def _random_word(rng):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    return ''.join(rng.choice(list(letters), rng.integers(2, 10)))
+
+
+def synthetic_page(dpi, rng):
+    """Página A4 escaneada de mentira: texto, renglones azules, sello rojo y firma"""
+    width, height = int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi)
+    s = dpi / 100
+    img = np.full((height, width, 3), 245, dtype=np.uint8)
+    img = np.clip(img + rng.normal(0, 2, img.shape), 0, 255).astype(np.uint8)
+    margin, line_step = int(60 * s), int(28 * s)
+    thickness = max(1, int(s))
+
+    # Texto impreso, con un renglón azul debajo de cada línea
+    for y in range(int(90 * s), height - int(120 * s), line_step):
+        text = ' '.join(_random_word(rng) for _ in range(12))
+        cv2.putText(img, text, (margin, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45 * s, (35, 35, 35),
+                    thickness, cv2.LINE_AA)
+        cv2.line(img, (margin, y + int(7 * s)), (width - margin, y + int(7 * s)), (190, 95, 35),
+                 max(1, int(1.5 * s)))
+
+    # Sello rojo circular
+    radius = int(rng.integers(55, 75) * s)
+    center = (int(rng.integers(width // 2, width - radius - margin)),
+              int(rng.integers(height // 2, height - radius - margin)))
+    cv2.circle(img, center, radius, (45, 45, 200), max(2, int(3 * s)), cv2.LINE_AA)
+    cv2.circle(img, center, int(radius * 0.72), (45, 45, 200), thickness, cv2.LINE_AA)
+    cv2.putText(img, "SELLO", (center[0] - int(28 * s), center[1] + int(6 * s)),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.6 * s, (45, 45, 200), thickness, cv2.LINE_AA)
+
+    # Firma: un trazo continuo y suave a mano alzada
+    steps = rng.normal(0, 1, (160, 2)).cumsum(axis=0)
+    xs = np.linspace(0, 220 * s, len(steps)) + steps[:, 0] * 4 * s
+    ys = np.sin(np.linspace(0, 9 * np.pi, len(steps))) * 22 * s + steps[:, 1] * 3 * s
+    origin = (margin + int(rng.integers(0, width // 3)), height - int(90 * s))
+    points = np.stack([xs + origin[0], ys + origin[1]], axis=1).astype(np.int32)
+    cv2.polylines(img, [points], False, (110, 40, 25), max(2, int(2 * s)), cv2.LINE_AA)
+    return img
+
+
+def write_synthetic_pdf(path, dpi, pages, seed):
+    """PDF de páginas sintéticas escaneadas a `dpi`, reproducible con `seed`"""
+    rng = np.random.default_rng(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        success, data = cv2.imencode('.jpg', synthetic_page(dpi, rng), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        page = doc.new_page(width=A4_POINTS[0], height=A4_POINTS[1])
+        page.insert_image(page.rect, stream=data.tobytes())
+    doc.save(path, deflate=True)
+    doc.close()
+
+
+def _trimmed_copy(pdf_path, pages, directory):
+    """Copia de un PDF con solo sus primeras `pages` páginas"""
+    doc = fitz.open(pdf_path)
+    if not pages or len(doc) <= pages:
+        doc.close()
+        return pdf_path
+    doc.select(range(pages))
+    path = os.path.join(directory, Path(pdf_path).name)
+    doc.save(path, garbage=3, deflate=True)
+    doc.close()
+    return path
+
+
+def _mean_stage_seconds(metrics_path):
+    """Segundos medios por página de cada etapa, a partir de las métricas del caso"""
+    totals = defaultdict(float)
+    pages = 0
+    with open(metrics_path, encoding='utf-8') as f:
+        for line in f:
+            pages += 1
+            for stage, seconds in json.loads(line)['stages'].items():
+                totals[stage] += seconds
+    return {stage: round(seconds / pages, 4) for stage, seconds in totals.items()} if pages else {}
+
+
+def _run_case(pdf_path, options, output_dir, queue):
+    """Limpiar un documento de principio a fin en un proceso nuevo y medirlo"""
+    # Los mensajes por página del motor no interesan aquí
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, sys.stdout.fileno())
+
+    start = time.perf_counter()
+    try:
+        results = clean_batch([pdf_path], output_dir, options)
+    except Exception as e:
+        queue.put(_failed_case(f"Error en el caso: {e}"))
+        return
+    seconds = time.perf_counter() - start
+    if not results:
+        queue.put(_failed_case("No se encontraron archivos soportados"))
+        return
+    result = results[0]
+    queue.put({
+        'seconds': round(seconds, 3),
+        'pages': result.pages,
+        'error': result.error,
+        'output_bytes': os.path.getsize(result.output_path) if result.ok else None,
+        'peak_rss_mb': peak_rss_mb(),
+    })
+
+
+def _failed_case(error):
+    return {'seconds': None, 'pages': 0, 'error': error, 'output_bytes': None, 'peak_rss_mb': None}
+
+
+def wait_for_case(process, queue):
+    """Esperar la medición de un caso sin colgarse si su proceso muere antes de enviarla"""
+    while True:
+        try:
+            return queue.get(timeout=CASE_POLL_SECONDS)
+        except Empty:
+            if process.is_alive():
+                continue
+        # Terminó: lo que hubiera enviado justo antes ya está en la cola
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            process.join()
+            return _failed_case(f"El proceso del caso terminó sin resultado (código {process.exitcode})")
+
+
+def run_case(name, pdf_path, options, work_dir):
+    """Limpiar un documento de principio a fin en un proceso aparte y medirlo"""
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    output_dir = os.path.join(work_dir, "out", name)
+    # El desglose por etapas sale de la instrumentación del propio motor
+    metrics_path = os.path.join(work_dir, f"{name}.jsonl")
+    options = replace(options, metrics_path=metrics_path)
+    process = context.Process(target=_run_case, args=(pdf_path, options, output_dir, queue))
+    process.start()
+    measured = wait_for_case(process, queue)
+    process.join()
+
+    case = {'name': name, 'input': str(pdf_path)}
+    case.update(measured)
+    case['pages_per_second'] = round(case['pages'] / case['seconds'], 4) if case['seconds'] else None
+    case['stages'] = _mean_stage_seconds(metrics_path) if os.path.exists(metrics_path) else {}
+    return case
+
+
+def _page_grays(pdf_path):
+    """Imagen en gris de cada página de un PDF escrito en modo raster"""
+    doc = fitz.open(pdf_path)
+    try:
+        for page in doc:
+            pix = fitz.Pixmap(doc, page.get_images()[0][0])
+            img = np.frombuffer(pix.samples, np.uint8).reshape(pix.h, pix.w, pix.n)
+            yield img[..., 0] if pix.n < 3 else cv2.cvtColor(img[..., :3], cv2.COLOR_RGB2GRAY)
+    finally:
+        doc.close()
+
+
+def ssim(a, b):
+    """Índice de similitud estructural (SSIM) entre dos imágenes en gris, ventana gaussiana de 11"""
+    a, b = a.astype(np.float32), b.astype(np.float32)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    blur = lambda img: cv2.GaussianBlur(img, (11, 11), 1.5)
+    mean_a, mean_b = blur(a), blur(b)
+    var_a = blur(a * a) - mean_a * mean_a
+    var_b = blur(b * b) - mean_b * mean_b
+    covar = blur(a * b) - mean_a * mean_b
+    index = ((2 * mean_a * mean_b + c1) * (2 * covar + c2)
+             / ((mean_a * mean_a + mean_b * mean_b + c1) * (var_a + var_b + c2)))
+    return float(index.mean())
+
+
+def sharpness(gray):
+    """Nitidez como varianza del laplaciano: baja cuando se ablandan los bordes del texto"""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def compare_smoothing(document, cases, work_dir):
+    """Comparar las salidas de un documento con cada suavizado frente a REFERENCE_SMOOTHING
+
+    `cases` es {modo: caso}. Devuelve una fila por modo con el tiempo ahorrado,
+    el SSIM por página frente a la referencia y la nitidez media.
+    """
+    outputs = {mode: next(Path(work_dir, "out", case['name']).glob("*.pdf"))
+               for mode, case in cases.items() if not case['error']}
+    if REFERENCE_SMOOTHING not in outputs:
+        return []
+    reference_case = cases[REFERENCE_SMOOTHING]
+    reference = list(_page_grays(outputs[REFERENCE_SMOOTHING]))
+    rows = []
+    for mode, path in outputs.items():
+        pages = list(_page_grays(path))
+        scores = [ssim(page, ref) for page, ref in zip(pages, reference)]
+        saved = reference_case['seconds'] - cases[mode]['seconds']
+        rows.append({
+            'document': document,
+            'smoothing': mode,
+            'seconds': cases[mode]['seconds'],
+            'saved_seconds': round(saved, 3),
+            'saved_fraction': round(saved / reference_case['seconds'], 4) if reference_case['seconds'] else None,
+            'smoothing_seconds': cases[mode]['stages'].get('bilateral', 0.0),
+            'ssim': round(sum(scores) / len(scores), 5) if scores else None,
+            'ssim_min': round(min(scores), 5) if scores else None,
+            'sharpness': round(sum(map(sharpness, pages)) / len(pages), 1) if pages else None,
+        })
+    return rows
+
+
+def print_smoothing(rows):
+    print(f"Suavizado final frente a '{REFERENCE_SMOOTHING}':")
+    print(f"{'documento':<24} {'modo':<10} {'seg':>8} {'ahorro':>14} {'suav. s/pág':>12} "
+          f"{'SSIM':>8} {'SSIM mín':>9} {'nitidez':>9}")
+    for row in rows:
+        saved = f"{row['saved_seconds']:+.2f} ({row['saved_fraction']:+.1%})"
+        print(f"{row['document']:<24} {row['smoothing']:<10} {row['seconds']:>8.2f} {saved:>14} "
+              f"{row['smoothing_seconds']:>12.4f} {row['ssim']:>8.4f} {row['ssim_min']:>9.4f} "
+              f"{row['sharpness']:>9.1f}")
+
+
+def measure_import(module):
+    """Milisegundos que tarda `import module` en un intérprete nuevo y qué
+    bibliotecas pesadas deja cargadas (la mejor de IMPORT_REPEATS medidas)"""
+    code = (
+        "import json, sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "ms = (time.perf_counter() - start) * 1000\n"
+        f"print(json.dumps([ms, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))\n"
+    )
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (str(SAMPLES_DIR), env.get('PYTHONPATH'))))
+    best = None
+    for _ in range(IMPORT_REPEATS):
+        output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                                capture_output=True, text=True).stdout
+        ms, heavy = json.loads(output.splitlines()[-1])
+        if best is None or ms < best['ms']:
+            best = {'module': module, 'ms': round(ms, 1), 'heavy': heavy}
+    return best
+
+
+def check_imports(budget_ms):
+    """Medir el arranque de los módulos ligeros y del proceso de trabajo
+
+    Devuelve (mediciones, fallos): falla un módulo ligero que tarda más de
+    `budget_ms` o que carga alguna de HEAVY_MODULES.
+    """
+    imports = [measure_import(module) for module in LIGHT_IMPORTS + (WORKER_IMPORT,)]
+    failures = []
+    for measured in imports:
+        light = measured['module'] in LIGHT_IMPORTS
+        over_budget = light and budget_ms and measured['ms'] > budget_ms
+        heavy = light and measured['heavy']
+        mark = "❌" if over_budget or heavy else "  "
+        detail = f" carga {', '.join(measured['heavy'])}" if measured['heavy'] else ""
+        print(f"{mark} import {measured['module']:<20} {measured['ms']:>8.1f} ms{detail}")
+        if mark == "❌":
+            failures.append(measured)
+    return imports, failures
+
+
+def compare_with_baseline(report, baseline, max_slowdown, max_rss_growth, max_size_growth):
+    """Comparar con un informe anterior; devuelve la lista de regresiones"""
+    if baseline.get('options') != report['options']:
+        print("⚠️ El informe base se hizo con otras opciones; la comparación es orientativa")
+
+    regressions = []
+    previous = {case['name']: case for case in baseline.get('cases', [])}
+    checks = (
+        ('pages_per_second', max_slowdown, lambda new, old, limit: new < old * (1 - limit)),
+        ('peak_rss_mb', max_rss_growth, lambda new, old, limit: new > old * (1 + limit)),
+        ('output_bytes', max_size_growth, lambda new, old, limit: new > old * (1 + limit)),
+    )
+    for case in report['cases']:
+        old = previous.get(case['name'])
+        if old is None:
+            continue
+        for metric, limit, regressed in checks:
+            new_value, old_value = case.get(metric), old.get(metric)
+            if new_value is None or not old_value:
+                continue
+            change = (new_value - old_value) / old_value
+            mark = "❌" if regressed(new_value, old_value, limit) else "  "
+            print(f"{mark} {case['name']:<28} {metric:<17} {old_value:>12} -> {new_value:>12} ({change:+.1%})")
+            if mark == "❌":
+                regressions.append((case['name'], metric, old_value, new_value))
+    return regressions
+
+
+def print_report(report):
+    print(f"{'caso':<28} {'págs':>5} {'seg':>8} {'págs/s':>8} {'RSS MB':>8} {'salida KB':>10}")
+    for case in report['cases']:
+        if case['error']:
+            print(f"{case['name']:<28} error: {case['error']}")
+            continue
+        rss = case['peak_rss_mb'] if case['peak_rss_mb'] is not None else '-'
+        print(f"{case['name']:<28} {case['pages']:>5} {case['seconds']:>8.2f} {case['pages_per_second']:>8.3f} "
+              f"{rss:>8} {case['output_bytes'] // 1024:>10}")
+        if case['stages']:
+            stages = ', '.join(f"{stage} {seconds:.3f}s" for stage, seconds in case['stages'].items())
+            print(f"{'':<28} por página: {stages}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m retoque.benchmark",
+        description="Medir el rendimiento del motor de limpieza sobre los PDFs de ejemplo y páginas sintéticas.")
+    parser.add_argument("inputs", nargs="*",
+                        help="PDFs adicionales a medir (por defecto solo los de ejemplo y los sintéticos)")
+    parser.add_argument("--no-samples", action="store_true",
+                        help="No medir los PDFs de ejemplo del repositorio")
+    parser.add_argument("--synthetic-dpi", default="100,150,200",
+                        help="Resoluciones de las páginas sintéticas, separadas por comas; vacío para omitirlas "
+                             "(por defecto: %(default)s)")
+    parser.add_argument("--synthetic-pages", type=int, default=3,
+                        help="Páginas de cada PDF sintético (por defecto: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Semilla de las páginas sintéticas (por defecto: %(default)s)")
+    parser.add_argument("--pages", type=int, default=0,
+                        help="Medir solo las primeras N páginas de cada documento; 0 = todas")
+    parser.add_argument("-o", "--output", default="benchmark.json",
+                        help="Archivo JSON donde se guardan los resultados (por defecto: %(default)s)")
+    parser.add_argument("--baseline",
+                        help="JSON de una ejecución anterior con el que comparar")
+    parser.add_argument("--max-slowdown", type=float, default=0.10,
+                        help="Caída máxima tolerada de páginas/s respecto a la base (por defecto: %(default)s)")
+    parser.add_argument("--max-rss-growth", type=float, default=0.20,
+                        help="Aumento máximo tolerado del pico de memoria (por defecto: %(default)s)")
+    parser.add_argument("--max-size-growth", type=float, default=0.10,
+                        help="Aumento máximo tolerado del tamaño de salida (por defecto: %(default)s)")
+    parser.add_argument("--import-budget", type=float, default=150.0, metavar="MS",
+                        help="Milisegundos máximos para importar la línea de órdenes y los módulos que usan las "
+                             "interfaces, sin cargar OpenCV, NumPy ni PyMuPDF; 0 = no limitar el tiempo "
+                             "(por defecto: %(default)s)")
+    parser.add_argument("--compare-smoothing", action="store_true",
+                        help="Medir cada documento con cada suavizado final (salida raster PNG, sin caché) y "
+                             f"comparar tiempo, SSIM y nitidez con '{REFERENCE_SMOOTHING}'")
+    parser.add_argument("--imports-only", action="store_true",
+                        help="Comprobar solo los tiempos de importación, sin limpiar documentos")
+    add_option_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    options = options_from_args(args)
+    report = {
+        'version': BENCHMARK_VERSION,
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'opencv': cv2.__version__,
+        'pymupdf': fitz.VersionBind,
+        'cpu_count': os.cpu_count(),
+        'options': asdict(options),
+        'cases': [],
+    }
+
+    print("Tiempos de importación:")
+    report['imports'], import_failures = check_imports(args.import_budget)
+    if args.imports_only:
+        if import_failures:
+            print(f"❌ {len(import_failures)} importación(es) fuera de presupuesto")
+            return 1
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="retoque-bench-") as work_dir:
+        documents = []
+        if not args.no_samples:
+            for name in SAMPLE_PDFS:
+                path = SAMPLES_DIR / name
+                if path.exists():
+                    documents.append((Path(name).stem, str(path)))
+                else:
+                    print(f"⚠️ No se encontró el PDF de ejemplo {path}")
+        for dpi in filter(None, args.synthetic_dpi.split(",")):
+            path = os.path.join(work_dir, f"sintetico-{dpi}dpi.pdf")
+            write_synthetic_pdf(path, int(dpi), args.synthetic_pages, args.seed)
+            documents.append((f"sintetico-{dpi}dpi", path))
+        documents.extend((Path(path).stem, path) for path in args.inputs)
+
+        for name, path in documents:
+            trimmed_dir = os.path.join(work_dir, "trimmed", name)
+            os.makedirs(trimmed_dir, exist_ok=True)
+            path = _trimmed_copy(path, args.pages, trimmed_dir)
+            if not args.compare_smoothing:
+                print(f"Midiendo {name}...", flush=True)
+                report['cases'].append(run_case(name, path, options, work_dir))
+                continue
+            # Salida sin pérdida y sin caché, para comparar píxeles y tiempos reales
+            cases = {}
+            for mode in SMOOTHING_MODES:
+                print(f"Midiendo {name} con suavizado '{mode}'...", flush=True)
+                mode_options = replace(options, smoothing=mode, output_mode='raster', page_encoder='png',
+                                       cache_dir=None, journal_dir=None)
+                cases[mode] = run_case(f"{name}-{mode}", path, mode_options, work_dir)
+                report['cases'].append(cases[mode])
+            report.setdefault('smoothing', []).extend(compare_smoothing(name, cases, work_dir))
+
+    measured = [case for case in report['cases'] if not case['error']]
+    total_pages = sum(case['pages'] for case in measured)
+    total_seconds = sum(case['seconds'] for case in measured)
+    report['totals'] = {
+        'pages': total_pages,
+        'seconds': round(total_seconds, 3),
+        'pages_per_second': round(total_pages / total_seconds, 4) if total_seconds else None,
+    }
+
+    print_report(report)
+    if report.get('smoothing'):
+        print_smoothing(report['smoothing'])
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {args.output}")
+
+    failed = False
+    if import_failures:
+        print(f"❌ {len(import_failures)} importación(es) fuera de presupuesto")
+        failed = True
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.max_slowdown,
+                                            args.max_rss_growth, args.max_size_growth)
+        if regressions:
+            print(f"❌ {len(regressions)} regresión(es) respecto a {args.baseline}")
+            failed = True
+        else:
+            print(f"✅ Sin regresiones respecto a {args.baseline}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
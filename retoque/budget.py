@@ -0,0 +1,89 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class Cancelled(BaseException):
+    """Se pidió cancelar el trabajo
+
+    Hereda de BaseException (como KeyboardInterrupt) para que los `except
+    Exception` que convierten el fallo de una página en su imagen original
+    no se la traguen: tiene que llegar hasta quien escribe el PDF.
+    """
+
+
+def raise_if_cancelled(cancel):
+    """Lanzar Cancelled si `cancel` (un threading.Event o None) está activado"""
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+class PageBudget:
+    """Tiempo de una página y cancelación del trabajo, comprobados entre etapas
+
+    Las etapas caras (cada detector y el bilateral final) preguntan antes de
+    empezar con allows(): si la página ya pasó de su plazo, o si se estima
+    que la etapa no cabe en lo que queda, se salta y queda anotada en
+    `skipped`. Una llamada de OpenCV que ya está en marcha no se puede
+    interrumpir, así que las que pueden dispararse (HoughCircles) se estiman
+    antes de empezar.
+    """
+
+    def __init__(self, seconds=0, cancel=None):
+        self.deadline = time.monotonic() + seconds if seconds else None
+        self.cancel = cancel
+        self.skipped = []
+        self._lock = threading.Lock()
+
+    def allows(self, name, seconds=0.0):
+        """¿Se puede empezar la etapa `name`, que se estima que tarda `seconds`?"""
+        raise_if_cancelled(self.cancel)
+        if self.deadline is None or time.monotonic() + seconds <= self.deadline:
+            return True
+        with self._lock:
+            if name not in self.skipped:
+                self.skipped.append(name)
+        return False
+
+
+# Presupuesto de la página que se está limpiando en cada hilo
+_local = threading.local()
+
+
+def current_budget():
+    return getattr(_local, 'budget', None)
+
+
+@contextmanager
+def using_budget(budget):
+    """Aplicar `budget` a las etapas que corran en este hilo durante el bloque"""
+    previous, _local.budget = current_budget(), budget
+    try:
+        yield budget
+    finally:
+        _local.budget = previous
+
+
+def page_budget(options, cancel=None):
+    """Presupuesto de una página según options.page_time_limit, aplicado a este hilo"""
+    return using_budget(PageBudget(options.page_time_limit, cancel))
+
+
+def stage_allowed(name):
+    """¿Se puede empezar la etapa `name`? Sin presupuesto en el hilo, siempre"""
+    budget = current_budget()
+    return budget is None or budget.allows(name)
+
+
+def stage_fits(name, estimate):
+    """¿Cabe la etapa `name` en lo que le queda a la página?
+
+    `estimate()` devuelve los segundos previstos; solo se llama si la página
+    tiene plazo, así que puede costar algo.
+    """
+    budget = current_budget()
+    if budget is None:
+        return True
+    if budget.deadline is None:
+        return budget.allows(name)
+    return budget.allows(name, estimate())
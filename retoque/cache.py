@@ -0,0 +1,140 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+from .options import default_cache_dir  # noqa: F401 (se importaba desde aquí)
+
+# Cambiar al modificar los filtros, para no servir resultados viejos
+CACHE_VERSION = 1
+# Las entradas se guardan como PNG con poca compresión: leerlas debe costar
+# mucho menos que volver a limpiar la página
+PNG_COMPRESSION = 1
+
+# Opciones que cambian el resultado de la limpieza de una página
+KEY_OPTIONS = ('remove_blue_lines', 'remove_seals', 'remove_signatures', 'fused_masks',
+               'region_inpaint', 'detection_scale', 'render_scale', 'template_masks', 'tile_size',
+               'smoothing')
+
+
+class PageCache:
+    """Caché en disco de páginas limpias, direccionada por contenido
+
+    La clave es un hash de los píxeles de la página renderizada y de las
+    opciones que afectan a la limpieza, así que un mismo documento enviado
+    dos veces (o relanzado tras un fallo) no se vuelve a limpiar. Cada
+    entrada es un PNG con la página limpia en BGR y la máscara de lo
+    rellenado en el canal alfa. La fecha de modificación de cada archivo
+    hace de marca de último uso; al pasar de `max_bytes` se borran las
+    entradas usadas hace más tiempo. Varios procesos pueden compartir el
+    mismo directorio, y varios hilos la misma caché: las entradas se
+    escriben a un temporal con nombre único y se renombran.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, img, options):
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}:{img.shape}:{img.dtype}".encode())
+        for name in KEY_OPTIONS:
+            digest.update(f":{name}={getattr(options, name)}".encode())
+        digest.update(np.ascontiguousarray(img).data)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".png")
+
+    def get(self, key):
+        """Devolver (imagen limpia, máscara) o None si la página no está en caché"""
+        path = self._path(key)
+        try:
+            data = np.fromfile(path, dtype=np.uint8)
+        except OSError:
+            return None
+        entry = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+        if entry is None or not (entry.ndim == 2 or entry.shape[2] == 4):
+            return None
+        try:
+            # Marcar como usada recientemente
+            os.utime(path)
+        except OSError:
+            pass
+        if entry.ndim == 2:
+            # Página en gris: la imagen y debajo la máscara
+            height = entry.shape[0] // 2
+            return entry[:height], entry[height:]
+        return np.ascontiguousarray(entry[..., :3]), np.ascontiguousarray(entry[..., 3])
+
+    def put(self, key, cleaned, mask):
+        """Guardar una página limpia y su máscara"""
+        # PNG no admite gris con un canal alfa de 8 bits en OpenCV: una página
+        # en gris se guarda con la máscara debajo, en un PNG de doble alto
+        entry = np.vstack((cleaned, mask)) if cleaned.ndim == 2 else np.dstack((cleaned, mask))
+        success, data = cv2.imencode('.png', entry, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION])
+        if not success:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, partial_path = tempfile.mkstemp(prefix=key, suffix=".part", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data.tobytes())
+            os.replace(partial_path, path)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            full = self._size is None or self._size > self.max_bytes
+        if full:
+            self.evict()
+
+    def _entries(self):
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if not name.endswith(".png"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # Otro proceso la ha borrado mientras tanto
+                    continue
+                yield stat.st_mtime, stat.st_size, path
+
+    def evict(self):
+        """Borrar las entradas menos usadas hasta quedar por debajo del límite"""
+        entries = sorted(self._entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= entry_size
+        with self._lock:
+            self._size = size
+
+    def clear(self):
+        for _, _, path in list(self._entries()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self._lock:
+            self._size = 0
@@ -0,0 +1,244 @@
+import argparse
+import os
+import signal
+
+from .options import ENCODERS, OUTPUT_MODES, SMOOTHING_MODES, CleaningOptions, default_cache_dir, default_journal_dir
+from .progress import ProgressLog
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m retoque",
+        description="Remueve líneas azules, sellos y firmas de PDFs e imágenes escaneadas, sin interfaz gráfica.")
+    parser.add_argument("inputs", nargs="*",
+                        help="Archivos (JPG, PNG, BMP, JPEG, PDF) o directorios a procesar")
+    parser.add_argument("-o", "--output-dir", default=os.path.join(os.getcwd(), "limpios"),
+                        help="Directorio donde se escribe un PDF limpio por cada entrada (por defecto: ./limpios)")
+    parser.add_argument("--watch", metavar="CARPETA",
+                        help="Vigilar CARPETA y limpiar cada archivo que llegue a ella, hasta Ctrl+C; "
+                             "las entradas tratadas se mueven a sus subcarpetas procesados/ y errores/")
+    parser.add_argument("--watch-interval", type=float, default=2.0, metavar="SEG",
+                        help="Segundos entre revisiones de la carpeta vigilada (por defecto: %(default)s)")
+    parser.add_argument("--settle-seconds", type=float, default=5.0, metavar="SEG",
+                        help="Segundos que un archivo tiene que pasar sin cambiar para empezar a limpiarlo "
+                             "(por defecto: %(default)s)")
+    parser.add_argument("--done-dir", metavar="CARPETA",
+                        help="Adónde mover las entradas limpiadas en modo --watch")
+    parser.add_argument("--failed-dir", metavar="CARPETA",
+                        help="Adónde mover las entradas que fallan en modo --watch")
+    parser.add_argument("--progress", action="store_true",
+                        help="Mostrar en stderr el avance de cada archivo (páginas/s, tiempo restante, etapa más lenta)")
+    add_option_arguments(parser)
+    return parser
+
+
+def add_option_arguments(parser):
+    """Añadir a un parser los argumentos que se traducen en CleaningOptions"""
+    parser.add_argument("--no-blue-lines", dest="remove_blue_lines", action="store_false",
+                        help="No remover líneas azules")
+    parser.add_argument("--no-seals", dest="remove_seals", action="store_false",
+                        help="No remover sellos")
+    parser.add_argument("--no-signatures", dest="remove_signatures", action="store_false",
+                        help="No remover firmas manuscritas")
+    parser.add_argument("--fused", dest="fused_masks", action="store_true",
+                        help="Unir las máscaras de todos los detectores y hacer un único inpaint por página")
+    parser.add_argument("--region-inpaint", action="store_true",
+                        help="Hacer el inpaint solo en recortes alrededor de cada región detectada")
+    parser.add_argument("--template-masks", action="store_true",
+                        help="Reutilizar en cada PDF las máscaras de líneas azules y sellos fijos aprendidas "
+                             "en las primeras páginas")
+    parser.add_argument("--triage", action="store_true",
+                        help="Revisar antes una miniatura de cada página y no limpiar las que no tienen nada que remover")
+    parser.add_argument("--gray", dest="gray_pages", action="store_true",
+                        help="Limpiar en gris (un solo canal) las páginas sin color, con solo los detectores "
+                             "que no dependen del color, y escribirlas en gris o bilevel")
+    parser.add_argument("--smoothing", choices=SMOOTHING_MODES, default=CleaningOptions.smoothing,
+                        help="Suavizado final: 'bilateral' en toda la página, 'band' solo alrededor de lo "
+                             "rellenado u 'off' (por defecto: %(default)s)")
+    parser.add_argument("--cache-dir", nargs="?", const=default_cache_dir(), default=None,
+                        help="Guardar las páginas limpias en una caché en disco y reutilizarlas al repetir "
+                             f"documentos; sin valor usa {default_cache_dir()}")
+    parser.add_argument("--cache-size", dest="cache_max_mb", type=int, default=CleaningOptions.cache_max_mb,
+                        help="Tamaño máximo de la caché en MB (por defecto: %(default)s)")
+    parser.add_argument("--journal-dir", nargs="?", const=default_journal_dir(), default=None,
+                        help="Guardar cada página de los PDF en un diario en cuanto está escrita, para que "
+                             "un trabajo interrumpido se reanude donde se quedó al relanzarlo; sin valor usa "
+                             f"{default_journal_dir()}")
+    parser.add_argument("--detection-scale", type=float, default=CleaningOptions.detection_scale,
+                        help="Escala de la copia reducida en la que se buscan los sellos circulares, p. ej. 0.5 (por defecto: %(default)s)")
+    parser.add_argument("--scale", dest="render_scale", type=float, default=CleaningOptions.render_scale,
+                        help="Zoom al rasterizar páginas de PDF (por defecto: %(default)s)")
+    parser.add_argument("--dpi", dest="target_dpi", type=int, default=CleaningOptions.target_dpi,
+                        help="Resolución de render en ppp; sustituye a --scale (p. ej. 200)")
+    parser.add_argument("--max-megapixels", dest="max_page_megapixels", type=float,
+                        default=CleaningOptions.max_page_megapixels,
+                        help="Megapíxeles como máximo por página; las más grandes se renderizan a menos "
+                             "resolución; 0 = sin límite (por defecto: %(default)s)")
+    parser.add_argument("--tile-size", type=int, default=CleaningOptions.tile_size, metavar="PX",
+                        help="Limpiar las páginas de más de PX píxeles de lado por teselas de ese tamaño, "
+                             "para que la memoria dependa de la tesela y no de la página; 0 = nunca")
+    parser.add_argument("--tile-threads", type=int, default=CleaningOptions.tile_threads,
+                        help="Teselas que se limpian a la vez en cada página (por defecto: %(default)s)")
+    parser.add_argument("--page-time-limit", type=float, default=CleaningOptions.page_time_limit,
+                        metavar="SEG",
+                        help="Segundos como máximo por página: pasado el plazo se saltan los detectores que "
+                             "falten y el suavizado final, y la página se marca; 0 = sin límite")
+    parser.add_argument("--encoder", dest="page_encoder", choices=ENCODERS, default=CleaningOptions.page_encoder,
+                        help="Codificación de las páginas de salida; 'auto' la elige por página (por defecto: %(default)s)")
+    parser.add_argument("--jpeg-quality", type=int, default=CleaningOptions.jpeg_quality,
+                        help="Calidad JPEG para 'jpeg' y para el fondo de 'mrc' (por defecto: %(default)s)")
+    parser.add_argument("--output-mode", choices=OUTPUT_MODES, default=CleaningOptions.output_mode,
+                        help="'patch' conserva las páginas del PDF original y pega solo las zonas limpiadas "
+                             "(por defecto: %(default)s)")
+    parser.add_argument("--output-name", default=CleaningOptions.output_name, metavar="PATRÓN",
+                        help="Nombre del PDF limpio de cada entrada; {stem} es el nombre de la entrada sin "
+                             "extensión y {ext} su extensión (por defecto: %(default)s)")
+    parser.add_argument("--file-workers", type=int, default=CleaningOptions.file_workers,
+                        help="Archivos que se limpian a la vez; comparten los procesos de -j "
+                             "(por defecto: %(default)s)")
+    parser.add_argument("--encode-threads", type=int, default=CleaningOptions.encode_threads,
+                        help="Hilos para codificar páginas en paralelo (por defecto: %(default)s)")
+    parser.add_argument("-j", "--workers", type=int, default=CleaningOptions.workers,
+                        help="Procesos para limpiar páginas en paralelo; 0 usa todos los núcleos (por defecto: %(default)s)")
+    parser.add_argument("--opencv-threads", type=int, default=CleaningOptions.opencv_threads,
+                        help="Hilos internos de OpenCV por proceso (por defecto: %(default)s)")
+    parser.add_argument("--max-inflight", dest="max_inflight_pages", type=int,
+                        default=CleaningOptions.max_inflight_pages,
+                        help="Páginas pendientes como máximo en el pool; 0 usa el doble de procesos")
+    parser.add_argument("--memory-budget", dest="memory_budget_mb", type=int,
+                        default=CleaningOptions.memory_budget_mb, metavar="MB",
+                        help="Memoria estimada como máximo para las páginas en vuelo en el pool; 0 = sin límite")
+    parser.add_argument("--metrics", dest="metrics_path", metavar="ARCHIVO",
+                        help="Guardar métricas por página (tiempos por etapa, cobertura de las máscaras, "
+                             "memoria) como líneas JSON")
+    parser.add_argument("--metrics-prom", dest="prometheus_path", metavar="ARCHIVO",
+                        help="Guardar los totales de las métricas en formato de texto de Prometheus")
+    parser.add_argument("--profile-page", type=int, default=CleaningOptions.profile_page, metavar="N",
+                        help="Perfilar con cProfile y tracemalloc la página N de cada archivo")
+    parser.add_argument("--profile-output", default=CleaningOptions.profile_output, metavar="PREFIJO",
+                        help="Prefijo de los archivos del perfil (por defecto: %(default)s)")
+
+
+def options_from_args(args):
+    """Construir CleaningOptions a partir de los argumentos de línea de comandos"""
+    return CleaningOptions(
+        remove_blue_lines=args.remove_blue_lines,
+        remove_seals=args.remove_seals,
+        remove_signatures=args.remove_signatures,
+        fused_masks=args.fused_masks,
+        region_inpaint=args.region_inpaint,
+        template_masks=args.template_masks,
+        triage=args.triage,
+        gray_pages=args.gray_pages,
+        smoothing=args.smoothing,
+        cache_dir=args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        journal_dir=args.journal_dir,
+        detection_scale=args.detection_scale,
+        render_scale=args.render_scale,
+        target_dpi=args.target_dpi,
+        max_page_megapixels=args.max_page_megapixels,
+        tile_size=args.tile_size,
+        tile_threads=args.tile_threads,
+        page_time_limit=args.page_time_limit,
+        workers=args.workers,
+        opencv_threads=args.opencv_threads,
+        max_inflight_pages=args.max_inflight_pages,
+        memory_budget_mb=args.memory_budget_mb,
+        page_encoder=args.page_encoder,
+        jpeg_quality=args.jpeg_quality,
+        encode_threads=args.encode_threads,
+        output_mode=args.output_mode,
+        output_name=args.output_name,
+        file_workers=args.file_workers,
+        metrics_path=args.metrics_path,
+        prometheus_path=args.prometheus_path,
+        profile_page=args.profile_page,
+        profile_output=args.profile_output,
+    )
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def check_output_name(parser, pattern):
+    """Rechazar un --output-name que no se puede formatear"""
+    try:
+        pattern.format(stem="documento", ext="pdf")
+    except (KeyError, ValueError, IndexError) as e:
+        parser.error(f"--output-name no válido ({e!r}); solo admite {{stem}} y {{ext}}")
+
+
+def watch(args, options, events):
+    """Modo --watch: limpiar lo que llegue a la carpeta hasta Ctrl+C o SIGTERM"""
+    from .watch import FolderWatcher
+
+    watcher = FolderWatcher(args.watch, args.output_dir, options, events=events,
+                            interval=args.watch_interval, settle=args.settle_seconds,
+                            done_dir=args.done_dir, failed_dir=args.failed_dir)
+    signal.signal(signal.SIGTERM, _interrupt)
+    print(f"Vigilando {args.watch} (Ctrl+C para terminar)")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    failed = [r for r in watcher.results if not r.ok]
+    print(f"{len(watcher.results) - len(failed)}/{len(watcher.results)} archivo(s) limpiados")
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if not args.inputs and not args.watch:
+        parser.error("indica archivos de entrada o una carpeta con --watch")
+    if args.watch and args.inputs:
+        parser.error("--watch no admite archivos de entrada")
+    if args.watch and not os.path.isdir(args.watch):
+        parser.error(f"--watch: no existe la carpeta {args.watch}")
+    if args.watch and os.path.abspath(args.watch) == os.path.abspath(args.output_dir):
+        parser.error("--watch: la carpeta de salida no puede ser la carpeta vigilada")
+    check_output_name(parser, args.output_name)
+    options = options_from_args(args)
+    events = ProgressLog() if args.progress else None
+    if args.watch:
+        return watch(args, options, events)
+
+    # El motor (OpenCV, PyMuPDF, NumPy) se carga solo cuando hay algo que
+    # limpiar: --help y los errores de argumentos responden al instante
+    from .engine import clean_batch
+
+    results = clean_batch(args.inputs, args.output_dir, options, events=events)
+    if not results:
+        print("No se encontraron archivos soportados")
+        return 2
+
+    failed = [r for r in results if not r.ok]
+    for result in results:
+        if result.ok:
+            details = f"{result.pages} páginas"
+            if result.skipped_pages:
+                details += f", {result.skipped_pages} sin nada que limpiar"
+            if result.cached_pages:
+                details += f", {result.cached_pages} de la caché"
+            if result.resumed_pages:
+                details += f", {result.resumed_pages} del diario"
+            if result.timed_out_pages:
+                details += f", {result.timed_out_pages} a medias por tiempo"
+            print(f"✅ {result.input_path} -> {result.output_path} ({details})")
+        else:
+            print(f"❌ {result.input_path}: {result.error}")
+
+    total_pages = sum(r.pages for r in results)
+    summary = f"{len(results) - len(failed)}/{len(results)} archivo(s) limpiados, {total_pages} páginas"
+    if options.triage:
+        summary += f", {sum(r.skipped_pages for r in results)} omitidas por el triage"
+    if options.cache_dir:
+        summary += f", {sum(r.cached_pages for r in results)} recuperadas de la caché"
+    if options.journal_dir:
+        summary += f", {sum(r.resumed_pages for r in results)} recuperadas del diario"
+    if options.page_time_limit:
+        summary += f", {sum(r.timed_out_pages for r in results)} a medias por tiempo"
+    print(summary)
+    return 1 if failed else 0
@@ -0,0 +1,136 @@
+import io
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from .options import ENCODERS  # noqa: F401 (se importaba desde aquí)
+
+# Umbrales de la elección automática, medidos sobre una miniatura de la página
+COLOR_JPEG_FRACTION = 0.02     # más color que esto: fotografía o página a color
+COLOR_BILEVEL_FRACTION = 0.001
+MIDTONE_BILEVEL_FRACTION = 0.04
+# Para G4 el umbral de Otsu tiene que quedar cerca del gris medio y lo que deja
+# en negro tiene que ser sobre todo tinta: en una página con solo trazos
+# claros, o con el relleno gris de un inpaint, Otsu cae por encima de 190 y
+# esos grises salen como manchas negras
+OTSU_BILEVEL_MAX_DISTANCE = 64
+INK_LEVEL = 96
+INK_BILEVEL_SHARE = 0.6
+# Factor de reducción del fondo en modo MRC
+MRC_BACKGROUND_SCALE = 0.5
+
+
+@dataclass
+class EncodedPage:
+    """Página lista para insertar en el PDF
+
+    `image` es un stream que PyMuPDF inserta tal cual (PNG o JPEG; en MRC, el
+    fondo) y `g4` son datos CCITT G4 crudos (la página en bilevel o, en MRC,
+    la máscara del texto).
+    """
+    width: int
+    height: int
+    kind: str
+    image: bytes = None
+    g4: bytes = None
+
+
+def _gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def binarize(img):
+    """Umbral de Otsu: texto en 0, papel en 255"""
+    return cv2.threshold(_gray(img), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1]
+
+
+def g4_bytes(bilevel):
+    """Comprimir una imagen 0/255 a CCITT G4 y devolver el stream crudo"""
+    # Pillow solo hace falta para G4: se carga aquí y no al importar el módulo
+    from PIL import Image
+
+    height = bilevel.shape[0]
+    buf = io.BytesIO()
+    # Una sola tira (RowsPerStrip = alto) para que el stream sea un único bloque G4
+    Image.fromarray(bilevel).convert('1').save(buf, 'TIFF', compression='group4',
+                                               tiffinfo={278: height})
+    tiff = Image.open(buf)
+    offset = tiff.tag_v2[273][0]
+    length = tiff.tag_v2[279][0]
+    return buf.getvalue()[offset:offset + length]
+
+
+def encode_png(img):
+    success, data = cv2.imencode('.png', img)
+    if not success:
+        raise ValueError("no se pudo codificar la página como PNG")
+    return EncodedPage(img.shape[1], img.shape[0], 'png', image=data.tobytes())
+
+
+def encode_jpeg(img, quality):
+    success, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("no se pudo codificar la página como JPEG")
+    return EncodedPage(img.shape[1], img.shape[0], 'jpeg', image=data.tobytes())
+
+
+def encode_g4(img):
+    return EncodedPage(img.shape[1], img.shape[0], 'g4', g4=g4_bytes(binarize(img)))
+
+
+def encode_mrc(img, quality):
+    """Texto como máscara G4 nítida sobre un fondo JPEG a menor resolución"""
+    gray = _gray(img)
+    threshold, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Solo lo claramente oscuro es texto; el resto queda en el fondo
+    text = gray < min(threshold, 160)
+    foreground = np.where(text, 0, 255).astype(np.uint8)
+
+    # Borrar el texto del fondo con un filtro de máximo antes de reducirlo
+    background = cv2.dilate(img, np.ones((7, 7), np.uint8))
+    background = cv2.resize(background, None, fx=MRC_BACKGROUND_SCALE, fy=MRC_BACKGROUND_SCALE,
+                            interpolation=cv2.INTER_AREA)
+    success, data = cv2.imencode('.jpg', background, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not success:
+        raise ValueError("no se pudo codificar el fondo MRC")
+    return EncodedPage(img.shape[1], img.shape[0], 'mrc', image=data.tobytes(),
+                       g4=g4_bytes(foreground))
+
+
+def choose_encoder(img):
+    """Elegir el codificador de una página según su contenido"""
+    gray = _gray(img)
+    hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+    midtones = hist[64:192].sum()
+    threshold, _ = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    black = hist[:int(threshold)].sum()
+    ink_share = hist[:INK_LEVEL].sum() / black if black else 1.0
+    binarizes = (abs(threshold - 128) <= OTSU_BILEVEL_MAX_DISTANCE and ink_share >= INK_BILEVEL_SHARE)
+
+    colored = 0.0
+    if img.ndim == 3:
+        small = cv2.resize(img, None, fx=0.25, fy=0.25, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        colored = np.count_nonzero((hsv[..., 1] > 60) & (hsv[..., 2] > 60)) / hsv[..., 0].size
+
+    if colored > COLOR_JPEG_FRACTION:
+        return 'jpeg'
+    if colored <= COLOR_BILEVEL_FRACTION and midtones <= MIDTONE_BILEVEL_FRACTION and binarizes:
+        return 'g4'
+    return 'mrc'
+
+
+def encode_page(img, options):
+    """Codificar una página con el codificador de las opciones (o el elegido en 'auto')"""
+    kind = options.page_encoder
+    if kind == 'auto':
+        kind = choose_encoder(img)
+
+    if kind == 'jpeg':
+        return encode_jpeg(img, options.jpeg_quality)
+    if kind == 'g4':
+        return encode_g4(img)
+    if kind == 'mrc':
+        return encode_mrc(img, options.jpeg_quality)
+    return encode_png(img)
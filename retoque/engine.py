@@ -0,0 +1,718 @@
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+
+import cv2
+import fitz  # PyMuPDF
+
+from .budget import Cancelled, current_budget, page_budget, raise_if_cancelled
+from .cache import PageCache
+from .journal import JobJournal
+from .metrics import MetricsRecorder, measure_page, stage
+from .options import CleaningOptions
+from .patches import PdfPatchWriter, extract_patches
+from .progress import BATCH_DONE, FILE_DONE, FILE_STARTED, ProgressEvent, page_done_event
+from .render import page_memory_bytes, render_page, render_thumbnail
+from .templates import document_template, start_document
+from .tiles import clean_image_tiled
+from .triage import is_gray, thumbnail, triage_page
+from .writer import PdfPageWriter
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS + ('.pdf',)
+
+# Estado de cada página procesada
+PAGE_CLEANED = 'cleaned'     # limpiada
+PAGE_CACHED = 'cached'       # limpia, recuperada de la caché en disco
+PAGE_SKIPPED = 'skipped'     # el triage no encontró nada que limpiar
+PAGE_ORIGINAL = 'original'   # la limpieza falló y se conserva la imagen original
+PAGE_RESUMED = 'resumed'     # ya estaba en el diario de un trabajo interrumpido
+PAGE_TIMED_OUT = 'timed_out' # agotó options.page_time_limit y se saltaron etapas
+
+# Error de los archivos que no se terminaron porque se canceló el trabajo
+CANCELLED_ERROR = "Cancelado"
+
+
+@dataclass
+class FileResult:
+    """Resultado de limpiar un archivo de entrada en modo lote"""
+    input_path: str
+    output_path: str = None
+    pages: int = 0
+    skipped_pages: int = 0
+    cached_pages: int = 0
+    resumed_pages: int = 0
+    timed_out_pages: int = 0
+    error: str = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# Cachés de páginas abiertas en este proceso, por directorio
+_page_caches = {}
+_page_caches_lock = threading.Lock()
+
+
+def page_cache_for(options):
+    """Caché de páginas configurada en las opciones, o None si está desactivada"""
+    if not options.cache_dir:
+        return None
+    with _page_caches_lock:
+        cache = _page_caches.get(options.cache_dir)
+        if cache is None:
+            cache = PageCache(options.cache_dir, options.cache_max_mb * 1024 * 1024)
+            _page_caches[options.cache_dir] = cache
+    return cache
+
+
+def clean_image_cached(img, options, template=None):
+    """clean_image consultando antes la caché de páginas
+
+    Las páginas más grandes que options.tile_size se limpian por teselas.
+    Devuelve (resultado, máscara, estado); el estado es PAGE_CACHED si la
+    página ya estaba en la caché, PAGE_ORIGINAL si la limpieza falló y
+    PAGE_TIMED_OUT si se agotó su tiempo y quedó a medias (entonces no se
+    guarda en la caché).
+    """
+    cache = page_cache_for(options)
+    if cache is not None:
+        with stage('cache'):
+            key = cache.key(img, options)
+            entry = cache.get(key)
+        if entry is not None:
+            return entry[0], entry[1], PAGE_CACHED
+
+    cleaned_img, mask = clean_image_tiled(img, options, template)
+    if cleaned_img is None:
+        return None, None, PAGE_ORIGINAL
+    budget = current_budget()
+    if budget is not None and budget.skipped:
+        return cleaned_img, mask, PAGE_TIMED_OUT
+
+    if cache is not None:
+        try:
+            with stage('cache'):
+                cache.put(key, cleaned_img, mask)
+        except Exception as e:
+            print(f"Error guardando en la caché: {e}")
+    return cleaned_img, mask, PAGE_CLEANED
+
+
+def clean_loaded_page(img, options, thumb=None, template=None):
+    """Limpiar una página ya rasterizada; devuelve (imagen, estado)
+
+    Con options.triage se decide antes sobre una miniatura (`thumb`, o una
+    reducción de la propia imagen) qué detectores pueden encontrar algo; si
+    ninguno puede, la página pasa tal cual. `template` es la MaskTemplate
+    del documento al que pertenece la página, si la hay.
+    """
+    if options.triage:
+        with stage('triage'):
+            options = triage_page(thumbnail(img) if thumb is None else thumb, options)
+        if options is None:
+            return img, PAGE_SKIPPED
+
+    cleaned_img, _, status = clean_image_cached(img, options, template)
+    if cleaned_img is None:
+        return img, PAGE_ORIGINAL
+    return cleaned_img, status
+
+
+def _clean_image_file(image_path, options):
+    with stage('decode'):
+        img = cv2.imread(image_path)
+        if img is not None and options.gray_pages and is_gray(thumbnail(img)):
+            img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    if img is None:
+        return None, PAGE_ORIGINAL
+    return clean_loaded_page(img, options)
+
+
+def clean_document(image_path, options):
+    """Limpieza para archivos de imagen individuales"""
+    try:
+        img, status = _clean_image_file(image_path, options)
+        return None if status == PAGE_ORIGINAL else img
+    except Exception as e:
+        print(f"Error en clean_document: {e}")
+        return None
+
+
+def _document_template(doc, options):
+    return document_template(doc.name) if options.template_masks else None
+
+
+def _page_thumbnail(page, options):
+    """Miniatura de la página si el triage o options.gray_pages la necesitan"""
+    return render_thumbnail(page, options) if options.triage or options.gray_pages else None
+
+
+def _renders_gray(thumb, options):
+    """¿Se rasteriza la página en gris? Solo con options.gray_pages y sin color en la miniatura"""
+    return options.gray_pages and is_gray(thumb)
+
+
+def clean_pdf_page(doc, page_num, options):
+    """Renderizar y limpiar una página; devuelve (imagen, estado) o (None, PAGE_ORIGINAL)"""
+    page = doc[page_num]
+    with stage('render'):
+        thumb = _page_thumbnail(page, options)
+        img = render_page(page, options, gray=_renders_gray(thumb, options))
+    if img is None:
+        return None, PAGE_ORIGINAL
+    return clean_loaded_page(img, options, thumb, _document_template(doc, options))
+
+
+def clean_pdf_page_patches(doc, page_num, options):
+    """Renderizar y limpiar una página; devuelve (parches, estado) o (None, PAGE_ORIGINAL)
+
+    Solo viajan los recortes limpios, no la página entera. Si el triage
+    descarta la página, ni siquiera se renderiza a resolución completa.
+    """
+    page = doc[page_num]
+    with stage('render'):
+        thumb = _page_thumbnail(page, options)
+    if options.triage:
+        with stage('triage'):
+            options = triage_page(thumb, options)
+        if options is None:
+            return [], PAGE_SKIPPED
+
+    with stage('render'):
+        img = render_page(page, options, gray=_renders_gray(thumb, options))
+    if img is None:
+        return None, PAGE_ORIGINAL
+
+    cleaned_img, mask, status = clean_image_cached(img, options, _document_template(doc, options))
+    if cleaned_img is None:
+        return [], PAGE_ORIGINAL
+    with stage('encode'):
+        patches = extract_patches(cleaned_img, mask, options)
+    return patches, status
+
+
+def run_page_function(page_function, doc, page_num, options, cancel=None):
+    """Ejecutar `page_function` midiendo la página; devuelve (resultado, estado, PageMetrics)
+
+    La página tiene options.page_time_limit segundos y, entre etapas, se
+    comprueba `cancel` (un threading.Event; en los procesos del pool no hay).
+    """
+    with measure_page(doc.name, page_num, options) as metrics, page_budget(options, cancel) as budget:
+        result, status = page_function(doc, page_num, options)
+    metrics.status = status
+    metrics.skipped_stages = budget.skipped
+    return result, status, metrics
+
+
+# Documento abierto en cada proceso del pool, reutilizado entre las páginas
+# de una misma pasada por el archivo
+_worker_doc = None
+_worker_doc_run = None
+
+
+def _init_page_worker(opencv_threads):
+    """Inicializar un proceso del pool limitando los hilos internos de OpenCV"""
+    cv2.setNumThreads(opencv_threads)
+
+
+def _clean_pdf_page_in_worker(page_function, pdf_path, page_num, options, run_id=None):
+    """Limpiar una página dentro de un proceso del pool
+
+    `run_id` identifica la pasada de iter_pdf_pages: en otra, aunque el
+    camino sea el mismo, el archivo se vuelve a abrir (puede ser otro) y la
+    plantilla del documento empieza de cero.
+    """
+    global _worker_doc, _worker_doc_run
+    if _worker_doc_run != (pdf_path, run_id):
+        if _worker_doc is not None:
+            _worker_doc.close()
+        _worker_doc = fitz.open(pdf_path)
+        _worker_doc_run = (pdf_path, run_id)
+        if options.template_masks:
+            start_document(_worker_doc.name)
+    return run_page_function(page_function, _worker_doc, page_num, options)
+
+
+def resolve_workers(options):
+    """Número de procesos a usar; 0 o None significa todos los núcleos"""
+    return options.workers or os.cpu_count() or 1
+
+
+def create_page_pool(options):
+    """Crear un pool de procesos para limpiar páginas en paralelo"""
+    # "spawn" evita hacer fork de un proceso con hilos activos (p. ej. el de Tk)
+    return ProcessPoolExecutor(max_workers=resolve_workers(options),
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_page_worker,
+                               initargs=(options.opencv_threads,))
+
+
+def _warm_up_worker(delay):
+    # Ocupar el proceso un momento para que el pool arranque todos los demás
+    time.sleep(delay)
+    return os.getpid()
+
+
+def warm_up_pool(pool, workers, delay=0.2):
+    """Arrancar de antemano todos los procesos del pool (importan OpenCV y PyMuPDF al nacer)"""
+    futures = [pool.submit(_warm_up_worker, delay) for _ in range(workers)]
+    return {future.result() for future in futures}
+
+
+def _bounded_page_tasks(pool, page_function, pdf_path, page_nums, options, page_bytes=None, run_id=None):
+    """Enviar las páginas `page_nums` al pool manteniendo como máximo max_inflight_pages en vuelo
+
+    Con options.memory_budget_mb, además, la memoria estimada de las páginas
+    en vuelo (`page_bytes`, una cifra por página del documento) no pasa del presupuesto.
+    Una página que por sí sola lo supera se procesa igualmente, pero sin
+    ninguna otra en vuelo.
+    """
+    max_inflight = options.max_inflight_pages or 2 * resolve_workers(options)
+    budget = options.memory_budget_mb * 1024 * 1024 if page_bytes else 0
+    pending = deque()
+    inflight_bytes = 0
+    next_index = 0
+    try:
+        while next_index < len(page_nums) or pending:
+            while next_index < len(page_nums) and len(pending) < max_inflight:
+                page_num = page_nums[next_index]
+                cost = page_bytes[page_num] if budget else 0
+                if pending and inflight_bytes + cost > budget:
+                    break
+                pending.append((pool.submit(_clean_pdf_page_in_worker, page_function,
+                                            pdf_path, page_num, options, run_id), cost))
+                inflight_bytes += cost
+                next_index += 1
+            future, cost = pending.popleft()
+            inflight_bytes -= cost
+            yield future.result
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+def iter_pdf_pages(pdf_path, options, pool=None, page_function=clean_pdf_page, resumed=(), cancel=None):
+    """Renderizar y limpiar las páginas de un PDF, entregándolas en orden
+
+    Genera tuplas (page_num, total_pages, imagen, estado, métricas), con estado
+    PAGE_CLEANED, PAGE_CACHED, PAGE_SKIPPED o PAGE_ORIGINAL. Las páginas de
+    `resumed` (las que ya están en el diario del trabajo) no se limpian: se
+    entregan sin imagen ni métricas y con estado PAGE_RESUMED. Si se activa
+    `cancel` (un threading.Event) se lanza Cancelled antes de la página
+    siguiente o, sin pool, entre las etapas de la página en curso; con pool,
+    las páginas en espera se descartan y la que ya se estaba limpiando
+    termina como mucho en options.page_time_limit. La imagen es None si la
+    página no se pudo renderizar; las métricas son el PageMetrics de la
+    página, o None si falló. Con un pool, cada proceso abre el
+    documento y renderiza sus propias páginas, y nunca hay más de
+    options.max_inflight_pages páginas pendientes en memoria (ni más de
+    options.memory_budget_mb de memoria estimada, si se fija).
+    `page_function(doc, page_num, options)` hace el trabajo de cada página
+    (p. ej. clean_pdf_page_patches, que entrega parches en vez de la imagen).
+    """
+    doc = fitz.open(pdf_path)
+    total_pages = len(doc)
+    own_pool = None
+    page_tasks = None
+
+    print(f"Procesando PDF con {total_pages} páginas...")
+
+    try:
+        page_nums = [page_num for page_num in range(total_pages) if page_num not in resumed]
+        if resumed:
+            print(f"{total_pages - len(page_nums)} páginas ya estaban hechas; se reanuda el trabajo")
+        if pool is None and resolve_workers(options) > 1 and len(page_nums) > 1:
+            pool = own_pool = create_page_pool(options)
+
+        if pool is not None:
+            page_bytes = None
+            if options.memory_budget_mb:
+                page_bytes = [page_memory_bytes(doc[page_num], options) for page_num in range(total_pages)]
+            doc.close()
+            page_tasks = _bounded_page_tasks(pool, page_function, pdf_path, page_nums, options, page_bytes,
+                                             uuid.uuid4().hex)
+        else:
+            if options.template_masks:
+                # Cada pasada por el archivo aprende su propia plantilla
+                start_document(doc.name)
+            page_tasks = (partial(run_page_function, page_function, doc, page_num, options, cancel)
+                          for page_num in page_nums)
+
+        for page_num in range(total_pages):
+            if page_num in resumed:
+                yield page_num, total_pages, None, PAGE_RESUMED, None
+                continue
+            raise_if_cancelled(cancel)
+            page_task = next(page_tasks)
+            try:
+                img, status, metrics = page_task()
+                if img is None:
+                    print(f"Error en página {page_num + 1}: no se pudo renderizar")
+                elif status == PAGE_CLEANED:
+                    print(f"Página {page_num + 1} procesada correctamente")
+                elif status == PAGE_CACHED:
+                    print(f"Página {page_num + 1} recuperada de la caché")
+                elif status == PAGE_SKIPPED:
+                    print(f"Página {page_num + 1} sin nada que limpiar (triage)")
+                elif status == PAGE_TIMED_OUT:
+                    print(f"Página {page_num + 1} limpiada a medias: se agotó su tiempo "
+                          f"(se saltó {', '.join(metrics.skipped_stages)})")
+                else:
+                    print(f"Página {page_num + 1} procesada con imagen original")
+            except BrokenProcessPool:
+                # Los procesos murieron (p. ej. con Ctrl-C): no quedan páginas que limpiar
+                raise
+            except Exception as e:
+                print(f"Error en página {page_num + 1}: {e}")
+                img, status, metrics = None, PAGE_ORIGINAL, None
+
+            yield page_num, total_pages, img, status, metrics
+            img = None
+
+    finally:
+        if page_tasks is not None:
+            # Descartar ya las páginas que esperaban en el pool
+            page_tasks.close()
+        if not doc.is_closed:
+            doc.close()
+        if own_pool is not None:
+            own_pool.shutdown(cancel_futures=True)
+
+
+def process_pdf(pdf_path, options, progress=None, pool=None):
+    """Procesar PDF: extraer páginas, limpiar y devolverlas en orden"""
+    try:
+        processed_images = []
+        for page_num, total_pages, img, _, _ in iter_pdf_pages(pdf_path, options, pool):
+            if img is not None:
+                processed_images.append(img)
+            if progress is not None:
+                progress(page_num + 1, total_pages)
+
+        print(f"Procesamiento completado. {len(processed_images)} páginas listas.")
+        return processed_images
+
+    except Exception as e:
+        print(f"Error procesando PDF: {e}")
+        return []
+
+
+def process_file(file_path, options, progress=None, pool=None):
+    """Limpiar un PDF o una imagen y devolver la lista de páginas limpias"""
+    if Path(file_path).suffix.lower() == '.pdf':
+        return process_pdf(file_path, options, progress, pool)
+
+    cleaned_img = clean_document(file_path, options)
+    return [cleaned_img] if cleaned_img is not None else []
+
+
+def _open_journal(pdf_path, writer, options):
+    """Diario del trabajo sobre `pdf_path`, entregado al writer, que lo borra al cerrar bien el PDF"""
+    journal = JobJournal.for_file(pdf_path, options)
+    if journal is not None:
+        writer.journals.append(journal)
+    return journal
+
+
+def _load_resumed(journal, pdf_path, page_num, options, page_function, cancel=None):
+    """Lo guardado en el diario para una página, o la página limpia de nuevo si no se puede leer
+
+    Devuelve (guardado, resultado, estado, métricas): lo guardado es None si
+    la página se ha vuelto a limpiar, y entonces el resto es lo que devuelve
+    run_page_function.
+    """
+    try:
+        return journal.load(page_num), None, PAGE_RESUMED, None
+    except Exception as e:
+        print(f"Página {page_num + 1}: no se pudo leer del diario ({e}); se vuelve a limpiar")
+    journal.forget(page_num)
+    with fitz.open(pdf_path) as doc:
+        return (None,) + run_page_function(page_function, doc, page_num, options, cancel)
+
+
+def _discount_failed_pages(writer, page_counts, failed_before):
+    """Esperar a las páginas que el writer codifica en hilos y descontar las que fallaron
+
+    Devuelve cuántas fallaron desde `failed_before` (el writer.failed_pages
+    de antes de empezar), que add_page ya había dado por añadidas.
+    """
+    writer.wait_encoded()
+    failed = writer.failed_pages - failed_before
+    for status, count in failed.items():
+        if status is not None:
+            page_counts[status] -= count
+    return sum(failed.values())
+
+
+def clean_file_to_writer(file_path, writer, options, progress=None, pool=None, page_counts=None,
+                         events=None, cancel=None):
+    """Limpiar un PDF o una imagen escribiendo cada página en cuanto está lista
+
+    Devuelve el número de páginas escritas, sin las que el writer no pudo
+    codificar. Ninguna página limpia se guarda en memoria más allá de las
+    que están en vuelo. Con options.journal_dir
+    cada página de un PDF queda además en el diario del trabajo (JobJournal)
+    y, si el trabajo se había interrumpido, las que ya estaban se copian de
+    ahí sin volver a limpiarlas (una que no se pueda leer se limpia otra
+    vez). Un error a mitad del documento, fuera de una página concreta, se
+    propaga: el PDF quedaría incompleto, así que quien llama descarta el
+    writer y el diario se conserva para reanudar. Si se pasa un Counter en
+    `page_counts`, se suma en él el estado de cada página escrita. Con
+    `events` (un ProgressChannel, ProgressLog o cualquier objeto con
+    publish()) se publican FILE_STARTED y un PAGE_DONE por página. Si se
+    activa `cancel` (un threading.Event) se lanza Cancelled.
+    """
+    if page_counts is None:
+        page_counts = Counter()
+    started = time.monotonic()
+    failed_before = Counter(writer.failed_pages)
+    if events is not None:
+        events.publish(ProgressEvent(FILE_STARTED, str(file_path)))
+
+    if Path(file_path).suffix.lower() != '.pdf':
+        try:
+            with measure_page(file_path, 0, options) as metrics, page_budget(options, cancel) as budget:
+                cleaned_img, status = _clean_image_file(file_path, options)
+            metrics.status = status
+            metrics.skipped_stages = budget.skipped
+        except Exception as e:
+            print(f"Error procesando imagen: {e}")
+            return 0
+        if status == PAGE_ORIGINAL or not writer.add_page(cleaned_img, metrics):
+            return 0
+        page_counts[status] += 1
+        if _discount_failed_pages(writer, page_counts, failed_before):
+            return 0
+        if events is not None:
+            events.publish(page_done_event(file_path, 0, 1, status, metrics, started))
+        return 1
+
+    pages = 0
+    journal = _open_journal(file_path, writer, options)
+    resumed = set(journal.pages) if journal is not None else ()
+    for page_num, total_pages, img, status, metrics in iter_pdf_pages(file_path, options, pool,
+                                                                      resumed=resumed, cancel=cancel):
+        encoded = None
+        if status == PAGE_RESUMED:
+            encoded, img, status, metrics = _load_resumed(journal, file_path, page_num, options,
+                                                          clean_pdf_page, cancel)
+        if encoded is not None:
+            added = writer.add_encoded(encoded)
+        else:
+            added = img is not None and writer.add_page(img, metrics, journal, page_num)
+        if added:
+            pages += 1
+            page_counts[status] += 1
+        # Soltar la referencia antes de esperar la página siguiente
+        img = None
+        if progress is not None:
+            progress(page_num + 1, total_pages)
+        if events is not None:
+            events.publish(page_done_event(file_path, page_num, total_pages, status, metrics, started))
+
+    pages -= _discount_failed_pages(writer, page_counts, failed_before)
+    print(f"Procesamiento completado. {pages} páginas escritas.")
+    return pages
+
+
+def patch_pdf_to_writer(pdf_path, writer, options, progress=None, pool=None, page_counts=None,
+                        events=None, cancel=None):
+    """Limpiar un PDF pegando solo los recortes limpios sobre sus páginas originales
+
+    Devuelve el número de páginas revisadas; las que fallan quedan como en
+    el original. `page_counts`, `events` y `cancel`, el diario y los errores
+    a mitad del documento funcionan como en clean_file_to_writer.
+    """
+    if page_counts is None:
+        page_counts = Counter()
+    started = time.monotonic()
+    if events is not None:
+        events.publish(ProgressEvent(FILE_STARTED, str(pdf_path)))
+
+    pages = 0
+    journal = _open_journal(pdf_path, writer, options)
+    resumed = set(journal.pages) if journal is not None else ()
+    for page_num, total_pages, patches, status, metrics in iter_pdf_pages(
+            pdf_path, options, pool, page_function=clean_pdf_page_patches, resumed=resumed,
+            cancel=cancel):
+        if status == PAGE_RESUMED:
+            saved, patches, status, metrics = _load_resumed(journal, pdf_path, page_num, options,
+                                                            clean_pdf_page_patches, cancel)
+            if saved is not None:
+                patches = saved
+        if patches is not None:
+            # Lo que venía del diario no se vuelve a anotar; lo limpiado de nuevo, sí
+            writer.add_patches(page_num, patches, metrics, journal)
+            pages += 1
+            page_counts[status] += 1
+        if progress is not None:
+            progress(page_num + 1, total_pages)
+        if events is not None:
+            events.publish(page_done_event(pdf_path, page_num, total_pages, status, metrics, started))
+
+    print(f"Procesamiento completado. {writer.patched_pages} de {pages} páginas con parches.")
+    return pages
+
+
+def collect_input_files(paths):
+    """Expandir directorios y filtrar las extensiones soportadas, sin duplicados"""
+    files = []
+    seen = set()
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            candidates = sorted(p for p in path.rglob('*') if p.is_file())
+        else:
+            candidates = [path]
+
+        for candidate in candidates:
+            if candidate.suffix.lower() not in SUPPORTED_EXTENSIONS:
+                continue
+            key = os.path.abspath(candidate)
+            if key not in seen:
+                seen.add(key)
+                files.append(str(candidate))
+    return files
+
+
+def output_name_for(input_path, pattern=CleaningOptions.output_name):
+    """Nombre del PDF limpio de un archivo de entrada según el patrón de options.output_name"""
+    path = Path(input_path)
+    return pattern.format(stem=path.stem, ext=path.suffix.lstrip('.'))
+
+
+def output_path_for(input_path, output_dir, taken=(), pattern=CleaningOptions.output_name):
+    """Ruta del PDF limpio correspondiente a un archivo de entrada"""
+    output_path = os.path.join(output_dir, output_name_for(input_path, pattern))
+    if output_path in taken:
+        # "informe.pdf" e "informe.png" no deben pisarse entre sí
+        path = Path(input_path)
+        ext = path.suffix.lstrip('.')
+        stem = f"{path.stem}-{ext}"
+        output_path = os.path.join(output_dir, pattern.format(stem=stem, ext=ext))
+        copy = 2
+        while output_path in taken:
+            output_path = os.path.join(output_dir, pattern.format(stem=f"{stem}-{copy}", ext=ext))
+            copy += 1
+    return output_path
+
+
+def clean_file_to_path(file_path, output_path, options, progress=None, events=None, pool=None,
+                       recorder=None, cancel=None):
+    """Limpiar un archivo y escribir su PDF limpio en `output_path`; devuelve su FileResult
+
+    Con `events` se publican los eventos del archivo y, al final, un
+    FILE_DONE con su resultado. `recorder` es el MetricsRecorder del lote.
+    Si se activa `cancel` (un threading.Event), el PDF a medio escribir se
+    descarta y el resultado lleva CANCELLED_ERROR; el diario del trabajo, si
+    lo hay, se conserva para reanudarlo.
+    """
+    result = FileResult(file_path)
+    if cancel is not None and cancel.is_set():
+        # Cancelado antes de empezar: no se publica nada de este archivo
+        result.error = CANCELLED_ERROR
+        return result
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if options.output_mode == 'patch' and Path(file_path).suffix.lower() == '.pdf':
+        # Conservar las páginas originales y pegar solo lo que se limpió
+        writer = PdfPatchWriter(file_path, output_path, options, recorder=recorder)
+        clean_to_writer = patch_pdf_to_writer
+    else:
+        writer = PdfPageWriter(output_path, options, recorder=recorder)
+        clean_to_writer = clean_file_to_writer
+    page_counts = Counter()
+    try:
+        pages = clean_to_writer(file_path, writer, options, progress, pool, page_counts, events, cancel)
+        if not pages:
+            writer.discard()
+            result.error = "No se pudieron procesar las páginas"
+        elif writer.close():
+            result.output_path = output_path
+            result.pages = pages
+            result.skipped_pages = page_counts[PAGE_SKIPPED]
+            result.cached_pages = page_counts[PAGE_CACHED]
+            result.resumed_pages = page_counts[PAGE_RESUMED]
+            result.timed_out_pages = page_counts[PAGE_TIMED_OUT]
+        else:
+            result.error = "Error al crear el PDF final"
+    except Cancelled:
+        writer.discard()
+        result.error = CANCELLED_ERROR
+    except Exception as e:
+        writer.discard()
+        result.error = f"Error al crear el PDF final: {e}"
+    except BaseException:
+        # Ctrl-C y demás: no dejar el .part en la carpeta de salida
+        writer.discard()
+        raise
+    if events is not None:
+        events.publish(ProgressEvent(FILE_DONE, file_path, pages=result.pages, error=result.error))
+    return result
+
+
+def clean_batch(paths, output_dir, options, progress=None, events=None, pool=None, cancel=None,
+                recorder=None):
+    """Limpiar muchos archivos y escribir un PDF limpio por cada entrada
+
+    Cada PDF se llama según options.output_name dentro de `output_dir`.
+    Con options.file_workers > 1 se limpian varios archivos a la vez, en
+    hilos que comparten el pool de páginas; los resultados se devuelven en
+    el orden de las entradas. Con `events`, además de los eventos de cada
+    archivo se publica un FILE_DONE con su resultado y un BATCH_DONE al
+    terminar. `pool` es un pool de create_page_pool ya arrancado (p. ej. el
+    del servidor de trabajos); sin él se crea uno para el lote si options
+    pide procesos. Al activar `cancel` (un threading.Event) los archivos en
+    curso se detienen en la siguiente comprobación, los que faltan ni se
+    empiezan, todos acaban con CANCELLED_ERROR y el BATCH_DONE lo lleva.
+    `recorder` es un MetricsRecorder ya abierto que sigue sumando entre
+    lotes (p. ej. el del servidor) y que el lote no cierra; sin él se crea
+    uno para el lote según las opciones.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    taken = set()
+    jobs = []
+    for file_path in collect_input_files(paths):
+        output_path = output_path_for(file_path, output_dir, taken, options.output_name)
+        taken.add(output_path)
+        jobs.append((file_path, output_path))
+
+    # Un único pool para todo el lote, así los procesos se arrancan una sola vez
+    own_pool = None
+    if pool is None and resolve_workers(options) > 1 and jobs:
+        pool = own_pool = create_page_pool(options)
+    own_recorder = None
+    if recorder is None:
+        recorder = own_recorder = MetricsRecorder.from_options(options)
+
+    def clean_job(job):
+        file_path, output_path = job
+        return clean_file_to_path(file_path, output_path, options, progress, events, pool, recorder,
+                                  cancel)
+
+    try:
+        if options.file_workers > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=options.file_workers) as files:
+                results = list(files.map(clean_job, jobs))
+        else:
+            results = [clean_job(job) for job in jobs]
+    finally:
+        if own_pool is not None:
+            own_pool.shutdown()
+        if own_recorder is not None:
+            own_recorder.close()
+
+    if events is not None:
+        cancelled = cancel is not None and cancel.is_set()
+        events.publish(ProgressEvent(BATCH_DONE, pages=sum(r.pages for r in results),
+                                     error=CANCELLED_ERROR if cancelled else None))
+    return results
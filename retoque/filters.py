@@ -0,0 +1,464 @@
+import time
+from functools import partial
+
+import cv2
+import numpy as np
+
+from .budget import stage_allowed, stage_fits
+from .metrics import record_coverage, stage
+
+# Radio de vecindad usado por cv2.inpaint en todos los filtros
+INPAINT_RADIUS = 7
+
+
+# Margen alrededor de cada región: todo lo que el inpaint puede leer
+REGION_PADDING = INPAINT_RADIUS + 2
+# Las regiones se agrupan sobre una rejilla reducida de este tamaño de celda
+REGION_CELL = 8
+
+
+def mask_regions(mask, padding=REGION_PADDING):
+    """Agrupar las zonas de la máscara en recortes rectangulares
+
+    Las regiones se agrupan en una versión reducida de la máscara (una celda
+    por REGION_CELL píxeles), ampliada con `padding`. Genera tuplas
+    (x, y, x_end, y_end, owner), donde `owner` marca con 1 las celdas del
+    recorte que pertenecen al grupo, ya a resolución completa.
+    """
+    height, width = mask.shape
+    cell = REGION_CELL
+    grid_w, grid_h = -(-width // cell), -(-height // cell)
+    # Una celda está marcada si contiene al menos un píxel de la máscara
+    grid = cv2.resize(mask, (grid_w, grid_h), interpolation=cv2.INTER_AREA)
+    grid = (grid > 0).astype(np.uint8)
+    pad_cells = -(-padding // cell)
+    grid = cv2.dilate(grid, np.ones((2 * pad_cells + 1, 2 * pad_cells + 1), np.uint8))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(grid, connectivity=8)
+    
+    for label in range(1, count):
+        gx, gy, gw, gh = stats[label, :4]
+        x, y = gx * cell, gy * cell
+        x_end, y_end = min((gx + gw) * cell, width), min((gy + gh) * cell, height)
+        owner = (labels[gy:gy+gh, gx:gx+gw] == label).astype(np.uint8)
+        owner = np.repeat(np.repeat(owner, cell, axis=0), cell, axis=1)[:y_end - y, :x_end - x]
+        yield x, y, x_end, y_end, owner
+
+
+def inpaint_regions(img, mask):
+    """Inpaint solo en recortes alrededor de las regiones de la máscara
+
+    Cada grupo de mask_regions se rellena por separado sobre su propio
+    recorte, así que el coste depende del área dañada y no de la resolución
+    de la página.
+    """
+    result = img.copy()
+    for x, y, x_end, y_end, owner in mask_regions(mask):
+        # Solo la parte de la máscara que pertenece a este grupo
+        crop_mask = cv2.bitwise_and(mask[y:y_end, x:x_end], mask[y:y_end, x:x_end], mask=owner)
+        filled = cv2.inpaint(img[y:y_end, x:x_end], crop_mask, INPAINT_RADIUS, cv2.INPAINT_TELEA)
+        region = crop_mask > 0
+        result[y:y_end, x:x_end][region] = filled[region]
+    
+    return result
+
+
+def inpaint_mask(img, mask, regions=False):
+    """Rellenar las zonas marcadas en la máscara; sin zonas no hay nada que hacer"""
+    if not cv2.countNonZero(mask):
+        return img.copy()
+    if regions:
+        return inpaint_regions(img, mask)
+    return cv2.inpaint(img, mask, INPAINT_RADIUS, cv2.INPAINT_TELEA)
+
+
+# Suavizado final: bilateral de diámetro 5 (lee 2 píxeles alrededor)
+BILATERAL_DIAMETER = 5
+# Con smoothing='band', píxeles alrededor de lo rellenado que se suavizan:
+# lo que el inpaint mezcla con el entorno
+SMOOTHING_BAND = INPAINT_RADIUS
+
+
+def bilateral(img):
+    return cv2.bilateralFilter(img, BILATERAL_DIAMETER, 75, 75)
+
+
+def smooth_band(img, mask):
+    """Bilateral solo en una franja de SMOOTHING_BAND píxeles alrededor de la máscara
+
+    Cada grupo de mask_regions se filtra sobre su propio recorte, con margen
+    suficiente para que los píxeles de la franja salgan igual que con el
+    bilateral de la página entera; el resto de la página no se toca. Si los
+    recortes suman tanto como la página, se filtra la página una sola vez.
+    """
+    result = img.copy()
+    kernel = np.ones((2 * SMOOTHING_BAND + 1, 2 * SMOOTHING_BAND + 1), np.uint8)
+    regions = list(mask_regions(mask, SMOOTHING_BAND + BILATERAL_DIAMETER // 2 + 1))
+    if sum((x_end - x) * (y_end - y) for x, y, x_end, y_end, _ in regions) >= mask.size:
+        cv2.copyTo(bilateral(img), cv2.dilate(mask, kernel), result)
+        return result
+    for x, y, x_end, y_end, owner in regions:
+        crop_mask = cv2.bitwise_and(mask[y:y_end, x:x_end], mask[y:y_end, x:x_end], mask=owner)
+        # copyTo escribe en la vista del recorte, sin índices booleanos
+        cv2.copyTo(bilateral(img[y:y_end, x:x_end]), cv2.dilate(crop_mask, kernel), result[y:y_end, x:x_end])
+    
+    return result
+
+
+def final_smoothing(img, mask, smoothing):
+    """Suavizado final según options.smoothing
+
+    'bilateral' filtra la página entera, 'band' solo alrededor de lo
+    rellenado (una página sin nada que limpiar queda como estaba) y 'off'
+    no suaviza.
+    """
+    if smoothing == 'off' or (smoothing == 'band' and not cv2.countNonZero(mask)):
+        return img
+    if not stage_allowed('bilateral'):
+        return img
+    with stage('bilateral'):
+        if smoothing == 'band':
+            return smooth_band(img, mask)
+        return bilateral(img)
+
+
+def _scaled(value, scale, minimum=1):
+    """Escalar un umbral en píxeles pensado para la página a resolución completa"""
+    return max(minimum, int(value * scale + 0.5))
+
+
+def blue_lines_mask(hsv):
+    """Máscara de líneas azules (horizontales principalmente) a partir de la imagen HSV"""
+    # Rango para detectar líneas azules (ajustado para varios tonos de azul)
+    lower_blue = np.array([90, 50, 50])
+    upper_blue = np.array([130, 255, 255])
+    
+    mask_blue = cv2.inRange(hsv, lower_blue, upper_blue)
+    
+    # Morfología para conectar líneas
+    kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1))
+    mask_blue = cv2.morphologyEx(mask_blue, cv2.MORPH_CLOSE, kernel_horizontal)
+    
+    # Dilatar para cubrir toda la línea
+    kernel_dilate = np.ones((3, 3), np.uint8)
+    mask_blue = cv2.dilate(mask_blue, kernel_dilate, iterations=2)
+    
+    return mask_blue
+
+
+# Umbral alto del Canny que HoughCircles hace por dentro (param1; el bajo es la mitad)
+HOUGH_EDGES_THRESHOLD = 50
+# Segundos de HoughCircles por píxel de borde al cuadrado: en escaneos con
+# mucho grano los bordes se disparan y una sola página puede tardar minutos.
+# Es lo medido en un equipo modesto; cada proceso lo corrige con sus páginas
+_hough_seconds_per_edge2 = 1.3e-9
+# Por debajo de tantos bordes la medida es ruido y no corrige la estimación
+HOUGH_CALIBRATION_EDGES = 20000
+
+
+def _hough_circles(gray, detection_scale=1.0):
+    """cv2.HoughCircles de los sellos, o None si no cabe en el tiempo de la página
+
+    Con detection_scale < 1 los círculos se buscan en una copia reducida de
+    la página (el tiempo baja más o menos con el cuadrado de la escala) y se
+    devuelven en coordenadas de la página. Con plazo, antes se cuentan los
+    bordes (un Canny, unos milisegundos) para estimar lo que va a tardar:
+    una vez en marcha ya no se puede cortar.
+    """
+    global _hough_seconds_per_edge2
+    gray, scale = detection_proxy(gray, detection_scale)
+    edges = None
+
+    def estimate():
+        nonlocal edges
+        edges = cv2.countNonZero(cv2.Canny(gray, HOUGH_EDGES_THRESHOLD // 2, HOUGH_EDGES_THRESHOLD))
+        return _hough_seconds_per_edge2 * edges * edges
+
+    if not stage_fits('hough_circles', estimate):
+        return None
+    start = time.perf_counter()
+    # Sobre una página reducida (y por tanto suavizada) los votos del
+    # acumulador bajan más o menos con la raíz de la escala; así las
+    # detecciones se parecen más a las de resolución completa
+    circles = cv2.HoughCircles(gray, cv2.HOUGH_GRADIENT, dp=1, minDist=_scaled(50, scale),
+                               param1=HOUGH_EDGES_THRESHOLD, param2=_scaled(30, scale ** 0.5, 10),
+                               minRadius=_scaled(20, scale), maxRadius=_scaled(150, scale))
+    if edges is not None and edges >= HOUGH_CALIBRATION_EDGES:
+        measured = (time.perf_counter() - start) / (edges * edges)
+        _hough_seconds_per_edge2 = (_hough_seconds_per_edge2 + measured) / 2
+    if circles is not None and scale != 1.0:
+        # Del centro de un píxel de la copia al de la página
+        circles = circles / scale
+        circles[..., :2] += 0.5 / scale - 0.5
+    return circles
+
+
+def seals_mask(gray, hsv, detection_scale=1.0):
+    """Máscara de sellos circulares o semicirculares y de zonas rojas
+
+    Sin `hsv` (páginas en gris) solo se buscan los círculos. Si la página
+    tiene plazo y la búsqueda de círculos no cabe en él, se salta y solo
+    quedan las zonas rojas. `detection_scale` es la escala de la copia
+    reducida en la que se buscan los círculos; lo demás va a resolución completa.
+    """
+    # Detectar círculos (sellos circulares)
+    circles = _hough_circles(gray, detection_scale)
+    
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    
+    if circles is not None:
+        circles = np.uint16(np.around(circles))
+        for circle in circles[0, :]:
+            center = (circle[0], circle[1])
+            radius = circle[2]
+            # Dibujar círculo relleno en la máscara
+            cv2.circle(mask, center, radius + 10, 255, -1)
+    
+    if hsv is not None:
+        # Rojo (sellos rojos)
+        lower_red1 = np.array([0, 100, 100])
+        upper_red1 = np.array([10, 255, 255])
+        lower_red2 = np.array([160, 100, 100])
+        upper_red2 = np.array([180, 255, 255])
+        
+        mask_red1 = cv2.inRange(hsv, lower_red1, upper_red1)
+        mask_red2 = cv2.inRange(hsv, lower_red2, upper_red2)
+        mask_red = cv2.bitwise_or(mask_red1, mask_red2)
+        
+        # Combinar con la máscara de círculos
+        mask = cv2.bitwise_or(mask, mask_red)
+    
+    # Morfología para limpiar
+    kernel = np.ones((5, 5), np.uint8)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.dilate(mask, kernel, iterations=2)
+    
+    return mask
+
+
+def signatures_mask(gray, exclude=None):
+    """Máscara de firmas manuscritas; los píxeles de `exclude` no cuentan como trazo"""
+    # Umbral adaptativo para detectar texto/trazos
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, 11, 2)
+    if exclude is not None:
+        thresh[exclude > 0] = 0
+    
+    # Morfología para conectar trazos de firma
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+    
+    # Encontrar contornos
+    contours, _ = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    if not contours:
+        return mask
+
+    # Todos los contornos en un solo array: caja y área de cada uno de una
+    # vez, sin recorrerlos en Python (en páginas de texto denso son miles)
+    lengths = np.fromiter(map(len, contours), dtype=np.intp, count=len(contours))
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    px, py = points[:, 0], points[:, 1]
+    x, y = np.minimum.reduceat(px, starts), np.minimum.reduceat(py, starts)
+    w = np.maximum.reduceat(px, starts) - x + 1
+    h = np.maximum.reduceat(py, starts) - y + 1
+    # Área como cv2.contourArea: fórmula del polígono (shoelace), cerrando
+    # cada contorno de su último punto al primero
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    area = np.abs(np.add.reduceat(px * py[following] - px[following] * py, starts)) / 2
+    aspect_ratio = w / h
+
+    # Densidad de trazo en la caja de cada candidato, con una imagen integral
+    ink = cv2.integral(cv2.threshold(thresh, 0, 1, cv2.THRESH_BINARY)[1])
+    inked = ink[y + h, x + w] - ink[y, x + w] - ink[y + h, x] + ink[y, x]
+    density = inked / (w * h)
+
+    # Filtrar características típicas de firmas:
+    # - Área media (no muy pequeña ni muy grande)
+    # - Relación de aspecto horizontal (firmas son más anchas)
+    # - Densidad de trazo media (no es texto regular ni una mancha)
+    selected = ((500 < area) & (area < 15000) & (1.5 < aspect_ratio) & (aspect_ratio < 8)
+                & (0.05 < density) & (density < 0.4))
+
+    # La caja ampliada de cada firma ya contiene todo su contorno relleno
+    margin = 5
+    for left, top, width, height in zip(x[selected], y[selected], w[selected], h[selected]):
+        mask[max(top - margin, 0):top + height + margin + 1,
+             max(left - margin, 0):left + width + margin + 1] = 255
+    
+    # Dilatar para cubrir toda la firma
+    kernel_dilate = np.ones((3, 3), np.uint8)
+    mask = cv2.dilate(mask, kernel_dilate, iterations=2)
+    
+    return mask
+
+
+def detection_proxy(img, detection_scale):
+    """Versión reducida de la página para buscar los círculos de los sellos y su escala real"""
+    if detection_scale >= 1:
+        return img, 1.0
+    height, width = img.shape[:2]
+    proxy_w = max(1, int(width * detection_scale + 0.5))
+    proxy_h = max(1, int(height * detection_scale + 0.5))
+    proxy = cv2.resize(img, (proxy_w, proxy_h), interpolation=cv2.INTER_AREA)
+    return proxy, proxy_w / width
+
+
+def _gray(img):
+    return img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def detect_blue_lines(img):
+    """Máscara de líneas azules"""
+    return blue_lines_mask(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+
+
+def detect_seals(img, detection_scale=1.0):
+    """Máscara de sellos, con los círculos buscados a `detection_scale`"""
+    hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV) if img.ndim == 3 else None
+    return seals_mask(_gray(img), hsv, detection_scale)
+
+
+def detect_signatures(img):
+    """Máscara de firmas manuscritas"""
+    return signatures_mask(_gray(img))
+
+
+def remove_blue_lines_from_image(img, regions=False):
+    """Detectar y remover líneas azules (horizontales principalmente)"""
+    return inpaint_mask(img, detect_blue_lines(img), regions)
+
+
+def remove_circular_seals(img, regions=False, detection_scale=1.0):
+    """Detectar y remover sellos circulares o semicirculares"""
+    return inpaint_mask(img, detect_seals(img, detection_scale), regions)
+
+
+def remove_handwritten_signatures(img, regions=False):
+    """Detectar y remover firmas manuscritas"""
+    return inpaint_mask(img, detect_signatures(img), regions)
+
+
+def _paper_tone(gray):
+    """Tono de gris más frecuente de la página (normalmente el del papel)"""
+    return int(np.bincount(gray.ravel(), minlength=256).argmax())
+
+
+def _template_or_detect(template, name, img, detect):
+    """Máscara de la plantilla si la página la confirma; si no, detectar (y aprender)"""
+    if template is None:
+        return detect()
+    mask = template.lookup(name, img)
+    if mask is None:
+        mask = detect()
+        template.learn(name, img, mask)
+    return mask
+
+
+def build_cleaning_mask(img, options, template=None):
+    """Unión de las máscaras de todos los detectores activos
+
+    Las conversiones a HSV y a gris se hacen una sola vez y se comparten;
+    con options.detection_scale < 1 los círculos de los sellos se buscan
+    sobre una versión reducida de la página.
+    Lo que ya cubre un detector se pinta con el tono del papel en la imagen
+    gris antes de pasar al siguiente, imitando lo que ven los filtros en
+    serie después de cada inpaint. Con una MaskTemplate, las líneas azules y
+    los sellos salen de la plantilla del documento cuando la página la
+    confirma. En una página en gris no hay HSV: las líneas azules no se
+    buscan y de los sellos solo los círculos.
+    """
+    color = img.ndim == 3
+    gray = _gray(img)
+    hsv = (cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+           if color and (options.remove_blue_lines or options.remove_seals) else None)
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    
+    if options.remove_blue_lines and color and stage_allowed('detect_blue_lines'):
+        with stage('detect_blue_lines'):
+            blue = _template_or_detect(template, 'blue_lines', img, lambda: blue_lines_mask(hsv))
+        record_coverage('blue_lines', blue)
+        mask = cv2.bitwise_or(mask, blue)
+    
+    if options.remove_seals and stage_allowed('detect_seals'):
+        with stage('detect_seals'):
+            if cv2.countNonZero(mask):
+                gray = gray.copy()
+                gray[mask > 0] = _paper_tone(gray)
+            seals = _template_or_detect(template, 'seals', img,
+                                        lambda: seals_mask(gray, hsv, options.detection_scale))
+        record_coverage('seals', seals)
+        mask = cv2.bitwise_or(mask, seals)
+    
+    if options.remove_signatures and stage_allowed('detect_signatures'):
+        with stage('detect_signatures'):
+            signatures = signatures_mask(gray, exclude=mask)
+        record_coverage('signatures', signatures)
+        mask = cv2.bitwise_or(mask, signatures)
+    
+    return mask
+
+
+def clean_image(img, options, template=None):
+    """Limpiar una imagen y devolver (resultado, máscara de lo que se rellenó)
+
+    La máscara es la unión de las de todos los filtros aplicados, a
+    resolución completa. `template` es la MaskTemplate del documento, si se
+    reutilizan máscaras entre páginas. Una imagen en gris (un solo canal)
+    sigue en gris de principio a fin, sin los detectores de color ni
+    plantillas. Devuelve (None, None) si algo falla.
+    """
+    if img.ndim == 2:
+        # Las plantillas se registran y verifican por el color
+        template = None
+    try:
+        if options.fused_masks:
+            # Una sola pasada de inpaint sobre la unión de las máscaras
+            mask = build_cleaning_mask(img, options, template)
+            with stage('inpaint'):
+                result = inpaint_mask(img, mask, options.region_inpaint)
+        else:
+            result = img.copy()
+            mask = np.zeros(img.shape[:2], dtype=np.uint8)
+            
+            # Aplicar filtros según las opciones, uno tras otro
+            detectors = []
+            if options.remove_blue_lines and img.ndim == 3:
+                detectors.append(('blue_lines', detect_blue_lines))
+            if options.remove_seals:
+                # Solo la búsqueda de círculos se hace sobre la copia reducida
+                detectors.append(('seals', partial(detect_seals, detection_scale=options.detection_scale)))
+            if options.remove_signatures:
+                # Las firmas cambian de una página a otra: siempre se detectan
+                detectors.append((None, detect_signatures))
+            
+            for name, detect in detectors:
+                if not stage_allowed(f"detect_{name or 'signatures'}"):
+                    # Sin tiempo: lo ya detectado se queda limpio y el resto se salta
+                    continue
+                detect_page = partial(detect, result)
+                with stage(f"detect_{name or 'signatures'}"):
+                    if name is None:
+                        filter_mask = detect_page()
+                    else:
+                        filter_mask = _template_or_detect(template, name, result, detect_page)
+                record_coverage(name or 'signatures', filter_mask)
+                with stage('inpaint'):
+                    result = inpaint_mask(result, filter_mask, options.region_inpaint)
+                mask = cv2.bitwise_or(mask, filter_mask)
+        
+        record_coverage('total', mask)
+        # Mejora final: suavizar y mejorar contraste
+        result = final_smoothing(result, mask, options.smoothing)
+        
+        return result, mask
+        
+    except Exception as e:
+        print(f"Error en clean_image: {e}")
+        return None, None
+
+
+def apply_cleaning_filters(img, options):
+    """Aplicar filtros de limpieza directamente a una imagen numpy array"""
+    return clean_image(img, options)[0]
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+# Cambiar si cambia el formato de lo que se guarda en el diario
+JOURNAL_VERSION = 1
+# Opciones que cambian el PDF de salida: un trabajo relanzado con otras no se reanuda
+JOURNAL_OPTIONS = ('remove_blue_lines', 'remove_seals', 'remove_signatures', 'fused_masks',
+                   'region_inpaint', 'template_masks', 'triage', 'gray_pages', 'detection_scale',
+                   'render_scale', 'target_dpi', 'max_page_megapixels', 'tile_size', 'page_encoder',
+                   'jpeg_quality', 'output_mode', 'smoothing')
+HASH_CHUNK = 1024 * 1024
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_synced(path, data):
+    """Escribir un archivo completo y en disco antes de darlo por bueno"""
+    partial_path = path + ".part"
+    with open(partial_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial_path, path)
+
+
+class JobJournal:
+    """Diario de un trabajo reanudable sobre un PDF
+
+    Cada página terminada se guarda ya codificada (o sus parches, en modo
+    patch) en un directorio propio del trabajo, y después se anota en
+    journal.jsonl; job.json guarda el hash del PDF de entrada y las opciones
+    que afectan a la salida. El directorio se identifica por ambos, así que
+    relanzar el mismo documento con las mismas opciones encuentra el diario
+    y las páginas anotadas no se vuelven a limpiar; con otro contenido u
+    otras opciones empieza uno nuevo. Una página cuyo archivo no llegó a
+    anotarse (el proceso murió en medio) simplemente se repite.
+    """
+
+    def __init__(self, directory, input_path, options):
+        self.input_path = str(input_path)
+        self.input_sha256 = file_sha256(input_path)
+        self.settings = {name: getattr(options, name) for name in JOURNAL_OPTIONS}
+        job = {'version': JOURNAL_VERSION, 'input_sha256': self.input_sha256, 'options': self.settings}
+        key = hashlib.sha256(json.dumps(job, sort_keys=True).encode()).hexdigest()
+        self.directory = os.path.join(directory, key[:32])
+        os.makedirs(self.directory, exist_ok=True)
+        job_path = os.path.join(self.directory, "job.json")
+        if not os.path.exists(job_path):
+            job['input'] = self.input_path
+            _write_synced(job_path, json.dumps(job, ensure_ascii=False, indent=2).encode())
+        self.pages = self._read()
+        self._journal = open(os.path.join(self.directory, "journal.jsonl"), 'a', encoding='utf-8')
+
+    @classmethod
+    def for_file(cls, input_path, options):
+        """Diario del PDF según options.journal_dir, o None si no se usa diario"""
+        if not options.journal_dir:
+            return None
+        try:
+            return cls(options.journal_dir, input_path, options)
+        except OSError as e:
+            print(f"Error abriendo el diario del trabajo: {e}")
+            return None
+
+    def _read(self):
+        pages = {}
+        try:
+            with open(os.path.join(self.directory, "journal.jsonl"), encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Última línea a medio escribir
+                        continue
+                    if os.path.exists(os.path.join(self.directory, entry['file'])):
+                        pages[entry['page']] = entry['file']
+        except OSError:
+            pass
+        return pages
+
+    def __contains__(self, page_num):
+        return page_num in self.pages
+
+    def save(self, page_num, payload):
+        """Guardar lo que se escribe de una página (EncodedPage o lista de PagePatch)"""
+        if self._journal is None or page_num in self.pages:
+            return
+        name = f"p{page_num + 1:06d}.pickle"
+        _write_synced(os.path.join(self.directory, name), pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+        self._journal.write(json.dumps({'page': page_num, 'file': name}) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self.pages[page_num] = name
+
+    def forget(self, page_num):
+        """Dejar de dar por hecha una página (p. ej. si su archivo no se puede leer)"""
+        self.pages.pop(page_num, None)
+
+    def load(self, page_num):
+        with open(os.path.join(self.directory, self.pages[page_num]), 'rb') as f:
+            return pickle.load(f)
+
+    def close(self):
+        """Cerrar el diario conservándolo para reanudar el trabajo más tarde"""
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    def finish(self):
+        """El PDF de salida ya está escrito: borrar el diario y sus páginas"""
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
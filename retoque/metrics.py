@@ -0,0 +1,249 @@
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import cv2
+
+# Líneas del informe de tracemalloc de la página perfilada
+TRACEMALLOC_TOP = 25
+
+
+@dataclass
+class PageMetrics:
+    """Métricas de una página: segundos por etapa, fracción de la página
+    cubierta por cada máscara, etapas saltadas por agotar su tiempo y pico
+    de memoria del proceso que la limpió"""
+    file: str
+    page: int
+    status: str = None
+    stages: dict = field(default_factory=dict)
+    coverage: dict = field(default_factory=dict)
+    skipped_stages: list = field(default_factory=list)
+    peak_rss_mb: float = None
+    pid: int = None
+
+
+def metrics_enabled(options):
+    return bool(options.metrics_path or options.prometheus_path)
+
+
+def peak_rss_mb():
+    """Pico de memoria residente de este proceso y de sus hijos ya terminados"""
+    # En Linux ru_maxrss sobrevive al exec de un proceso lanzado con spawn y
+    # arrastraría el pico del proceso padre; VmHWM empieza de cero
+    children = 0
+    try:
+        import resource
+        children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    except ImportError:
+        # Windows: sin getrusage
+        resource = None
+    try:
+        with open('/proc/self/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(max(int(line.split()[1]), children) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, children)
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# Página que se está midiendo en cada hilo
+_local = threading.local()
+
+
+def current_page():
+    return getattr(_local, 'page', None)
+
+
+@contextmanager
+def measuring(metrics):
+    """Atribuir a `metrics` las etapas y coberturas medidas en este hilo durante el bloque"""
+    previous, _local.page = current_page(), metrics
+    try:
+        yield metrics
+    finally:
+        _local.page = previous
+
+
+@contextmanager
+def stage(name):
+    """Sumar a la página en curso el tiempo del bloque; sin página medida no hace nada"""
+    page = current_page()
+    if page is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        page.stages[name] = page.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_coverage(name, mask):
+    """Guardar qué fracción de la página cubre una máscara"""
+    page = current_page()
+    if page is not None and mask is not None and mask.size:
+        page.coverage[name] = round(cv2.countNonZero(mask) / mask.size, 6)
+
+
+def _write_profile(profiler, snapshot, peak, prefix, file, page):
+    base = f"{prefix}-{Path(file).stem}-p{page}"
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".tracemalloc.txt", 'w', encoding='utf-8') as f:
+        f.write(f"Pico de memoria trazada: {peak / (1024 * 1024):.1f} MB\n")
+        for line in snapshot.statistics('lineno')[:TRACEMALLOC_TOP]:
+            f.write(f"{line}\n")
+    print(f"Perfil de la página {page} guardado en {base}.prof")
+
+
+@contextmanager
+def measure_page(file, page_num, options):
+    """Medir la limpieza de una página
+
+    Entrega un PageMetrics que las etapas instrumentadas de este hilo van
+    completando. Medir cuesta poco y se hace siempre (los tiempos viajan
+    también en los eventos de progreso); options solo decide si se exportan.
+    Si la página es options.profile_page se captura además un perfil de
+    cProfile y las asignaciones de tracemalloc, en archivos con prefijo
+    options.profile_output.
+    """
+    profile = options.profile_page == page_num + 1
+    metrics = PageMetrics(str(file), page_num + 1, pid=os.getpid())
+    profiler = None
+    if profile:
+        tracemalloc.start()
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        with measuring(metrics):
+            yield metrics
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            try:
+                _write_profile(profiler, snapshot, peak, options.profile_output, file, metrics.page)
+            except OSError as e:
+                print(f"Error guardando el perfil: {e}")
+        for name, seconds in metrics.stages.items():
+            metrics.stages[name] = round(seconds, 6)
+        metrics.peak_rss_mb = peak_rss_mb()
+
+
+class MetricsRecorder:
+    """Reunir las métricas de las páginas de un lote y exportarlas
+
+    Cada página se añade como una línea JSON a options.metrics_path en cuanto
+    termina de escribirse; al cerrar, los totales por etapa, por estado y por
+    máscara se guardan en options.prometheus_path con el formato de texto de
+    Prometheus (para el textfile collector de node_exporter, por ejemplo).
+    """
+
+    def __init__(self, metrics_path=None, prometheus_path=None):
+        self.prometheus_path = prometheus_path
+        self._jsonl = open(metrics_path, 'a', encoding='utf-8') if metrics_path else None
+        self._lock = threading.Lock()
+        self.stage_seconds = defaultdict(float)
+        self.stage_count = Counter()
+        self.coverage_sum = defaultdict(float)
+        self.coverage_count = Counter()
+        self.pages = Counter()
+        self.skipped_stages = Counter()
+        self.peak_rss_mb = 0.0
+
+    @classmethod
+    def from_options(cls, options):
+        """Recorder configurado en las opciones, o None si no hay métricas"""
+        if not metrics_enabled(options):
+            return None
+        return cls(options.metrics_path, options.prometheus_path)
+
+    def add_stage(self, name, seconds):
+        """Sumar tiempo de una etapa que no pertenece a una página concreta"""
+        with self._lock:
+            self.stage_seconds[name] += seconds
+            self.stage_count[name] += 1
+
+    def record(self, metrics):
+        """Añadir una página ya escrita"""
+        with self._lock:
+            for name, seconds in metrics.stages.items():
+                self.stage_seconds[name] += seconds
+                self.stage_count[name] += 1
+            for name, fraction in metrics.coverage.items():
+                self.coverage_sum[name] += fraction
+                self.coverage_count[name] += 1
+            self.pages[metrics.status] += 1
+            self.skipped_stages.update(metrics.skipped_stages)
+            if metrics.peak_rss_mb:
+                self.peak_rss_mb = max(self.peak_rss_mb, metrics.peak_rss_mb)
+            if self._jsonl is not None:
+                self._jsonl.write(json.dumps(asdict(metrics), ensure_ascii=False) + "\n")
+                self._jsonl.flush()
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP retoque_stage_seconds Tiempo dedicado a cada etapa del pipeline",
+            "# TYPE retoque_stage_seconds summary",
+        ]
+        for name in sorted(self.stage_seconds):
+            lines.append(f'retoque_stage_seconds_sum{{stage="{name}"}} {self.stage_seconds[name]:.6f}')
+            lines.append(f'retoque_stage_seconds_count{{stage="{name}"}} {self.stage_count[name]}')
+        lines += [
+            "# HELP retoque_pages_total Páginas procesadas por estado",
+            "# TYPE retoque_pages_total counter",
+        ]
+        for status in sorted(self.pages, key=str):
+            lines.append(f'retoque_pages_total{{status="{status}"}} {self.pages[status]}')
+        lines += [
+            "# HELP retoque_skipped_stages_total Etapas saltadas por agotar el tiempo de la página",
+            "# TYPE retoque_skipped_stages_total counter",
+        ]
+        for name in sorted(self.skipped_stages):
+            lines.append(f'retoque_skipped_stages_total{{stage="{name}"}} {self.skipped_stages[name]}')
+        lines += [
+            "# HELP retoque_mask_coverage_ratio Fracción de la página cubierta por cada máscara",
+            "# TYPE retoque_mask_coverage_ratio summary",
+        ]
+        for name in sorted(self.coverage_sum):
+            lines.append(f'retoque_mask_coverage_ratio_sum{{mask="{name}"}} {self.coverage_sum[name]:.6f}')
+            lines.append(f'retoque_mask_coverage_ratio_count{{mask="{name}"}} {self.coverage_count[name]}')
+        lines += [
+            "# HELP retoque_peak_rss_bytes Pico de memoria residente de los procesos de limpieza",
+            "# TYPE retoque_peak_rss_bytes gauge",
+            f"retoque_peak_rss_bytes {int(self.peak_rss_mb * 1024 * 1024)}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Escribir ya los totales en options.prometheus_path, sin cerrar el recorder"""
+        if not self.prometheus_path:
+            return
+        with self._lock:
+            # Temporal y renombrado: el colector nunca lee un archivo a medias
+            partial_path = self.prometheus_path + ".part"
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                f.write(self.prometheus_text())
+            os.replace(partial_path, self.prometheus_path)
+
+    def close(self):
+        with self._lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+        self.export()
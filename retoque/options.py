@@ -0,0 +1,108 @@
+import os
+from dataclasses import dataclass
+
+# Valores admitidos por page_encoder y output_mode. Viven aquí, con las
+# opciones, para que la línea de órdenes y las interfaces puedan validarlos
+# sin cargar OpenCV ni PyMuPDF
+ENCODERS = ('png', 'jpeg', 'g4', 'mrc', 'auto')
+OUTPUT_MODES = ('raster', 'patch')
+SMOOTHING_MODES = ('bilateral', 'band', 'off')
+
+
+def default_cache_dir():
+    """Directorio de caché del usuario (LOCALAPPDATA en Windows, XDG en el resto)"""
+    base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "retoque")
+
+
+def default_journal_dir():
+    """Directorio de los diarios de trabajos reanudables, junto a la caché"""
+    return default_cache_dir() + "-trabajos"
+
+
+@dataclass
+class CleaningOptions:
+    """Opciones de limpieza, independientes de la interfaz gráfica"""
+    remove_blue_lines: bool = True
+    remove_seals: bool = True
+    remove_signatures: bool = True
+    # Combinar las máscaras de todos los detectores y hacer un único inpaint
+    # por página, en lugar de un inpaint por filtro
+    fused_masks: bool = False
+    # Hacer el inpaint solo sobre recortes alrededor de cada región de la máscara
+    region_inpaint: bool = False
+    # Aprender de las primeras páginas de cada PDF dónde están las líneas
+    # azules y los sellos fijos y reutilizar esas máscaras en las siguientes
+    template_masks: bool = False
+    # Decidir sobre una miniatura qué detectores pueden encontrar algo en cada
+    # página y dejar pasar sin limpiar las que no tienen nada
+    triage: bool = False
+    # Tratar en gris las páginas sin color (según su miniatura): se renderizan
+    # con un solo canal, solo corren los detectores que no dependen del color
+    # y la salida se codifica en gris o en bilevel
+    gray_pages: bool = False
+    # Suavizado final de la página limpia: 'bilateral' (la página entera),
+    # 'band' (solo alrededor de lo rellenado, sin ablandar el resto del
+    # texto) u 'off'
+    smoothing: str = 'bilateral'
+    # Escala de la copia reducida en la que se buscan los círculos de los
+    # sellos, lo más lento de la detección (1.0 = resolución completa)
+    detection_scale: float = 1.0
+    # Zoom usado al rasterizar páginas de PDF (fitz.Matrix(scale, scale))
+    render_scale: float = 2.0
+    # Resolución de render en puntos por pulgada; si se fija, manda sobre render_scale
+    target_dpi: int = 0
+    # Megapíxeles como máximo por página renderizada (0 = sin límite); las
+    # páginas más grandes se rasterizan a la resolución que cabe en el límite
+    max_page_megapixels: float = 40.0
+    # Limpiar las páginas más grandes por teselas de este lado en píxeles
+    # (0 = la página entera de una vez), cada una con un margen alrededor para
+    # que no se noten las uniones: la memoria de trabajo depende de la tesela
+    tile_size: int = 0
+    # Teselas que se limpian a la vez, en hilos
+    tile_threads: int = 1
+    # Segundos como máximo por página (0 = sin límite): pasado el plazo, los
+    # detectores que faltan y el suavizado final se saltan y la página se
+    # escribe como haya quedado, marcada como PAGE_TIMED_OUT
+    page_time_limit: float = 0
+    # Procesos para limpiar páginas de PDF en paralelo (1 = en serie, 0 = todos los núcleos)
+    workers: int = 1
+    # Hilos internos de OpenCV por proceso, para no sobresuscribir los núcleos
+    opencv_threads: int = 1
+    # Páginas pendientes como máximo en el pool (0 = el doble de procesos)
+    max_inflight_pages: int = 0
+    # Memoria estimada como máximo para las páginas en vuelo en el pool, en MB
+    # (0 = sin límite): con páginas grandes hay menos en paralelo
+    memory_budget_mb: int = 0
+    # Codificador de páginas de salida: 'png', 'jpeg', 'g4' (bilevel CCITT),
+    # 'mrc' (texto G4 sobre fondo JPEG) o 'auto' (elegido por página)
+    page_encoder: str = 'png'
+    jpeg_quality: int = 85
+    # Hilos para codificar páginas en paralelo mientras se limpian las siguientes
+    encode_threads: int = 2
+    # Directorio de la caché en disco de páginas limpias (None = sin caché)
+    # y tamaño máximo en MB antes de borrar las entradas menos usadas
+    cache_dir: str = None
+    cache_max_mb: int = 1024
+    # Directorio de los diarios de trabajos (None = sin diario): cada página
+    # de un PDF se guarda ahí en cuanto está escrita y, si el trabajo se
+    # interrumpe, al relanzarlo solo se limpian las páginas que faltaban
+    journal_dir: str = None
+    # Salida de los PDF: 'raster' (cada página como imagen limpia) o 'patch'
+    # (las páginas originales con solo las zonas limpiadas pegadas encima)
+    output_mode: str = 'raster'
+    # Nombre del PDF limpio de cada entrada: {stem} es el nombre de la entrada
+    # sin extensión y {ext} su extensión (sin punto)
+    output_name: str = '{stem}_limpio.pdf'
+    # Archivos de un lote que se limpian a la vez (comparten el pool de páginas)
+    file_workers: int = 1
+    # Métricas por página: una línea JSON por página en metrics_path y los
+    # totales en formato de texto de Prometheus en prometheus_path
+    metrics_path: str = None
+    prometheus_path: str = None
+    # Página (desde 1) de cada archivo que se perfila con cProfile y
+    # tracemalloc (0 = ninguna); los informes llevan el prefijo profile_output
+    profile_page: int = 0
+    profile_output: str = 'perfil'
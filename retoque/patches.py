@@ -0,0 +1,146 @@
+import os
+import time
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+
+from .filters import mask_regions
+from .options import OUTPUT_MODES, CleaningOptions  # noqa: F401 (OUTPUT_MODES se importaba desde aquí)
+from .render import page_render_scale
+
+
+# Píxeles alrededor de la máscara que también se reemplazan, para tapar el
+# borde suavizado de lo que se borró
+PATCH_MARGIN = 2
+
+
+@dataclass
+class PagePatch:
+    """Recorte limpio de una página, en píxeles de la página renderizada
+
+    `image` es el recorte codificado (PNG o JPEG) y `mask` un PNG en gris que
+    indica qué píxeles del recorte reemplazan a la página original.
+    """
+    x: int
+    y: int
+    width: int
+    height: int
+    image: bytes
+    mask: bytes
+
+
+def _encode(img, options):
+    if options.page_encoder == 'jpeg' and img.ndim == 3:
+        success, data = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, options.jpeg_quality])
+    else:
+        success, data = cv2.imencode('.png', img)
+    if not success:
+        raise ValueError("no se pudo codificar el parche")
+    return data.tobytes()
+
+
+def extract_patches(cleaned, mask, options):
+    """Recortar de la página limpia solo las zonas que cubre la máscara"""
+    if not cv2.countNonZero(mask):
+        return []
+
+    kernel = np.ones((2 * PATCH_MARGIN + 1, 2 * PATCH_MARGIN + 1), np.uint8)
+    mask = cv2.dilate(mask, kernel)
+    patches = []
+    for x, y, x_end, y_end, owner in mask_regions(mask, PATCH_MARGIN):
+        alpha = cv2.bitwise_and(mask[y:y_end, x:x_end], mask[y:y_end, x:x_end], mask=owner)
+        patches.append(PagePatch(x, y, x_end - x, y_end - y,
+                                 image=_encode(cleaned[y:y_end, x:x_end], options),
+                                 mask=_encode(alpha, options)))
+    return patches
+
+
+def view_to_page_matrix(page):
+    """Matriz de coordenadas de la página renderizada a las de insert_image
+
+    Las coordenadas de la página tal como se ve (rotada y recortada por la
+    CropBox) se llevan primero al espacio PDF y luego al sistema que
+    insert_image espera, que en páginas rotadas con CropBox no coincide con
+    el de la vista.
+    """
+    mediabox, cropbox = page.mediabox, page.cropbox
+    to_pdf = page.derotation_matrix * fitz.Matrix(1, 0, 0, -1, cropbox.x0, mediabox.y1 - cropbox.y0)
+    return to_pdf * page.transformation_matrix
+
+
+class PdfPatchWriter:
+    """Copiar un PDF pegando encima de cada página solo los recortes limpios
+
+    Las páginas sin detecciones quedan intactas (texto, vectores e imágenes
+    originales); en las demás se superponen los parches con una máscara de
+    transparencia, así que solo cambian los píxeles que se limpiaron.
+    `recorder` y `journals` funcionan como en PdfPageWriter.
+    """
+
+    def __init__(self, input_path, output_path, options=None, recorder=None):
+        self.output_path = output_path
+        self.options = options or CleaningOptions()
+        self.recorder = recorder
+        self.partial_path = output_path + ".part"
+        self.page_count = 0
+        self.patched_pages = 0
+        self.journals = []
+        self._doc = fitz.open(input_path)
+
+    def add_patches(self, page_num, patches, metrics=None, journal=None):
+        """Pegar los parches de una página; sin parches la página no se toca
+
+        Con `journal`, los parches se guardan en él.
+        """
+        start = time.perf_counter()
+        if journal is not None:
+            try:
+                journal.save(page_num, patches)
+            except OSError as e:
+                print(f"Error guardando la página {page_num + 1} en el diario: {e}")
+        self._paste(page_num, patches)
+        if metrics is not None and self.recorder is not None:
+            metrics.stages['save'] = round(time.perf_counter() - start, 6)
+            self.recorder.record(metrics)
+
+    def _paste(self, page_num, patches):
+        self.page_count += 1
+        if not patches:
+            return
+        page = self._doc[page_num]
+        matrix = view_to_page_matrix(page)
+        scale = page_render_scale(page, self.options)
+        for patch in patches:
+            rect = fitz.Rect(patch.x, patch.y, patch.x + patch.width, patch.y + patch.height) / scale
+            page.insert_image(rect * matrix, stream=patch.image, mask=patch.mask,
+                              rotate=page.rotation, keep_proportion=False)
+        self.patched_pages += 1
+
+    def close(self):
+        """Guardar el documento y moverlo a su ruta definitiva"""
+        if self.page_count == 0:
+            self.discard()
+            return False
+        start = time.perf_counter()
+        self._doc.save(self.partial_path, garbage=3, deflate=True)
+        self._doc.close()
+        os.replace(self.partial_path, self.output_path)
+        if self.recorder is not None:
+            self.recorder.add_stage('save', time.perf_counter() - start)
+        for journal in self.journals:
+            journal.finish()
+        return True
+
+    def discard(self):
+        """Abandonar el documento sin dejar archivos a medio escribir
+
+        Los diarios se conservan para reanudar el trabajo.
+        """
+        for journal in self.journals:
+            journal.close()
+        if not self._doc.is_closed:
+            self._doc.close()
+        if os.path.exists(self.partial_path):
+            os.remove(self.partial_path)
@@ -0,0 +1,144 @@
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Tipos de evento de progreso
+FILE_STARTED = 'file_started'   # empieza un archivo de entrada
+PAGE_DONE = 'page_done'         # una página escrita (o revisada, en modo patch)
+FILE_DONE = 'file_done'         # un archivo terminado, con su resultado
+BATCH_DONE = 'batch_done'       # todo el trabajo terminado (o abortado con `error`)
+
+# Como mucho un evento de página cada tantos segundos en la cola de la interfaz
+PROGRESS_INTERVAL = 0.1
+# ...y en los registros de texto
+LOG_INTERVAL = 1.0
+
+
+@dataclass
+class ProgressEvent:
+    """Evento de progreso publicado por el motor
+
+    En PAGE_DONE, `page` es la página recién terminada (desde 1), `stages`
+    los segundos de cada etapa de esa página y `pages_per_second` y
+    `eta_seconds` se calculan desde que empezó el archivo. En FILE_DONE y
+    BATCH_DONE, `pages` es el total escrito y `error` explica un fallo.
+    """
+    kind: str
+    file: str = None
+    page: int = 0
+    total_pages: int = 0
+    status: str = None
+    stages: dict = field(default_factory=dict)
+    pages_per_second: float = None
+    eta_seconds: float = None
+    pages: int = 0
+    error: str = None
+
+
+def page_done_event(file, page_num, total_pages, status, metrics, started):
+    """Evento PAGE_DONE de la página `page_num` de un archivo empezado en `started` (time.monotonic())"""
+    done = page_num + 1
+    elapsed = time.monotonic() - started
+    rate = done / elapsed if elapsed > 0 else None
+    return ProgressEvent(
+        PAGE_DONE, str(file), done, total_pages, status,
+        stages=dict(metrics.stages) if metrics is not None else {},
+        pages_per_second=rate,
+        eta_seconds=(total_pages - done) / rate if rate else None,
+    )
+
+
+def format_event(event):
+    """Texto de una línea para mostrar un evento"""
+    name = Path(event.file).name if event.file else ""
+    if event.kind == FILE_STARTED:
+        return f"▶ {name}"
+    if event.kind == PAGE_DONE:
+        text = f"{name}: página {event.page} de {event.total_pages}"
+        if event.total_pages:
+            text += f" ({100 * event.page / event.total_pages:.0f}%)"
+        if event.pages_per_second:
+            text += f", {event.pages_per_second:.2f} págs/s"
+        if event.eta_seconds is not None and event.page < event.total_pages:
+            text += f", quedan ~{event.eta_seconds:.0f} s"
+        if event.stages:
+            slowest = max(event.stages, key=event.stages.get)
+            text += f", etapa más lenta: {slowest} ({event.stages[slowest]:.2f} s)"
+        return text
+    if event.error:
+        return f"❌ {name}: {event.error}" if name else f"❌ {event.error}"
+    if event.kind == FILE_DONE:
+        return f"✅ {name}: {event.pages} páginas"
+    return f"✅ Terminado: {event.pages} páginas"
+
+
+class ProgressChannel:
+    """Cola de eventos de progreso entre el hilo que limpia y la interfaz
+
+    publish() se puede llamar desde cualquier hilo y nunca espera a quien
+    muestra los eventos; la interfaz los recoge con drain() desde su propio
+    hilo (en Tk, con un temporizador de root.after). Los eventos de página
+    se limitan a uno cada `min_interval` segundos: los intermedios se
+    sustituyen por el más reciente, que se entrega en el siguiente drain().
+    Los demás eventos se conservan todos y en orden.
+    """
+
+    def __init__(self, min_interval=PROGRESS_INTERVAL):
+        self.min_interval = min_interval
+        self._events = deque()
+        self._latest_page = None
+        self._last_page_time = None
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            if event.kind != PAGE_DONE:
+                self._flush_page()
+                self._events.append(event)
+                return
+            now = time.monotonic()
+            if self._last_page_time is None or now - self._last_page_time >= self.min_interval:
+                self._latest_page = None
+                self._events.append(event)
+                self._last_page_time = now
+            else:
+                self._latest_page = event
+
+    def _flush_page(self):
+        if self._latest_page is not None:
+            self._events.append(self._latest_page)
+            self._latest_page = None
+
+    def drain(self):
+        """Recoger los eventos pendientes, en orden"""
+        with self._lock:
+            self._flush_page()
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+
+class ProgressLog:
+    """Escribir los eventos de progreso como líneas de texto (stderr o un archivo de log)
+
+    Las páginas se limitan a una línea cada `min_interval` segundos, salvo la
+    última de cada archivo.
+    """
+
+    def __init__(self, stream=None, min_interval=LOG_INTERVAL):
+        self.stream = stream
+        self.min_interval = min_interval
+        self._last_page_time = None
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            if event.kind == PAGE_DONE and event.page < event.total_pages:
+                now = time.monotonic()
+                if self._last_page_time is not None and now - self._last_page_time < self.min_interval:
+                    return
+                self._last_page_time = now
+            print(format_event(event), file=self.stream or sys.stderr, flush=True)
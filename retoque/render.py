@@ -0,0 +1,88 @@
+import math
+
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+
+from .tiles import needs_tiles, tile_halo
+from .triage import TRIAGE_SCALE
+
+# Bytes de memoria que ocupa, aproximadamente, cada píxel de una página en
+# vuelo: la imagen renderizada, sus copias de trabajo (resultado, inpaint,
+# filtro bilateral), las máscaras y las versiones en gris y HSV
+PAGE_BYTES_PER_PIXEL = 24
+# Por teselas, a la página solo la acompañan el resultado y la máscara
+TILED_PAGE_BYTES_PER_PIXEL = 7
+
+
+class PixmapArray(np.ndarray):
+    """Array de NumPy sobre las muestras de un fitz.Pixmap
+
+    Guarda una referencia al pixmap: PyMuPDF libera las muestras cuando el
+    pixmap se destruye, y el array (y las vistas que salgan de él) no deben
+    quedarse apuntando a memoria liberada. Las copias no la heredan.
+    """
+
+    def __array_finalize__(self, obj):
+        self.pixmap = getattr(obj, 'pixmap', None) if self.base is not None else None
+
+
+def pixmap_to_array(pix):
+    """Envolver las muestras de un pixmap en un array (alto, ancho, canales) sin copiarlas"""
+    img = PixmapArray((pix.h, pix.w, pix.n), dtype=np.uint8, buffer=pix.samples_mv,
+                      strides=(pix.stride, pix.n, 1))
+    img.pixmap = pix
+    return img
+
+
+def page_render_scale(page, options):
+    """Zoom con el que se rasteriza una página
+
+    Sale de options.target_dpi (los puntos PDF son 1/72 de pulgada) o, sin
+    él, de options.render_scale, y se reduce lo necesario para que la página
+    no pase de options.max_page_megapixels: un plano A0 no debe convertirse
+    en un array de cientos de megapíxeles.
+    """
+    scale = options.target_dpi / 72 if options.target_dpi else options.render_scale
+    if options.max_page_megapixels:
+        rect = page.rect
+        pixels = rect.width * rect.height * scale * scale
+        limit = options.max_page_megapixels * 1e6
+        if pixels > limit:
+            scale *= math.sqrt(limit / pixels)
+    return scale
+
+
+def page_memory_bytes(page, options):
+    """Memoria estimada para limpiar una página a su resolución de render"""
+    scale = page_render_scale(page, options)
+    width, height = int(page.rect.width * scale), int(page.rect.height * scale)
+    if not needs_tiles((height, width), options):
+        return width * height * PAGE_BYTES_PER_PIXEL
+    tile = options.tile_size + 2 * tile_halo(options)
+    threads = max(1, options.tile_threads)
+    return width * height * TILED_PAGE_BYTES_PER_PIXEL + threads * tile * tile * PAGE_BYTES_PER_PIXEL
+
+
+def render_page(page, options, scale=None, gray=False):
+    """Rasterizar una página de PDF a un array BGR (por defecto a page_render_scale)
+
+    Con `gray` la página se rasteriza directamente en gris, a un array de un
+    solo canal: la tercera parte de memoria y de trabajo.
+    """
+    scale = scale or page_render_scale(page, options)
+    if gray:
+        pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), colorspace=fitz.csGRAY, alpha=False)
+        return pixmap_to_array(pix)[..., 0]
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale), alpha=False)
+
+    # Usar directamente la memoria del pixmap y pasar de RGB a BGR en el sitio,
+    # sin codificar/decodificar la página ni copiarla
+    img = pixmap_to_array(pix)
+    cv2.cvtColor(img, cv2.COLOR_RGB2BGR, dst=img)
+    return img
+
+
+def render_thumbnail(page, options):
+    """Miniatura de una página para el triage, renderizada directamente a baja resolución"""
+    return render_page(page, options, page_render_scale(page, options) * TRIAGE_SCALE)
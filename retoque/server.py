@@ -0,0 +1,581 @@
+import argparse
+import heapq
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field, fields, replace
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from socketserver import TCPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .cli import add_option_arguments, options_from_args
+from .engine import (
+    CANCELLED_ERROR,
+    SUPPORTED_EXTENSIONS,
+    clean_batch,
+    create_page_pool,
+    output_name_for,
+    resolve_workers,
+    warm_up_pool,
+)
+from .metrics import MetricsRecorder
+from .options import ENCODERS, OUTPUT_MODES, SMOOTHING_MODES, CleaningOptions
+from .progress import PAGE_DONE
+
+# Estado de cada trabajo
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+# Opciones de limpieza que cada trabajo puede cambiar en la petición; el
+# resto (procesos, caché, métricas...) las fija quien arranca el servidor
+JOB_OPTIONS = ('remove_blue_lines', 'remove_seals', 'remove_signatures', 'fused_masks',
+               'region_inpaint', 'template_masks', 'triage', 'gray_pages', 'detection_scale',
+               'render_scale', 'target_dpi', 'page_encoder', 'jpeg_quality', 'output_mode',
+               'smoothing')
+# Valores admitidos de las opciones de texto y rango (mínimo, máximo) de las numéricas
+JOB_CHOICES = {'page_encoder': ENCODERS, 'output_mode': OUTPUT_MODES, 'smoothing': SMOOTHING_MODES}
+JOB_RANGES = {'detection_scale': (0.05, 1.0), 'render_scale': (0.1, 10.0), 'target_dpi': (0, 1200),
+              'jpeg_quality': (1, 100)}
+TRUE_VALUES = ('1', 'true', 'yes', 'si', 'sí', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+DEFAULT_PORT = 8765
+# Bloques al enviar un PDF limpio y al recibir el archivo de un trabajo
+SEND_CHUNK = 1024 * 1024
+RECEIVE_CHUNK = 1024 * 1024
+
+
+class JobError(Exception):
+    """Petición que el servidor rechaza, con el código HTTP que le corresponde"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+@dataclass
+class Job:
+    """Un archivo enviado para limpiar y su estado"""
+    id: str
+    filename: str
+    input_path: str
+    output_dir: str
+    options: CleaningOptions
+    priority: int = 0
+    status: str = JOB_QUEUED
+    page: int = 0
+    total_pages: int = 0
+    pages: int = 0
+    output_path: str = None
+    error: str = None
+    created: float = field(default_factory=time.time)
+    started: float = None
+    finished: float = None
+    # Se activa para detener el trabajo mientras se está limpiando
+    cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'priority': self.priority,
+            'status': self.status,
+            'page': self.page,
+            'total_pages': self.total_pages,
+            'pages': self.pages,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'result': f"/jobs/{self.id}/result" if self.status == JOB_DONE else None,
+        }
+
+
+class _JobProgress:
+    """Sumidero de eventos de progreso que actualiza la página en curso de un trabajo"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def publish(self, event):
+        if event.kind == PAGE_DONE:
+            self.job.page = event.page
+            self.job.total_pages = event.total_pages
+
+
+def _copy_body(source, target, length):
+    """Copiar `length` bytes de `source` a `target` por bloques de RECEIVE_CHUNK"""
+    remaining = length
+    while remaining:
+        chunk = source.read(min(RECEIVE_CHUNK, remaining))
+        if not chunk:
+            raise JobError(HTTPStatus.BAD_REQUEST, "El archivo llegó incompleto")
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def job_options(options, query):
+    """Opciones del servidor con los cambios permitidos que pide un trabajo
+
+    Un valor que no se puede convertir, que no está entre los admitidos
+    (JOB_CHOICES) o que queda fuera de su rango (JOB_RANGES) se rechaza con
+    un JobError 400 que nombra la opción.
+    """
+    types = {f.name: f.type for f in fields(CleaningOptions)}
+    changes = {}
+    for name in JOB_OPTIONS:
+        if name not in query:
+            continue
+        value = query[name][-1]
+        kind = types[name]
+        try:
+            if kind in (bool, 'bool'):
+                if value.lower() not in TRUE_VALUES + FALSE_VALUES:
+                    raise ValueError(value)
+                changes[name] = value.lower() in TRUE_VALUES
+            elif kind in (int, 'int'):
+                changes[name] = int(value)
+            elif kind in (float, 'float'):
+                changes[name] = float(value)
+            else:
+                changes[name] = value
+        except ValueError:
+            raise JobError(HTTPStatus.BAD_REQUEST, f"Valor no válido para {name}: {value}")
+        if name in JOB_CHOICES and changes[name] not in JOB_CHOICES[name]:
+            raise JobError(HTTPStatus.BAD_REQUEST,
+                           f"Valor no válido para {name}: {value} (admitidos: {', '.join(JOB_CHOICES[name])})")
+        if name in JOB_RANGES:
+            low, high = JOB_RANGES[name]
+            # `not low <= x <= high` también rechaza nan
+            if not low <= changes[name] <= high:
+                raise JobError(HTTPStatus.BAD_REQUEST,
+                               f"Valor no válido para {name}: {value} (entre {low} y {high})")
+    return replace(options, **changes)
+
+
+class JobServer:
+    """Cola de trabajos de limpieza servida por un pool de procesos ya arrancado
+
+    Los trabajos se ordenan por prioridad (mayor primero) y, a igualdad, por
+    orden de llegada. Como mucho `max_jobs` se limpian a la vez, todos sobre
+    el mismo pool de options.workers procesos, que se arranca una sola vez al
+    crear el servidor: cada trabajo se ahorra importar OpenCV y PyMuPDF y
+    lanzar procesos. Con más de `max_queued` trabajos en espera se rechazan
+    los nuevos. Cada trabajo guarda su entrada y su PDF limpio en un
+    directorio propio dentro de `spool_dir`; los terminados se borran pasados
+    `keep_seconds` o al pedirlo. Las métricas de todos los trabajos se suman
+    en un único MetricsRecorder, que exporta los totales al acabar cada uno.
+    """
+
+    def __init__(self, options, spool_dir=None, max_jobs=1, max_queued=100, keep_seconds=24 * 3600):
+        self.options = options
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.keep_seconds = keep_seconds
+        self._own_spool = spool_dir is None
+        self.spool_dir = spool_dir or tempfile.mkdtemp(prefix="retoque-trabajos-")
+        os.makedirs(self.spool_dir, exist_ok=True)
+
+        self.pool = None
+        self.recorder = None
+        self._jobs = {}
+        self._queue = []
+        self._order = itertools.count()
+        self._running = 0
+        self._closing = False
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        self.recorder = MetricsRecorder.from_options(self.options)
+        if resolve_workers(self.options) > 1:
+            self.pool = create_page_pool(self.options)
+            warm_up_pool(self.pool, resolve_workers(self.options))
+        for _ in range(self.max_jobs):
+            thread = threading.Thread(target=self._run_jobs, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self):
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+            # No esperar a que terminen: los trabajos en curso se detienen en
+            # la siguiente etapa o página
+            for job in self._jobs.values():
+                if job.status == JOB_RUNNING:
+                    job.cancel.set()
+        for thread in self._threads:
+            thread.join()
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+        if self.recorder is not None:
+            self.recorder.close()
+        if self._own_spool:
+            shutil.rmtree(self.spool_dir, ignore_errors=True)
+
+    def submit(self, filename, data, priority=0, options=None, length=None):
+        """Encolar un archivo y devolver el Job creado
+
+        `data` son los bytes del archivo o un objeto con read() (el cuerpo de
+        la petición) del que se copian `length` bytes al spool por bloques,
+        sin tener el archivo entero en memoria.
+        """
+        filename = Path(filename or "").name
+        if Path(filename).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            raise JobError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                           f"Formato no soportado: {filename or 'sin nombre'}")
+        self._expire()
+
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir)
+        input_path = os.path.join(job_dir, filename)
+        try:
+            with open(input_path, 'wb') as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    _copy_body(data, f, length)
+        except BaseException:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise
+        job = Job(job_id, filename, input_path, os.path.join(job_dir, "salida"),
+                  options or self.options, priority)
+
+        # Comprobar el límite y encolar de una vez, para que dos peticiones
+        # simultáneas no lo superen entre las dos
+        with self._condition:
+            full = len(self._queue) >= self.max_queued
+            if not full:
+                self._jobs[job_id] = job
+                heapq.heappush(self._queue, (-priority, next(self._order), job))
+                self._condition.notify()
+        if full:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise JobError(HTTPStatus.SERVICE_UNAVAILABLE, "La cola de trabajos está llena")
+        return job
+
+    def get(self, job_id):
+        with self._condition:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise JobError(HTTPStatus.NOT_FOUND, f"No existe el trabajo {job_id}")
+        return job
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def stats(self):
+        with self._condition:
+            return {
+                'workers': resolve_workers(self.options),
+                'max_jobs': self.max_jobs,
+                'queued': len(self._queue),
+                'running': self._running,
+                'jobs': len(self._jobs),
+            }
+
+    def delete(self, job_id):
+        """Cancelar un trabajo en espera o borrar uno terminado, con sus archivos
+
+        Un trabajo en curso no se borra todavía: se le pide que se detenga,
+        queda como JOB_CANCELLED y se devuelve False.
+        """
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None:
+                raise JobError(HTTPStatus.NOT_FOUND, f"No existe el trabajo {job_id}")
+            if job.status == JOB_RUNNING:
+                job.cancel.set()
+                return False
+            if job.status == JOB_QUEUED:
+                self._queue = [entry for entry in self._queue if entry[2] is not job]
+                heapq.heapify(self._queue)
+            del self._jobs[job_id]
+        shutil.rmtree(os.path.dirname(job.input_path), ignore_errors=True)
+        return True
+
+    def _expire(self):
+        """Borrar los trabajos terminados hace más de keep_seconds"""
+        limit = time.time() - self.keep_seconds
+        with self._condition:
+            expired = [job.id for job in self._jobs.values()
+                       if job.finished is not None and job.finished < limit]
+        for job_id in expired:
+            try:
+                self.delete(job_id)
+            except JobError:
+                pass
+
+    def _run_jobs(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closing:
+                    self._condition.wait()
+                if self._closing:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                job.status = JOB_RUNNING
+                job.started = time.time()
+                self._running += 1
+            try:
+                self._clean(job)
+            finally:
+                with self._condition:
+                    self._running -= 1
+
+    def _clean(self, job):
+        try:
+            results = clean_batch([job.input_path], job.output_dir, job.options,
+                                  events=_JobProgress(job), pool=self.pool, cancel=job.cancel,
+                                  recorder=self.recorder)
+            result = results[0] if results else None
+            if result is None:
+                job.error = "No se encontraron archivos soportados"
+            elif result.ok:
+                job.output_path = result.output_path
+                job.pages = result.pages
+            else:
+                job.error = result.error
+        except Exception as e:
+            job.error = f"Error procesando el trabajo: {e}"
+        if self.recorder is not None:
+            try:
+                self.recorder.export()
+            except OSError as e:
+                print(f"Error exportando las métricas: {e}", file=sys.stderr)
+        job.finished = time.time()
+        if job.error == CANCELLED_ERROR:
+            job.status = JOB_CANCELLED
+        else:
+            job.status = JOB_FAILED if job.error else JOB_DONE
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    """API HTTP del servidor de trabajos
+
+    POST   /jobs?filename=x.pdf&priority=N[&opción=valor...]  (el archivo en el cuerpo)
+    GET    /jobs                 lista de trabajos
+    GET    /jobs/<id>            estado de un trabajo
+    GET    /jobs/<id>/result     PDF limpio de un trabajo terminado
+    DELETE /jobs/<id>            cancelar o borrar un trabajo (202 si estaba en curso)
+    GET    /health               procesos, trabajos en cola y en curso
+    """
+    server_version = "retoque"
+    # HTTP/1.1: conexiones persistentes y "Expect: 100-continue" al subir archivos grandes
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        parts = urlsplit(self.path)
+        return [part for part in parts.path.split("/") if part], parse_qs(parts.query)
+
+    def _handle(self, action):
+        try:
+            action()
+        except JobError as e:
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            # No se sabe si el cuerpo de la petición llegó a leerse
+            self._skip_body()
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+
+    def _skip_body(self):
+        """Responder sin leer el cuerpo: la conexión se cierra después, para
+        que lo que quede por leer no se tome por la siguiente petición"""
+        self.close_connection = True
+
+    def do_GET(self):
+        self._handle(self._get)
+
+    def do_POST(self):
+        self._handle(self._post)
+
+    def do_DELETE(self):
+        self._handle(self._delete)
+
+    def _get(self):
+        jobs = self.server.jobs
+        path, _ = self._route()
+        if path == ["health"]:
+            self._send_json(HTTPStatus.OK, jobs.stats())
+        elif path == ["jobs"]:
+            self._send_json(HTTPStatus.OK, [job.to_dict() for job in jobs.jobs()])
+        elif len(path) == 2 and path[0] == "jobs":
+            self._send_json(HTTPStatus.OK, jobs.get(path[1]).to_dict())
+        elif len(path) == 3 and path[0] == "jobs" and path[2] == "result":
+            self._send_result(jobs.get(path[1]))
+        else:
+            raise JobError(HTTPStatus.NOT_FOUND, f"Ruta desconocida: {self.path}")
+
+    def _send_result(self, job):
+        if job.status != JOB_DONE:
+            raise JobError(HTTPStatus.CONFLICT, f"El trabajo no ha terminado ({job.status})")
+        size = os.path.getsize(job.output_path)
+        name = os.path.basename(output_name_for(job.filename, job.options.output_name))
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(size))
+        self.send_header("Content-Disposition", f'attachment; filename="{name}"')
+        self.end_headers()
+        with open(job.output_path, 'rb') as f:
+            shutil.copyfileobj(f, self.wfile, SEND_CHUNK)
+
+    def _post(self):
+        path, query = self._route()
+        if path != ["jobs"]:
+            self._skip_body()
+            raise JobError(HTTPStatus.NOT_FOUND, f"Ruta desconocida: {self.path}")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self._skip_body()
+            raise JobError(HTTPStatus.BAD_REQUEST, "Content-Length no válido")
+        if not length:
+            raise JobError(HTTPStatus.LENGTH_REQUIRED, "Falta el archivo en el cuerpo de la petición")
+        if length > self.server.max_upload_bytes:
+            self._skip_body()
+            raise JobError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "El archivo es demasiado grande")
+        jobs = self.server.jobs
+        try:
+            try:
+                priority = int(query.get("priority", ["0"])[-1])
+            except ValueError:
+                raise JobError(HTTPStatus.BAD_REQUEST, "La prioridad debe ser un número entero")
+            options = job_options(jobs.options, query)
+            # El cuerpo va directo al spool del trabajo, por bloques
+            job = jobs.submit(query.get("filename", [""])[-1], self.rfile, priority, options, length)
+        except JobError:
+            # Rechazado antes de leer el cuerpo entero
+            self._skip_body()
+            raise
+        self._send_json(HTTPStatus.ACCEPTED, job.to_dict(), {"Location": f"/jobs/{job.id}"})
+
+    def _delete(self):
+        path, _ = self._route()
+        if len(path) != 2 or path[0] != "jobs":
+            raise JobError(HTTPStatus.NOT_FOUND, f"Ruta desconocida: {self.path}")
+        if not self.server.jobs.delete(path[1]):
+            # En curso: se detendrá en la siguiente etapa; luego se puede borrar
+            self._send_json(HTTPStatus.ACCEPTED, self.server.jobs.get(path[1]).to_dict())
+            return
+        self.send_response(HTTPStatus.NO_CONTENT)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        print(f"[servidor] {self.command} {self.path} -> {format % args}", file=sys.stderr)
+
+
+class JobHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, jobs, max_upload_bytes):
+        self.jobs = jobs
+        self.max_upload_bytes = max_upload_bytes
+        super().__init__(address, JobRequestHandler)
+
+
+class UnixJobHTTPServer(JobHTTPServer):
+    """La misma API sobre un socket Unix, solo accesible a quien puede abrir el archivo"""
+    address_family = getattr(socket, 'AF_UNIX', None)
+
+    def server_bind(self):
+        TCPServer.server_bind(self)
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler espera una dirección (host, puerto)
+        return request, ("unix", 0)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m retoque.server",
+        description="Servidor local de trabajos de limpieza: mantiene los procesos arrancados y "
+                    "atiende archivos por HTTP.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="Dirección en la que escuchar (por defecto: %(default)s, solo esta máquina)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="Puerto HTTP; 0 elige uno libre (por defecto: %(default)s)")
+    parser.add_argument("--unix", metavar="RUTA",
+                        help="Escuchar en un socket Unix en lugar de en un puerto TCP")
+    parser.add_argument("--spool-dir",
+                        help="Directorio para las entradas y salidas de los trabajos (por defecto, uno temporal)")
+    parser.add_argument("--max-jobs", type=int, default=1,
+                        help="Trabajos que se limpian a la vez sobre el pool (por defecto: %(default)s)")
+    parser.add_argument("--max-queued", type=int, default=100,
+                        help="Trabajos en espera como máximo antes de rechazar nuevos (por defecto: %(default)s)")
+    parser.add_argument("--max-upload-mb", type=int, default=512,
+                        help="Tamaño máximo de cada archivo enviado (por defecto: %(default)s)")
+    parser.add_argument("--keep-hours", type=float, default=24,
+                        help="Horas que se conservan los trabajos terminados (por defecto: %(default)s)")
+    add_option_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    jobs = JobServer(options_from_args(args), args.spool_dir, args.max_jobs, args.max_queued,
+                     args.keep_hours * 3600)
+    max_upload_bytes = args.max_upload_mb * 1024 * 1024
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.remove(args.unix)
+        httpd = UnixJobHTTPServer(args.unix, jobs, max_upload_bytes)
+        address = args.unix
+    else:
+        httpd = JobHTTPServer((args.host, args.port), jobs, max_upload_bytes)
+        address = f"http://{args.host}:{httpd.server_port}"
+
+    jobs.start()
+    # Parar igual con SIGTERM (p. ej. el gestor de servicios) que con Ctrl+C:
+    # se terminan los trabajos en curso y se borran los temporales
+    signal.signal(signal.SIGTERM, _interrupt)
+    print(f"Servidor de trabajos en {address} ({resolve_workers(jobs.options)} procesos, "
+          f"{jobs.max_jobs} trabajo(s) a la vez)", flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        jobs.close()
+        if args.unix and os.path.exists(args.unix):
+            os.remove(args.unix)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+import threading
+
+import cv2
+import numpy as np
+
+# Páginas de las que se aprende la plantilla de cada detector
+TEMPLATE_PAGES = 2
+# Parecido mínimo (intersección sobre unión) entre las máscaras de esas páginas
+TEMPLATE_MIN_IOU = 0.5
+# Holgura en píxeles alrededor de las zonas estables, por si el registro no es exacto
+TEMPLATE_TOLERANCE = 3
+# Ancho de la miniatura sobre la que se registra y se verifica cada página
+REGISTRATION_WIDTH = 512
+# Respuesta mínima de cv2.phaseCorrelate para fiarse del desplazamiento
+MIN_REGISTRATION_RESPONSE = 0.1
+# Píxeles de color fuera de la plantilla tolerados en la miniatura
+VERIFY_MAX_OUTSIDE_PIXELS = 4
+VERIFY_MAX_OUTSIDE_FRACTION = 0.02
+# La zona de la plantilla debe parecerse a la de la página de referencia
+VERIFY_MIN_CORRELATION = 0.7
+VERIFY_MAX_DIFFERENCE = 8
+
+# Color que delata algo que la plantilla no cubre, por detector
+EVIDENCE_RANGES = {
+    'blue_lines': [([90, 25, 50], [130, 255, 255])],
+    'seals': [([0, 60, 60], [10, 255, 255]), ([160, 60, 60], [180, 255, 255])],
+}
+
+
+def _small(img):
+    """Miniatura en gris y HSV de una página, y su escala"""
+    scale = min(1.0, REGISTRATION_WIDTH / img.shape[1])
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), cv2.cvtColor(small, cv2.COLOR_BGR2HSV), scale
+
+
+def _evidence(name, hsv):
+    evidence = np.zeros(hsv.shape[:2], dtype=np.uint8)
+    for lower, upper in EVIDENCE_RANGES[name]:
+        evidence |= cv2.inRange(hsv, np.array(lower), np.array(upper))
+    return evidence
+
+
+def _shift(img, dx, dy, interpolation=cv2.INTER_NEAREST, border=cv2.BORDER_CONSTANT):
+    matrix = np.float32([[1, 0, dx], [0, 1, dy]])
+    return cv2.warpAffine(img, matrix, (img.shape[1], img.shape[0]), flags=interpolation,
+                          borderMode=border)
+
+
+class _DetectorTemplate:
+    def __init__(self, gray, mask, scale):
+        # Página de referencia (la primera vista) y su escala de miniatura
+        self.reference = gray
+        self.window = cv2.createHanningWindow((gray.shape[1], gray.shape[0]), cv2.CV_32F)
+        self.scale = scale
+        self.stable = mask > 0
+        self.learned = 1
+        self.mask = None
+        self.unstable = False
+
+    def register(self, gray):
+        """Desplazamiento (dx, dy) de la página respecto a la referencia, en la miniatura"""
+        if gray.shape != self.reference.shape:
+            return None
+        (dx, dy), response = cv2.phaseCorrelate(self.reference.astype(np.float32),
+                                                gray.astype(np.float32), self.window)
+        if response < MIN_REGISTRATION_RESPONSE:
+            return None
+        return dx, dy
+
+
+class MaskTemplate:
+    """Máscaras de líneas azules y sellos reutilizadas entre páginas de un documento
+
+    En formularios de varias páginas las líneas impresas y el sello suelen
+    estar en el mismo sitio. De las primeras TEMPLATE_PAGES páginas se
+    aprende, por detector, la parte de la máscara que se repite; en las
+    siguientes se registra la página contra la primera (correlación de fase
+    sobre una miniatura), se desplaza la plantilla y se verifica que no haya
+    color del detector fuera de ella y que su zona se parezca a la de la
+    referencia. Si algo no cuadra, lookup devuelve None y el detector se
+    ejecuta completo.
+    """
+
+    def __init__(self):
+        self._detectors = {}
+
+    def lookup(self, name, img):
+        """Máscara de la plantilla ajustada a esta página, o None si hay que detectar"""
+        template = self._detectors.get(name)
+        if template is None or template.mask is None:
+            return None
+
+        gray, hsv, scale = _small(img)
+        if scale != template.scale:
+            return None
+        shift = template.register(gray)
+        if shift is None:
+            return None
+        dx, dy = shift
+
+        mask = _shift(template.mask, dx / scale, dy / scale)
+        region = cv2.resize(mask, (gray.shape[1], gray.shape[0]), interpolation=cv2.INTER_AREA) > 0
+        region = cv2.dilate(region.astype(np.uint8), np.ones((3, 3), np.uint8)) > 0
+        if not region.any():
+            return None
+
+        # Nada nuevo fuera de la plantilla...
+        evidence = _evidence(name, hsv) > 0
+        outside = np.count_nonzero(evidence & ~region)
+        if outside > max(VERIFY_MAX_OUTSIDE_PIXELS, VERIFY_MAX_OUTSIDE_FRACTION * np.count_nonzero(evidence)):
+            return None
+
+        # ...y dentro lo mismo que en la página de referencia
+        reference = _shift(template.reference, dx, dy, cv2.INTER_LINEAR, cv2.BORDER_REPLICATE)
+        reference = reference[region].astype(np.float32)
+        current = gray[region].astype(np.float32)
+        if np.abs(reference - current).mean() > VERIFY_MAX_DIFFERENCE:
+            if reference.std() == 0 or current.std() == 0:
+                return None
+            if np.corrcoef(reference, current)[0, 1] < VERIFY_MIN_CORRELATION:
+                return None
+        return mask
+
+    def learn(self, name, img, mask):
+        """Incorporar la máscara detectada en una de las primeras páginas"""
+        template = self._detectors.get(name)
+        if template is None:
+            gray, _, scale = _small(img)
+            self._detectors[name] = _DetectorTemplate(gray, mask, scale)
+            return
+        if template.unstable or template.learned >= TEMPLATE_PAGES:
+            return
+
+        gray, _, scale = _small(img)
+        shift = template.register(gray) if scale == template.scale else None
+        if shift is None:
+            template.unstable = True
+            return
+        # Llevar la máscara al marco de la página de referencia
+        aligned = _shift(mask, -shift[0] / scale, -shift[1] / scale) > 0
+        union = np.count_nonzero(template.stable | aligned)
+        intersection = template.stable & aligned
+        if not union or np.count_nonzero(intersection) < TEMPLATE_MIN_IOU * union:
+            # Sin detecciones o demasiado distintas: no es un elemento fijo del formulario
+            template.unstable = True
+            return
+
+        template.stable = intersection
+        template.learned += 1
+        if template.learned >= TEMPLATE_PAGES:
+            kernel = np.ones((2 * TEMPLATE_TOLERANCE + 1, 2 * TEMPLATE_TOLERANCE + 1), np.uint8)
+            template.mask = cv2.dilate(template.stable.astype(np.uint8) * 255, kernel)
+
+
+# Plantilla del documento que se está procesando en cada hilo (con varios
+# archivos a la vez, cada uno va por su hilo)
+_current = threading.local()
+
+
+def start_document(key):
+    """Empezar una plantilla nueva en este hilo para el documento `key`
+
+    Se llama al empezar cada archivo: el mismo camino puede traer otro
+    contenido (un archivo nuevo con el mismo nombre, un trabajo relanzado)
+    y la plantilla aprendida antes ya no vale.
+    """
+    _current.template = MaskTemplate()
+    _current.key = key
+    return _current.template
+
+
+def document_template(key):
+    """Plantilla del documento `key`; se empieza una nueva al cambiar de documento"""
+    if getattr(_current, 'template', None) is None or _current.key != key:
+        return start_document(key)
+    return _current.template
@@ -0,0 +1,128 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import numpy as np
+
+from .budget import current_budget, using_budget
+from .filters import SMOOTHING_BAND, clean_image
+from .metrics import PageMetrics, current_page, measuring, record_coverage
+
+# Distancia en píxeles de la página hasta la que cada detector mira alrededor
+# de lo que marca (con detection_scale solo cambia la búsqueda de círculos,
+# que devuelve coordenadas de la página):
+# - líneas azules: cierre horizontal de 25 y dos dilataciones de 3x3
+BLUE_LINES_HALO = 25 // 2 + 2
+# - sellos: un círculo de hasta maxRadius=150, pintado con 10 de más, cuyo
+#   centro cae en el margen tiene que verse entero; más cierre y dilatación.
+#   Vale mientras los círculos que encuentra HoughCircles dependan solo de
+#   su entorno: sobre texto denso salen cientos de candidatos falsos que se
+#   descartan unos a otros (minDist) en cadena, y cerca de una unión la
+#   tesela puede quedarse con otros que la página entera
+SEALS_HALO = 2 * (150 + 10) + 6
+# - firmas: el contorno candidato más grande que aceptan los filtros de área
+#   y proporción, más su margen y la dilatación final
+SIGNATURES_HALO = 400
+# El inpaint de Telea rellena cada píxel con los ya rellenados a su
+# alrededor, así que a lo largo de una zona marcada (un renglón, el aro de un
+# sello) lo que ve en un extremo llega mucho más allá de INPAINT_RADIUS,
+# atenuándose. No tiene un límite fijo: en 40 páginas sintéticas de 100 a
+# 300 ppp y en los PDFs de ejemplo, a 190 píxeles de la unión la diferencia
+# ya no llegaba a un nivel de gris; se deja margen sobre eso
+INPAINT_REACH = 256
+# El filtro bilateral final (d=5) lee 2 píxeles alrededor
+BILATERAL_HALO = 2
+
+
+def tile_halo(options):
+    """Margen de cada tesela: lo que necesitan los detectores activos, el inpaint y el bilateral
+
+    Las etapas se encadenan, así que sus alcances se suman: el inpaint de un
+    píxel del núcleo lee la máscara hasta INPAINT_REACH, y esa máscara tiene
+    que salir igual que en la página entera.
+    """
+    halo = 0
+    if options.remove_blue_lines:
+        halo = max(halo, BLUE_LINES_HALO)
+    if options.remove_seals:
+        halo = max(halo, SEALS_HALO)
+    if options.remove_signatures:
+        halo = max(halo, SIGNATURES_HALO)
+    if halo:
+        halo += INPAINT_REACH
+        if options.smoothing == 'band':
+            # La franja suavizada alrededor de lo rellenado
+            halo += SMOOTHING_BAND
+    return halo + BILATERAL_HALO
+
+
+def needs_tiles(shape, options):
+    return bool(options.tile_size) and max(shape[:2]) > options.tile_size
+
+
+def page_tiles(shape, tile_size, halo):
+    """Teselas de una página de tamaño `shape`
+
+    Genera tuplas ((y, y_end, x, x_end), (top, bottom, left, right)): la
+    parte de la página que le toca a la tesela y lo que se lee alrededor,
+    recortado en los bordes de la página.
+    """
+    height, width = shape[:2]
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            y_end, x_end = min(y + tile_size, height), min(x + tile_size, width)
+            yield (y, y_end, x, x_end), (max(y - halo, 0), min(y_end + halo, height),
+                                         max(x - halo, 0), min(x_end + halo, width))
+
+
+def clean_image_tiled(img, options, template=None):
+    """clean_image por teselas cuando la página pasa de options.tile_size
+
+    Cada tesela se limpia con su margen (tile_halo) y del resultado solo se
+    copia la parte que le toca, así que las uniones quedan igual que si se
+    hubiera limpiado la página entera. Fuera de la página original y el
+    resultado, la memoria de trabajo (gris, HSV, máscaras, inpaint,
+    bilateral) es la de options.tile_threads teselas a la vez. Las
+    plantillas de máscaras son de página entera y no se usan por teselas.
+    """
+    if not needs_tiles(img.shape, options):
+        return clean_image(img, options, template)
+
+    halo = tile_halo(options)
+    tile_options = replace(options, tile_size=0)
+    page = current_page()
+    budget = current_budget()
+    result = np.empty_like(img)
+    mask = np.zeros(img.shape[:2], dtype=np.uint8)
+
+    def clean_tile(tile):
+        _, (top, bottom, left, right) = tile
+        # Cada tesela mide en su propio PageMetrics: los hilos no comparten la
+        # página; el plazo sí es el de la página entera
+        with measuring(PageMetrics(page.file, page.page) if page is not None else None) as metrics, \
+                using_budget(budget):
+            cleaned, tile_mask = clean_image(img[top:bottom, left:right], tile_options)
+        return tile, cleaned, tile_mask, metrics
+
+    coverage, covered_pixels = {}, 0
+    with ThreadPoolExecutor(max_workers=max(1, options.tile_threads)) as pool:
+        for tile, cleaned, tile_mask, metrics in pool.map(clean_tile, page_tiles(img.shape, options.tile_size, halo)):
+            if cleaned is None:
+                return None, None
+            (y, y_end, x, x_end), (top, _, left, _) = tile
+            core = (slice(y - top, y_end - top), slice(x - left, x_end - left))
+            result[y:y_end, x:x_end] = cleaned[core]
+            mask[y:y_end, x:x_end] = tile_mask[core]
+            if page is not None:
+                for name, seconds in metrics.stages.items():
+                    page.stages[name] = page.stages.get(name, 0.0) + seconds
+                # Cobertura de cada detector ponderada por el tamaño de la
+                # tesela (aproximada: los márgenes cuentan en dos teselas)
+                pixels = tile_mask.size
+                for name, fraction in metrics.coverage.items():
+                    coverage[name] = coverage.get(name, 0.0) + fraction * pixels
+                covered_pixels += pixels
+    if page is not None and covered_pixels:
+        for name, weighted in coverage.items():
+            page.coverage[name] = round(weighted / covered_pixels, 6)
+    record_coverage('total', mask)
+    return result, mask
@@ -0,0 +1,101 @@
+from dataclasses import replace
+
+import cv2
+import numpy as np
+
+# Escala de la miniatura respecto a la página renderizada
+TRIAGE_SCALE = 0.25
+# Píxeles de color en la miniatura a partir de los cuales un detector puede actuar
+TRIAGE_MIN_COLOR_PIXELS = 2
+# Holgura sobre los límites de tamaño de los detectores: la miniatura solo
+# aproxima la geometría de la página, y ante la duda la página se procesa
+TRIAGE_SIZE_SLACK = 2.0
+# Color más tenue que cuentan los rangos de abajo (saturación y brillo
+# mínimos); por debajo, una página se puede tratar en gris
+GRAY_MAX_COLOR = ([0, 25, 50], [180, 255, 255])
+
+
+def thumbnail(img, scale=TRIAGE_SCALE):
+    """Miniatura de una página ya rasterizada"""
+    return cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+def is_gray(thumb):
+    """¿No hay en la miniatura color que puedan buscar los detectores de color?
+
+    Usa el color más tenue que el triage consideraría línea azul o sello
+    rojo, de cualquier tono: en una página así el triage ya descartaría
+    esos detectores, y se puede limpiar en gris sin perder nada.
+    """
+    if thumb.ndim == 2:
+        return True
+    hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV)
+    return _color_pixels(hsv, [GRAY_MAX_COLOR]) < TRIAGE_MIN_COLOR_PIXELS
+
+
+def _color_pixels(hsv, ranges):
+    count = 0
+    for lower, upper in ranges:
+        count += cv2.countNonZero(cv2.inRange(hsv, np.array(lower), np.array(upper)))
+    return count
+
+
+def _shape_candidates(gray, scale):
+    """Contar contornos con tamaño de sello circular y de firma"""
+    # Mismo umbral adaptativo que signatures_mask; el cierre es menor porque
+    # en la miniatura uno grande fundiría líneas enteras de texto
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                cv2.THRESH_BINARY_INV, 11, 2)
+    if not cv2.countNonZero(ink):
+        return 0, 0
+    ink = cv2.morphologyEx(ink, cv2.MORPH_CLOSE, np.ones((2, 2), np.uint8))
+    contours, _ = cv2.findContours(ink, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    slack = TRIAGE_SIZE_SLACK
+    # Diámetros de seals_mask (radios 20-150 más el margen de 10)
+    min_diameter, max_diameter = 40 * scale / slack, 320 * scale * slack
+    # Áreas de signatures_mask
+    min_area, max_area = 500 * scale * scale / slack, 15000 * scale * scale * slack
+
+    circles = signatures = 0
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        if min_diameter <= max(w, h) <= max_diameter and 0.5 <= w / h <= 2:
+            circles += 1
+        if w * h >= min_area and cv2.contourArea(contour) <= max_area and 1.2 < w / h < 10:
+            signatures += 1
+    return circles, signatures
+
+
+def triage_page(thumb, options, scale=TRIAGE_SCALE):
+    """Decidir sobre una miniatura qué detectores pueden encontrar algo
+
+    Devuelve una copia de las opciones con los detectores que no tienen nada
+    que buscar desactivados, o None si ninguno puede actuar y la página
+    puede pasar sin limpiar. Es una criba conservadora: solo descarta un
+    detector cuando en la miniatura no hay ni el color ni las formas que
+    necesita.
+    """
+    # Una miniatura en gris no tiene color: solo se buscan formas
+    hsv = cv2.cvtColor(thumb, cv2.COLOR_BGR2HSV) if thumb.ndim == 3 else None
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY) if thumb.ndim == 3 else thumb
+
+    blue = red = circles = signatures = 0
+    if options.remove_blue_lines and hsv is not None:
+        # Saturación más baja que en blue_lines_mask: en la miniatura una
+        # línea fina se mezcla con el papel
+        blue = _color_pixels(hsv, [([90, 25, 50], [130, 255, 255])])
+    if options.remove_seals and hsv is not None:
+        red = _color_pixels(hsv, [([0, 60, 60], [10, 255, 255]), ([160, 60, 60], [180, 255, 255])])
+    if options.remove_seals or options.remove_signatures:
+        circles, signatures = _shape_candidates(gray, scale)
+
+    page_options = replace(
+        options,
+        remove_blue_lines=options.remove_blue_lines and blue >= TRIAGE_MIN_COLOR_PIXELS,
+        remove_seals=options.remove_seals and (red >= TRIAGE_MIN_COLOR_PIXELS or circles > 0),
+        remove_signatures=options.remove_signatures and signatures > 0,
+    )
+    if not (page_options.remove_blue_lines or page_options.remove_seals or page_options.remove_signatures):
+        return None
+    return page_options
@@ -0,0 +1,182 @@
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .engine import (
+    SUPPORTED_EXTENSIONS,
+    clean_file_to_path,
+    create_page_pool,
+    output_path_for,
+    resolve_workers,
+)
+from .metrics import MetricsRecorder
+
+# Cada cuántos segundos se revisa la carpeta
+WATCH_INTERVAL = 2.0
+# Segundos que un archivo tiene que pasar sin cambiar para darlo por completo
+SETTLE_SECONDS = 5.0
+# Subcarpetas de la carpeta vigilada adonde se mueven las entradas ya tratadas
+DONE_DIRNAME = "procesados"
+FAILED_DIRNAME = "errores"
+
+
+class _TakenPaths(set):
+    """Rutas ocupadas: las usadas en esta sesión y las que ya existen en disco"""
+
+    def __contains__(self, path):
+        return set.__contains__(self, path) or os.path.exists(path)
+
+
+def _readable(path):
+    # En Windows un archivo que otro proceso sigue escribiendo no se puede abrir
+    try:
+        with open(path, 'rb'):
+            return True
+    except OSError:
+        return False
+
+
+def _move_to(path, directory):
+    """Mover un archivo a `directory` sin pisar otro con el mismo nombre"""
+    os.makedirs(directory, exist_ok=True)
+    name = Path(path)
+    target = os.path.join(directory, name.name)
+    copy = 2
+    while os.path.exists(target):
+        target = os.path.join(directory, f"{name.stem}-{copy}{name.suffix}")
+        copy += 1
+    shutil.move(path, target)
+    return target
+
+
+class FolderWatcher:
+    """Vigilar una carpeta y limpiar cada archivo en cuanto termina de llegar
+
+    La carpeta (sin subcarpetas) se revisa cada `interval` segundos. Un
+    archivo se da por completo cuando su tamaño y su fecha de modificación
+    llevan `settle` segundos sin cambiar: el escáner o la copia por red
+    pueden tardar en escribirlo. Su PDF limpio se escribe en `output_dir`
+    con el nombre de options.output_name, sin pisar salidas que ya existan,
+    y la entrada se mueve a `done_dir` (o a `failed_dir` si falla), así que
+    al reiniciar no se repite. Se limpian options.file_workers archivos a la
+    vez sobre un único pool de páginas; con options.journal_dir, un archivo
+    que se quedó a medias al parar se reanuda al volver a arrancar.
+    """
+
+    def __init__(self, watch_dir, output_dir, options, events=None, interval=WATCH_INTERVAL,
+                 settle=SETTLE_SECONDS, done_dir=None, failed_dir=None):
+        if os.path.abspath(output_dir) == os.path.abspath(watch_dir):
+            raise ValueError("la carpeta de salida no puede ser la carpeta vigilada")
+        self.watch_dir = watch_dir
+        self.output_dir = output_dir
+        self.options = options
+        self.events = events
+        self.interval = interval
+        self.settle = settle
+        self.done_dir = done_dir or os.path.join(watch_dir, DONE_DIRNAME)
+        self.failed_dir = failed_dir or os.path.join(watch_dir, FAILED_DIRNAME)
+        self.stop_event = threading.Event()
+        self.results = []
+        # Tamaño y fecha de cada archivo en la última revisión, y desde cuándo no cambian
+        self._seen = {}
+        self._active = set()
+        # Entradas que no se pudieron apartar, con su tamaño y fecha: no se vuelven a limpiar
+        self._stuck = {}
+        self._taken = _TakenPaths()
+        self._lock = threading.Lock()
+
+    def scan(self):
+        """Revisar la carpeta y devolver los archivos nuevos que ya terminaron de llegar"""
+        now = time.monotonic()
+        seen = {}
+        with os.scandir(self.watch_dir) as entries:
+            for entry in entries:
+                if (entry.name.startswith('.') or not entry.is_file()
+                        or Path(entry.name).suffix.lower() not in SUPPORTED_EXTENSIONS):
+                    continue
+                with self._lock:
+                    if entry.path in self._active:
+                        continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # Se ha movido o borrado mientras tanto
+                    continue
+                signature = (stat.st_size, stat.st_mtime_ns)
+                if self._stuck.get(entry.path) == signature:
+                    continue
+                previous = self._seen.get(entry.path)
+                since = previous[1] if previous is not None and previous[0] == signature else now
+                seen[entry.path] = (signature, since)
+        self._seen = seen
+        return [path for path, ((size, _), since) in sorted(seen.items())
+                if size and now - since >= self.settle and _readable(path)]
+
+    def clean(self, path, pool=None, recorder=None):
+        """Limpiar un archivo de la carpeta y apartar la entrada según el resultado"""
+        with self._lock:
+            output_path = output_path_for(path, self.output_dir, self._taken, self.options.output_name)
+            self._taken.add(output_path)
+        try:
+            result = clean_file_to_path(path, output_path, self.options, events=self.events,
+                                        pool=pool, recorder=recorder)
+            if not result.ok and self.stop_event.is_set():
+                # Interrumpido al parar: la entrada se queda y se reanuda al volver a arrancar
+                print(f"⏸️ {path}: {result.error}")
+                return result
+            try:
+                _move_to(path, self.done_dir if result.ok else self.failed_dir)
+            except OSError as e:
+                print(f"Error moviendo {path}: {e} (no se volverá a limpiar mientras no cambie)")
+                self._remember_stuck(path)
+            if result.ok:
+                print(f"✅ {path} -> {result.output_path} ({result.pages} páginas)")
+            else:
+                print(f"❌ {path}: {result.error}")
+            with self._lock:
+                self.results.append(result)
+            return result
+        finally:
+            with self._lock:
+                self._active.discard(path)
+
+    def _remember_stuck(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._stuck[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def run(self):
+        """Vigilar hasta que se llame a stop() (o llegue un KeyboardInterrupt)
+
+        Al parar se terminan los archivos en curso y se descartan los que
+        esperaban turno: siguen en la carpeta y se tratarán al volver a arrancar.
+        Los que se cortan a medias (Ctrl-C) tampoco se apartan.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        pool = create_page_pool(self.options) if resolve_workers(self.options) > 1 else None
+        recorder = MetricsRecorder.from_options(self.options)
+        files = ThreadPoolExecutor(max_workers=max(1, self.options.file_workers))
+        try:
+            while not self.stop_event.is_set():
+                for path in self.scan():
+                    with self._lock:
+                        self._active.add(path)
+                    files.submit(self.clean, path, pool, recorder)
+                self.stop_event.wait(self.interval)
+        finally:
+            # También con Ctrl-C: los archivos que se corten se quedan en la carpeta
+            self.stop_event.set()
+            files.shutdown(wait=True, cancel_futures=True)
+            if pool is not None:
+                pool.shutdown()
+            if recorder is not None:
+                recorder.close()
+
+    def stop(self):
+        self.stop_event.set()
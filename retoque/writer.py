@@ -0,0 +1,243 @@
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import fitz  # PyMuPDF
+
+from .encoders import encode_page
+from .options import CleaningOptions
+
+# Páginas acumuladas en memoria antes de volcarlas al archivo de salida
+FLUSH_EVERY_PAGES = 16
+
+
+def _encode_page_measured(img, options, metrics):
+    """encode_page sumando su duración a las métricas de la página, si las hay"""
+    start = time.perf_counter()
+    encoded = encode_page(img, options)
+    if metrics is not None:
+        metrics.stages['encode'] = round(time.perf_counter() - start, 6)
+    return encoded
+
+
+class PdfPageWriter:
+    """Escribir páginas limpias a un PDF a medida que llegan, con memoria acotada
+
+    Cada página se codifica según options.page_encoder; con encode_threads > 1
+    la codificación corre en hilos (OpenCV y Pillow sueltan el GIL) y las
+    páginas se insertan en orden. Cada FLUSH_EVERY_PAGES páginas el documento
+    se guarda (de forma incremental después de la primera vez) y se vuelve a
+    abrir desde disco, para que PyMuPDF no retenga en memoria las imágenes ya
+    escritas; al cerrar se reescribe entero, así que el tamaño final no
+    depende de cada cuánto se volcó. Con un MetricsRecorder en `recorder`, las métricas de cada
+    página se completan con la codificación y el guardado y se le entregan
+    al insertarla. Las páginas que llegan con un JobJournal se guardan en él
+    ya codificadas; los diarios de `journals` se borran al cerrar bien el
+    PDF y se conservan si se descarta.
+    """
+
+    def __init__(self, output_path, options=None, flush_every=FLUSH_EVERY_PAGES, recorder=None):
+        self.output_path = output_path
+        self.options = options or CleaningOptions()
+        self.flush_every = flush_every
+        self.recorder = recorder
+        # Se escribe a un archivo temporal y se renombra al cerrar
+        self.partial_path = output_path + ".part"
+        self.compact_path = output_path + ".compact.part"
+        self.page_count = 0
+        # Páginas que add_page dio por añadidas y luego no se pudieron
+        # codificar (solo con encode_threads > 1), por su metrics.status
+        self.failed_pages = Counter()
+        self._pending = 0
+        self._saved = False
+        self._incremental = False
+        self.journals = []
+        self._doc = fitz.open()
+        self._encoding = deque()
+        self._encoder = None
+        if self.options.encode_threads > 1:
+            self._encoder = ThreadPoolExecutor(max_workers=self.options.encode_threads)
+
+    def add_page(self, img, metrics=None, journal=None, page_num=None):
+        """Codificar una imagen OpenCV y añadirla como página nueva
+
+        Con `journal`, la página codificada se guarda en él como `page_num`.
+        Devuelve False si la página no se pudo codificar; con encode_threads
+        > 1 la codificación termina después y sus fallos quedan en
+        failed_pages (ver wait_encoded).
+        """
+        if self._encoder is None:
+            try:
+                self._insert(_encode_page_measured(img, self.options, metrics), metrics, journal, page_num)
+            except Exception as e:
+                print(f"Error codificando imagen {self.page_count}: {e}")
+                return False
+            return True
+
+        future = self._encoder.submit(_encode_page_measured, img, self.options, metrics)
+        self._enqueue(future, metrics, journal, page_num)
+        return True
+
+    def add_encoded(self, encoded, metrics=None):
+        """Añadir una página ya codificada (p. ej. recuperada del diario), en su turno"""
+        if self._encoder is None:
+            self._insert(encoded, metrics)
+            return True
+        future = Future()
+        future.set_result(encoded)
+        self._enqueue(future, metrics)
+        return True
+
+    def _enqueue(self, future, metrics, journal=None, page_num=None):
+        self._encoding.append((future, metrics, journal, page_num))
+        # Como mucho dos páginas por hilo esperando a ser codificadas
+        while self._encoding and (self._encoding[0][0].done()
+                                  or len(self._encoding) > 2 * self.options.encode_threads):
+            self._insert_next()
+
+    def _insert_next(self):
+        future, metrics, journal, page_num = self._encoding.popleft()
+        try:
+            self._insert(future.result(), metrics, journal, page_num)
+        except Exception as e:
+            print(f"Error codificando imagen {self.page_count}: {e}")
+            self.failed_pages[getattr(metrics, 'status', None)] += 1
+
+    def wait_encoded(self):
+        """Insertar las páginas que aún se están codificando
+
+        Después, failed_pages cuenta todas las que fallaron.
+        """
+        while self._encoding:
+            self._insert_next()
+
+    def _insert(self, encoded, metrics=None, journal=None, page_num=None):
+        start = time.perf_counter()
+        if journal is not None:
+            try:
+                journal.save(page_num, encoded)
+            except OSError as e:
+                print(f"Error guardando la página {page_num + 1} en el diario: {e}")
+        page = self._doc.new_page(width=encoded.width, height=encoded.height)
+        if encoded.image is not None:
+            page.insert_image(page.rect, stream=encoded.image)
+        if encoded.g4 is not None:
+            page.insert_image(page.rect, xref=self._add_g4_image(encoded))
+        self.page_count += 1
+        self._pending += 1
+
+        if self._pending >= self.flush_every:
+            self.flush()
+
+        if metrics is not None and self.recorder is not None:
+            metrics.stages['save'] = round(time.perf_counter() - start, 6)
+            self.recorder.record(metrics)
+
+    def _add_g4_image(self, encoded):
+        """Crear un objeto imagen CCITT G4 sin recomprimir los datos"""
+        doc = self._doc
+        xref = doc.get_new_xref()
+        doc.update_object(xref, "<< >>")
+        doc.update_stream(xref, encoded.g4, compress=False)
+        doc.xref_set_key(xref, "Type", "/XObject")
+        doc.xref_set_key(xref, "Subtype", "/Image")
+        doc.xref_set_key(xref, "Width", str(encoded.width))
+        doc.xref_set_key(xref, "Height", str(encoded.height))
+        doc.xref_set_key(xref, "BitsPerComponent", "1")
+        if encoded.kind == 'mrc':
+            # Máscara de texto: pinta en negro solo los píxeles de texto sobre el fondo
+            doc.xref_set_key(xref, "ImageMask", "true")
+            doc.xref_set_key(xref, "Decode", "[1 0]")
+            black_is_1 = "false"
+        else:
+            doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+            black_is_1 = "true"
+        doc.xref_set_key(xref, "Filter", "/CCITTFaxDecode")
+        doc.xref_set_key(xref, "DecodeParms",
+                         f"<< /K -1 /Columns {encoded.width} /Rows {encoded.height} /BlackIs1 {black_is_1} >>")
+        return xref
+
+    def flush(self):
+        """Volcar al archivo las páginas pendientes y liberar su memoria"""
+        if not self._pending:
+            return
+        if self._saved:
+            # Incremental, pero comprimiendo las imágenes nuevas: insert_image
+            # deja sin comprimir los PNG que PyMuPDF descodifica
+            self._doc.save(self.partial_path, incremental=True, deflate=True,
+                           encryption=fitz.PDF_ENCRYPT_KEEP)
+            self._incremental = True
+        else:
+            self._doc.save(self.partial_path, garbage=4, deflate=True, clean=True)
+            self._saved = True
+        self._doc.close()
+        self._doc = fitz.open(self.partial_path)
+        self._pending = 0
+
+    def close(self):
+        """Terminar el documento y moverlo a su ruta definitiva"""
+        self.wait_encoded()
+        self._shutdown_encoder()
+        if self.page_count == 0:
+            self.discard()
+            return False
+        start = time.perf_counter()
+        self.flush()
+        if self._incremental:
+            # Cada guardado incremental añade otra tabla xref, otra copia del
+            # árbol de páginas y otro perfil de color: el PDF final se
+            # reescribe entero desde disco, compacto
+            self._doc.save(self.compact_path, garbage=4, deflate=True, clean=True)
+            self._doc.close()
+            os.replace(self.compact_path, self.output_path)
+            os.remove(self.partial_path)
+        else:
+            self._doc.close()
+            os.replace(self.partial_path, self.output_path)
+        if self.recorder is not None:
+            self.recorder.add_stage('save', time.perf_counter() - start)
+        for journal in self.journals:
+            journal.finish()
+        return True
+
+    def discard(self):
+        """Abandonar el documento sin dejar archivos a medio escribir
+
+        Los diarios se conservan para reanudar el trabajo.
+        """
+        self._encoding.clear()
+        self._shutdown_encoder()
+        for journal in self.journals:
+            journal.close()
+        if not self._doc.is_closed:
+            self._doc.close()
+        for path in (self.partial_path, self.compact_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _shutdown_encoder(self):
+        if self._encoder is not None:
+            self._encoder.shutdown(cancel_futures=True)
+            self._encoder = None
+
+
+def create_pdf_from_images(images, output_path, options=None):
+    """Crear PDF desde imágenes procesadas"""
+    if not images:
+        return False
+
+    writer = PdfPageWriter(output_path, options)
+    try:
+        for img in images:
+            writer.add_page(img)
+        if not writer.close():
+            return False
+
+        print(f"PDF creado exitosamente con {writer.page_count} páginas")
+        return True
+
+    except Exception as e:
+        print(f"Error al crear PDF: {e}")
+        writer.discard()
+        return False
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+import time
+
+from retoque.benchmark import run_case, wait_for_case
+from retoque.options import CleaningOptions
+
+
+def test_dead_case_process_is_reported_not_waited_for():
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    # Muere sin enviar nada a la cola
+    process = context.Process(target=os._exit, args=(3,))
+    process.start()
+    start = time.monotonic()
+    measured = wait_for_case(process, queue)
+    assert time.monotonic() - start < 30
+    assert measured['error'] and "3" in measured['error']
+    assert measured['seconds'] is None
+
+
+def test_case_without_supported_files_fails(tmp_path):
+    path = tmp_path / "notas.txt"
+    path.write_text("sin páginas")
+    case = run_case("notas", str(path), CleaningOptions(), str(tmp_path))
+    assert case['error']
+    assert case['pages'] == 0
+    assert case['pages_per_second'] is None
@@ -0,0 +1,61 @@
+import os
+import threading
+
+import numpy as np
+
+from retoque.cache import PageCache
+
+THREADS = 8
+PUTS = 20
+
+
+def _run_threads(target):
+    errors = []
+
+    def run(index):
+        try:
+            target(index)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return errors
+
+
+def _page(value):
+    return np.full((200, 150, 3), value, np.uint8), np.zeros((200, 150), np.uint8)
+
+
+def _files(directory):
+    return [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+
+
+def test_threads_writing_the_same_key(tmp_path):
+    cache = PageCache(str(tmp_path), 1024 * 1024 * 1024)
+    key = "ab" * 32
+
+    def put(index):
+        for _ in range(PUTS):
+            cache.put(key, *_page(index))
+
+    assert _run_threads(put) == []
+    # Sin temporales a medias y con una entrada entera
+    assert [os.path.basename(path) for path in _files(tmp_path)] == [key + ".png"]
+    cleaned, mask = cache.get(key)
+    assert cleaned.shape == (200, 150, 3) and mask.shape == (200, 150)
+
+
+def test_size_is_tracked_across_threads(tmp_path):
+    cache = PageCache(str(tmp_path), 1024 * 1024 * 1024)
+    cache.evict()
+
+    def put(index):
+        for number in range(PUTS):
+            cache.put(f"{index:02d}{number:062d}", *_page(index))
+
+    assert _run_threads(put) == []
+    assert cache._size == sum(os.path.getsize(path) for path in _files(tmp_path))
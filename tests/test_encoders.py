@@ -0,0 +1,43 @@
+import os
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+
+from retoque.encoders import choose_encoder
+from retoque.filters import clean_image
+from retoque.options import CleaningOptions
+from retoque.render import render_page
+
+SAMPLE_EXERCISE = os.path.join(os.path.dirname(__file__), os.pardir, "ejercicio pdf_0001.pdf")
+OPTIONS = CleaningOptions(remove_seals=False)
+
+
+def _text_page(color):
+    img = np.full((1000, 800, 3), 255, np.uint8)
+    for y in range(50, 950, 30):
+        cv2.putText(img, "Lorem ipsum dolor sit amet", (30, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    color, 1, cv2.LINE_AA)
+    return img
+
+
+def test_black_text_is_bilevel():
+    assert choose_encoder(_text_page((0, 0, 0))) == 'g4'
+
+
+def test_inpainted_light_page_is_not_bilevel():
+    # Trazos a lápiz tachados por renglones azules: tras el inpaint solo quedan grises claros
+    img = _text_page((150, 150, 150))
+    for y in range(57, 950, 30):
+        cv2.line(img, (20, y), (780, y), (190, 95, 35), 2)
+    cleaned, mask = clean_image(img, OPTIONS)
+    assert np.count_nonzero(mask)
+    assert choose_encoder(cleaned) != 'g4'
+
+
+def test_cleaned_sample_pages_are_not_bilevel():
+    # Las páginas del ejercicio solo tienen trazos claros: en G4 el relleno saldría negro
+    with fitz.open(SAMPLE_EXERCISE) as doc:
+        for page in doc:
+            cleaned, _ = clean_image(render_page(page, OPTIONS), OPTIONS)
+            assert choose_encoder(cleaned) != 'g4', page.number
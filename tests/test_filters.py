@@ -0,0 +1,110 @@
+import os
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+from retoque.benchmark import synthetic_page
+from retoque.filters import blue_lines_mask, build_cleaning_mask, detect_seals, signatures_mask
+from retoque.options import CleaningOptions
+from retoque.render import render_page
+
+SAMPLE_SCAN = os.path.join(os.path.dirname(__file__), os.pardir, "Scan test pdf_0001.pdf")
+SAMPLE_EXERCISE = os.path.join(os.path.dirname(__file__), os.pardir, "ejercicio pdf_0001.pdf")
+
+
+def _iou(a, b):
+    a, b = a > 0, b > 0
+    union = np.count_nonzero(a | b)
+    return np.count_nonzero(a & b) / union if union else 1.0
+
+
+@pytest.fixture(scope='module')
+def scan_page():
+    # A escala 1: a 2 la búsqueda de círculos a resolución completa tarda casi un minuto
+    with fitz.open(SAMPLE_SCAN) as doc:
+        return render_page(doc[0], CleaningOptions(), scale=1.0)
+
+
+def test_proxy_seals_match_full_resolution(scan_page):
+    full = detect_seals(scan_page)
+    proxy = detect_seals(scan_page, detection_scale=0.5)
+    assert proxy.shape == full.shape
+    assert _iou(proxy, full) >= 0.9
+
+
+def test_proxy_only_changes_seals(scan_page):
+    options = CleaningOptions(remove_seals=False, fused_masks=True)
+    full = build_cleaning_mask(scan_page, options)
+    proxy = build_cleaning_mask(scan_page, CleaningOptions(remove_seals=False, fused_masks=True,
+                                                           detection_scale=0.5))
+    assert np.count_nonzero(full)
+    np.testing.assert_array_equal(proxy, full)
+
+
+def _reference_signatures_mask(gray, exclude=None):
+    """signatures_mask de antes, un contorno cada vez con las funciones de OpenCV"""
+    thresh = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                   cv2.THRESH_BINARY_INV, 11, 2)
+    if exclude is not None:
+        thresh[exclude > 0] = 0
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    morph = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel, iterations=2)
+    contours, _ = cv2.findContours(morph, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    mask = np.zeros(gray.shape, dtype=np.uint8)
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        x, y, w, h = cv2.boundingRect(contour)
+        aspect_ratio = w / float(h) if h > 0 else 0
+        if 500 < area < 15000 and 1.5 < aspect_ratio < 8:
+            roi = thresh[y:y+h, x:x+w]
+            density = np.sum(roi > 0) / (w * h) if (w * h) > 0 else 0
+            if 0.05 < density < 0.4:
+                cv2.drawContours(mask, [contour], -1, 255, -1)
+                cv2.rectangle(mask, (x-5, y-5), (x+w+5, y+h+5), 255, -1)
+    return cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=2)
+
+
+def _sample_pages():
+    for path in (SAMPLE_SCAN, SAMPLE_EXERCISE):
+        with fitz.open(path) as doc:
+            for page in doc:
+                yield render_page(page, CleaningOptions())
+
+
+def _scribbles(rng):
+    """Página con garabatos de varios tamaños: unos pasan los filtros de firma y otros no"""
+    # Sin ruido de escáner: con él el umbral adaptativo junta toda la página en un contorno
+    img = np.full((1400, 1000, 3), 245, np.uint8)
+    for _ in range(40):
+        width, height = rng.integers(30, 400), rng.integers(10, 120)
+        x, y = rng.integers(0, 1000 - width), rng.integers(0, 1400 - height)
+        steps = rng.normal(0, 1, (int(rng.integers(20, 120)), 2)).cumsum(axis=0)
+        steps = (steps - steps.min(axis=0)) / np.ptp(steps, axis=0).clip(1e-6)
+        points = (steps * (width, height) + (x, y)).astype(np.int32)
+        cv2.polylines(img, [points], False, (110, 40, 25), int(rng.integers(1, 4)), cv2.LINE_AA)
+    return img
+
+
+def _synthetic_pages():
+    for dpi in (100, 200):
+        yield synthetic_page(dpi, np.random.default_rng(dpi))
+    for seed in range(6):
+        yield _scribbles(np.random.default_rng(seed))
+
+
+@pytest.mark.parametrize('pages', [_sample_pages, _synthetic_pages])
+def test_signatures_match_reference_loop(pages):
+    selected = 0
+    for img in pages():
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        expected = _reference_signatures_mask(gray)
+        np.testing.assert_array_equal(signatures_mask(gray), expected)
+        selected += bool(np.count_nonzero(expected))
+        # Con lo ya marcado por otro detector fuera del umbral, como en build_cleaning_mask
+        exclude = blue_lines_mask(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+        np.testing.assert_array_equal(signatures_mask(gray, exclude),
+                                      _reference_signatures_mask(gray, exclude))
+    # Que la comparación no sea entre máscaras vacías
+    assert selected
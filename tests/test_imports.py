@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from retoque.benchmark import HEAVY_MODULES, LIGHT_IMPORTS
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def _heavy_after(statement):
+    """Bibliotecas pesadas cargadas tras ejecutar `statement` en un intérprete nuevo"""
+    code = (f"import json, sys\n{statement}\n"
+            f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))\n")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, (ROOT, env.get('PYTHONPATH'))))
+    output = subprocess.run([sys.executable, "-c", code], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', LIGHT_IMPORTS)
+def test_light_imports_load_no_heavy_modules(module):
+    assert _heavy_after(f"import {module}") == []
+
+
+def test_options_from_package_load_no_heavy_modules():
+    # Los nombres ligeros del paquete no arrastran a los pesados al pedirlos
+    assert _heavy_after("from retoque import CleaningOptions, SMOOTHING_MODES") == []
@@ -0,0 +1,61 @@
+import os
+
+import fitz  # PyMuPDF
+import pytest
+
+from retoque.engine import clean_file_to_path
+from retoque.options import CleaningOptions
+
+PAGES = 4
+
+
+def _source(tmp_path):
+    doc = fitz.open()
+    for number in range(PAGES):
+        page = doc.new_page(width=200, height=300)
+        page.insert_text((40, 150), f"Hoja {number + 1}", fontsize=24)
+    path = str(tmp_path / "entrada.pdf")
+    doc.save(path)
+    doc.close()
+    return path
+
+
+def _fail_at(page):
+    def progress(done, total):
+        if done == page:
+            raise RuntimeError("fallo a mitad del documento")
+    return progress
+
+
+def _journal_pages(journal_dir):
+    (job,) = os.listdir(journal_dir)
+    job_dir = os.path.join(journal_dir, job)
+    return sorted(os.path.join(job_dir, name) for name in os.listdir(job_dir) if name.endswith(".pickle"))
+
+
+@pytest.mark.parametrize('output_mode', ['raster', 'patch'])
+def test_mid_document_error_keeps_journal_and_resumes(tmp_path, output_mode):
+    source = _source(tmp_path)
+    journal_dir = str(tmp_path / "diario")
+    output_dir = tmp_path / "salida"
+    output_path = str(output_dir / "entrada_limpio.pdf")
+    options = CleaningOptions(render_scale=1.0, journal_dir=journal_dir, output_mode=output_mode)
+
+    result = clean_file_to_path(source, output_path, options, progress=_fail_at(3))
+    # Sin PDF a medias dado por bueno, y con el diario para reanudar
+    assert not result.ok
+    assert os.listdir(output_dir) == []
+    saved = _journal_pages(journal_dir)
+    # La página 3 puede no haber llegado al diario si aún se estaba codificando
+    assert len(saved) >= 2
+
+    # Una página del diario ilegible se vuelve a limpiar
+    with open(saved[1], 'wb') as f:
+        f.write(b"no es un pickle")
+    result = clean_file_to_path(source, output_path, options)
+    assert result.ok, result.error
+    assert result.pages == PAGES
+    with fitz.open(output_path) as doc:
+        assert len(doc) == PAGES
+        assert "Hoja 2" in doc[1].get_text() or output_mode == 'raster'
+    assert os.listdir(journal_dir) == []
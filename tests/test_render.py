@@ -0,0 +1,32 @@
+import gc
+import os
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+from retoque.options import CleaningOptions
+from retoque.render import render_page
+
+SAMPLES = [os.path.join(os.path.dirname(__file__), os.pardir, name)
+           for name in ("Scan test pdf_0001.pdf", "ejercicio pdf_0001.pdf")]
+
+
+def _ppm_render(page, scale):
+    """Render de antes: codificar el pixmap a PPM y decodificarlo con OpenCV"""
+    pix = page.get_pixmap(matrix=fitz.Matrix(scale, scale))
+    return cv2.imdecode(np.frombuffer(pix.tobytes("ppm"), np.uint8), cv2.IMREAD_COLOR)
+
+
+@pytest.mark.parametrize('sample', SAMPLES)
+@pytest.mark.parametrize('scale', [1.0, 1.37, 2.0])
+def test_render_matches_ppm_decode(sample, scale):
+    with fitz.open(sample) as doc:
+        page = doc[0]
+        img = render_page(page, CleaningOptions(), scale=scale)
+        expected = _ppm_render(page, scale)
+    # El array sigue siendo válido con el documento ya cerrado
+    gc.collect()
+    assert img.dtype == np.uint8
+    np.testing.assert_array_equal(img, expected)
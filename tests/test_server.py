@@ -0,0 +1,202 @@
+import http.client
+import io
+import json
+import re
+import threading
+import time
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+from retoque.options import CleaningOptions
+from retoque.server import JOB_DONE, RECEIVE_CHUNK, JobError, JobHTTPServer, JobServer
+
+MAX_UPLOAD = 1024 * 1024
+
+
+def _sample_pdf():
+    """PDF de una página pequeña con dos renglones azules"""
+    img = np.full((300, 220, 3), 245, np.uint8)
+    cv2.putText(img, "texto", (20, 100), cv2.FONT_HERSHEY_SIMPLEX, 1, (30, 30, 30), 2)
+    for y in (110, 200):
+        cv2.line(img, (10, y), (210, y), (190, 95, 35), 2)
+    data = cv2.imencode('.png', img)[1].tobytes()
+    doc = fitz.open()
+    page = doc.new_page(width=220, height=300)
+    page.insert_image(page.rect, stream=data)
+    pdf = doc.tobytes()
+    doc.close()
+    return pdf
+
+
+@pytest.fixture
+def server(tmp_path):
+    options = CleaningOptions(remove_seals=False, remove_signatures=False, render_scale=1.0,
+                              prometheus_path=str(tmp_path / "retoque.prom"))
+    jobs = JobServer(options, str(tmp_path / "spool"), max_queued=2)
+    httpd = JobHTTPServer(("127.0.0.1", 0), jobs, MAX_UPLOAD)
+    jobs.start()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield httpd
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        jobs.close()
+
+
+def _connect(httpd):
+    return http.client.HTTPConnection("127.0.0.1", httpd.server_port, timeout=30)
+
+
+def _request(connection, method, path, body=None):
+    connection.request(method, path, body=body)
+    response = connection.getresponse()
+    return response, response.read()
+
+
+def _wait_done(connection, job):
+    deadline = time.monotonic() + 60
+    while job['status'] != JOB_DONE:
+        assert job['status'] in ('queued', 'running'), job
+        assert time.monotonic() < deadline, job
+        time.sleep(0.1)
+        response, body = _request(connection, "GET", f"/jobs/{job['id']}")
+        assert response.status == 200
+        job = json.loads(body)
+    return job
+
+
+def test_submit_poll_and_fetch(server):
+    connection = _connect(server)
+    response, body = _request(connection, "POST", "/jobs?filename=hoja.pdf&smoothing=band", _sample_pdf())
+    assert response.status == 202
+    job = json.loads(body)
+    assert response.getheader("Location") == f"/jobs/{job['id']}"
+
+    # La misma conexión sigue sirviendo: sondear hasta que termine
+    job = _wait_done(connection, job)
+    assert job['pages'] == 1
+
+    response, body = _request(connection, "GET", job['result'])
+    assert response.status == 200
+    assert response.getheader("Content-Type") == "application/pdf"
+    assert 'hoja_limpio.pdf' in response.getheader("Content-Disposition")
+    with fitz.open(stream=body, filetype="pdf") as doc:
+        assert len(doc) == 1
+
+    response, _ = _request(connection, "DELETE", f"/jobs/{job['id']}")
+    assert response.status == 204
+    response, _ = _request(connection, "GET", f"/jobs/{job['id']}")
+    assert response.status == 404
+    connection.close()
+
+
+@pytest.mark.parametrize('query, key', [
+    ("page_encoder=webp", "page_encoder"),
+    ("output_mode=vector", "output_mode"),
+    ("smoothing=guided", "smoothing"),
+    ("detection_scale=0", "detection_scale"),
+    ("render_scale=0", "render_scale"),
+    ("jpeg_quality=101", "jpeg_quality"),
+    ("target_dpi=-5", "target_dpi"),
+    ("remove_seals=quizas", "remove_seals"),
+])
+def test_invalid_option_is_rejected(server, query, key):
+    connection = _connect(server)
+    response, body = _request(connection, "POST", f"/jobs?filename=hoja.pdf&{query}", _sample_pdf())
+    assert response.status == 400
+    assert key in json.loads(body)['error']
+    assert server.jobs.jobs() == []
+    connection.close()
+
+
+def test_unread_body_closes_connection(server):
+    connection = _connect(server)
+    # Solo las cabeceras: el servidor responde sin esperar al cuerpo
+    connection.putrequest("POST", "/jobs?filename=hoja.pdf")
+    connection.putheader("Content-Length", str(MAX_UPLOAD + 1))
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 413
+    assert response.getheader("Connection") == "close"
+    response.read()
+    connection.close()
+
+    connection = _connect(server)
+    connection.request("POST", "/desconocida", body=_sample_pdf())
+    response = connection.getresponse()
+    assert response.status == 404
+    assert response.getheader("Connection") == "close"
+    connection.close()
+
+
+def test_queue_limit(tmp_path):
+    # Sin start(): los trabajos se quedan en la cola
+    jobs = JobServer(CleaningOptions(), str(tmp_path / "spool"), max_queued=2)
+    refused = []
+    threads = [threading.Thread(target=_try_submit, args=(jobs, refused)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(jobs.jobs()) == 2
+    assert refused == [503] * 6
+    # Los rechazados no dejan su directorio en el spool
+    assert len(list((tmp_path / "spool").iterdir())) == 2
+    jobs.close()
+
+
+def _try_submit(jobs, refused):
+    try:
+        jobs.submit("hoja.pdf", _sample_pdf())
+    except JobError as e:
+        refused.append(e.status)
+
+
+def _pages_total(path):
+    with open(path, encoding='utf-8') as f:
+        return sum(int(value) for value in re.findall(r'^retoque_pages_total\{.*\} (\d+)$', f.read(), re.M))
+
+
+def test_metrics_accumulate_across_jobs(server, tmp_path):
+    connection = _connect(server)
+    for done in (1, 2):
+        response, body = _request(connection, "POST", "/jobs?filename=hoja.pdf", _sample_pdf())
+        assert response.status == 202
+        _wait_done(connection, json.loads(body))
+        # Los contadores siguen sumando: no vuelven a empezar en cada trabajo
+        assert _pages_total(tmp_path / "retoque.prom") == done
+    connection.close()
+
+
+class _RecordingReader(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return super().read(size)
+
+
+def test_upload_is_copied_in_chunks(tmp_path):
+    jobs = JobServer(CleaningOptions(), str(tmp_path / "spool"))
+    data = _sample_pdf() + b"\0" * (3 * RECEIVE_CHUNK)
+    body = _RecordingReader(data + "siguiente petición".encode())
+    job = jobs.submit("hoja.pdf", body, length=len(data))
+    with open(job.input_path, 'rb') as f:
+        assert f.read() == data
+    assert max(body.sizes) <= RECEIVE_CHUNK
+    # No lee más allá del cuerpo
+    assert body.read() == "siguiente petición".encode()
+
+    with pytest.raises(JobError) as error:
+        jobs.submit("hoja.pdf", io.BytesIO(data[:100]), length=len(data))
+    assert error.value.status == 400
+    # El trabajo incompleto no deja nada en el spool
+    assert [entry.name for entry in (tmp_path / "spool").iterdir()] == [job.id]
+    jobs.close()
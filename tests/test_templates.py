@@ -0,0 +1,61 @@
+import fitz  # PyMuPDF
+
+from retoque import engine
+from retoque.engine import PAGE_CLEANED, iter_pdf_pages
+from retoque.options import CleaningOptions
+
+OPTIONS = CleaningOptions(render_scale=1.0, template_masks=True, workers=1)
+
+
+def _source(path, text, pages=2):
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page(width=200, height=300)
+        page.insert_text((40, 150), text, fontsize=24)
+    doc.save(str(path))
+    doc.close()
+    return str(path)
+
+
+def _template_and_text(doc, page_num, options):
+    return (engine._document_template(doc, options), doc[page_num].get_text().strip()), PAGE_CLEANED
+
+
+def _run(path):
+    return [result for _, _, result, _, _ in iter_pdf_pages(path, OPTIONS, page_function=_template_and_text)]
+
+
+def test_each_pass_over_a_file_starts_a_new_template(tmp_path):
+    path = tmp_path / "entrada.pdf"
+    first = _run(_source(path, "Primero"))
+    # Mismo camino y mismo hilo, pero otro archivo
+    second = _run(_source(path, "Segundo"))
+
+    assert first[0][0] is first[1][0]
+    assert second[0][0] is second[1][0]
+    assert first[0][0] is not second[0][0]
+    assert [text for _, text in second] == ["Segundo", "Segundo"]
+
+
+def test_worker_reopens_a_replaced_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, '_worker_doc', None)
+    monkeypatch.setattr(engine, '_worker_doc_run', None)
+    path = tmp_path / "entrada.pdf"
+    try:
+        _source(path, "Primero")
+        (template, text), _, _ = engine._clean_pdf_page_in_worker(_template_and_text, str(path), 0,
+                                                                   OPTIONS, "trabajo-1")
+        assert text == "Primero"
+        (same, _), _, _ = engine._clean_pdf_page_in_worker(_template_and_text, str(path), 1,
+                                                           OPTIONS, "trabajo-1")
+        assert same is template
+
+        # Un archivo nuevo en el mismo camino: el proceso no debe seguir leyendo el viejo
+        _source(path, "Segundo")
+        (other, text), _, _ = engine._clean_pdf_page_in_worker(_template_and_text, str(path), 0,
+                                                               OPTIONS, "trabajo-2")
+        assert text == "Segundo"
+        assert other is not template
+    finally:
+        if engine._worker_doc is not None:
+            engine._worker_doc.close()
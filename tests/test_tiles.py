@@ -0,0 +1,71 @@
+import cv2
+import numpy as np
+import pytest
+
+from retoque.benchmark import synthetic_page
+from retoque.filters import clean_image
+from retoque.options import SMOOTHING_MODES, CleaningOptions
+from retoque.tiles import clean_image_tiled, needs_tiles
+
+TILE_SIZE = 500
+
+
+@pytest.mark.parametrize('dpi', [100, 150, 200])
+@pytest.mark.parametrize('smoothing', SMOOTHING_MODES)
+def test_tiles_match_whole_page_blue_lines(dpi, smoothing):
+    img = synthetic_page(dpi, np.random.default_rng(dpi))
+    options = CleaningOptions(remove_seals=False, remove_signatures=False, smoothing=smoothing,
+                              tile_size=TILE_SIZE)
+    assert needs_tiles(img.shape, options)
+    whole, whole_mask = clean_image(img, options)
+    tiled, tiled_mask = clean_image_tiled(img, options)
+    np.testing.assert_array_equal(tiled_mask, whole_mask)
+    np.testing.assert_array_equal(tiled, whole)
+
+
+@pytest.mark.parametrize('tile_threads', [1, 2])
+def test_tiles_match_whole_page_signatures(tile_threads):
+    # Los sellos (HoughCircles) quedan fuera: son lentos a esta resolución
+    img = synthetic_page(150, np.random.default_rng(7))
+    options = CleaningOptions(remove_seals=False, smoothing='band', tile_size=TILE_SIZE,
+                              tile_threads=tile_threads)
+    whole, whole_mask = clean_image(img, options)
+    tiled, tiled_mask = clean_image_tiled(img, options)
+    np.testing.assert_array_equal(tiled_mask, whole_mask)
+    np.testing.assert_array_equal(tiled, whole)
+
+
+
+def _form_with_seal(center, radius=65):
+    """Formulario de renglones azules con un sello rojo centrado en `center`
+
+    Sin texto: sobre texto denso HoughCircles encuentra cientos de círculos
+    falsos que se descartan unos a otros en cadena, y ese resultado no es
+    local (ver SEALS_HALO en tiles.py).
+    """
+    height, width = 2 * TILE_SIZE + 100, TILE_SIZE + 300
+    rng = np.random.default_rng(3)
+    img = np.clip(np.full((height, width, 3), 245.0) + rng.normal(0, 2, (height, width, 3)),
+                  0, 255).astype(np.uint8)
+    for y in range(80, height - 50, 40):
+        cv2.line(img, (60, y), (width - 60, y), (190, 95, 35), 1)
+    cv2.circle(img, center, radius, (45, 45, 200), 3, cv2.LINE_AA)
+    cv2.circle(img, center, int(radius * 0.72), (45, 45, 200), 1, cv2.LINE_AA)
+    cv2.putText(img, "SELLO", (center[0] - 28, center[1] + 6), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                (45, 45, 200), 1, cv2.LINE_AA)
+    return img
+
+
+@pytest.mark.parametrize('fused_masks', [False, True])
+def test_tiles_match_whole_page_seals(fused_masks):
+    # El sello queda en la esquina común de cuatro teselas
+    center, radius = (TILE_SIZE, TILE_SIZE), 65
+    img = _form_with_seal(center, radius)
+    options = CleaningOptions(remove_signatures=False, fused_masks=fused_masks, smoothing='band',
+                              tile_size=TILE_SIZE, tile_threads=2)
+    whole, whole_mask = clean_image(img, options)
+    tiled, tiled_mask = clean_image_tiled(img, options)
+    # Entre los dos aros solo llega el círculo relleno de HoughCircles
+    assert whole_mask[center[1] - int(radius * 0.85), center[0]]
+    np.testing.assert_array_equal(tiled_mask, whole_mask)
+    np.testing.assert_array_equal(tiled, whole)
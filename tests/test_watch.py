@@ -0,0 +1,75 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+import retoque.engine as engine_module
+import retoque.watch as watch_module
+from retoque.engine import FileResult, clean_file_to_path
+from retoque.options import CleaningOptions
+from retoque.watch import FolderWatcher
+
+OPTIONS = CleaningOptions(remove_seals=False, remove_signatures=False)
+
+
+def _image(path):
+    img = np.full((200, 150, 3), 240, np.uint8)
+    cv2.line(img, (10, 100), (140, 100), (190, 95, 35), 2)
+    cv2.imwrite(str(path), img)
+
+
+def test_interrupt_discards_partial_output(tmp_path, monkeypatch):
+    real = engine_module.clean_file_to_writer
+
+    def clean_file_to_writer(file_path, writer, *args):
+        real(file_path, writer, *args)
+        # Con el .part ya en disco, como a mitad de un PDF largo
+        writer.flush()
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(engine_module, 'clean_file_to_writer', clean_file_to_writer)
+    source = tmp_path / "hoja.png"
+    _image(source)
+    output_dir = tmp_path / "salida"
+    with pytest.raises(KeyboardInterrupt):
+        clean_file_to_path(str(source), str(output_dir / "hoja.pdf"), OPTIONS)
+    assert os.listdir(output_dir) == []
+
+
+def test_input_that_cannot_be_moved_is_not_cleaned_again(tmp_path, monkeypatch):
+    def _move_to(path, directory):
+        raise PermissionError("sin permiso")
+
+    monkeypatch.setattr(watch_module, '_move_to', _move_to)
+    watch_dir = tmp_path / "entrada"
+    watch_dir.mkdir()
+    source = watch_dir / "hoja.png"
+    _image(source)
+    watcher = FolderWatcher(str(watch_dir), str(tmp_path / "salida"), OPTIONS, settle=0)
+    assert watcher.scan() == [str(source)]
+    assert watcher.clean(str(source)).ok
+    assert watcher.scan() == []
+    assert len(os.listdir(tmp_path / "salida")) == 1
+
+    # Si el archivo cambia se vuelve a tratar
+    _image(source)
+    os.utime(source, ns=(0, 0))
+    assert watcher.scan() == [str(source)]
+
+
+def test_input_cut_short_by_stop_stays_in_folder(tmp_path, monkeypatch):
+    def clean_file_to_path(path, *args, **kwargs):
+        result = FileResult(path)
+        result.error = "A process in the process pool was terminated abruptly"
+        return result
+
+    monkeypatch.setattr(watch_module, 'clean_file_to_path', clean_file_to_path)
+    watch_dir = tmp_path / "entrada"
+    watch_dir.mkdir()
+    source = watch_dir / "hoja.png"
+    _image(source)
+    watcher = FolderWatcher(str(watch_dir), str(tmp_path / "salida"), OPTIONS, settle=0)
+    watcher.stop()
+    assert not watcher.clean(str(source)).ok
+    assert sorted(os.listdir(watch_dir)) == ["hoja.png"]
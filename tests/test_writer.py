@@ -0,0 +1,105 @@
+import os
+
+import cv2
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+import retoque.writer as writer_module
+from retoque.engine import clean_file_to_path
+from retoque.options import CleaningOptions
+from retoque.writer import PdfPageWriter
+
+PAGES = 40
+# El trailer lleva un /ID aleatorio cuya codificación cambia unos bytes de un guardado a otro
+SIZE_TOLERANCE = 64
+
+
+def _pages():
+    pages = []
+    for number in range(PAGES):
+        img = np.full((300, 200, 3), 200 + number % 50, np.uint8)
+        cv2.putText(img, str(number), (20, 150), cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 0), 3)
+        pages.append(img)
+    return pages
+
+
+def _page_streams(doc):
+    """Streams crudos (ya comprimidos) de las imágenes de cada página"""
+    return [[doc.xref_stream_raw(image[0]) for image in page.get_images(full=True)] for page in doc]
+
+
+def _write(path, options, flush_every):
+    writer = PdfPageWriter(path, options, flush_every=flush_every)
+    for img in _pages():
+        assert writer.add_page(img)
+    assert writer.close()
+    return os.path.getsize(path)
+
+
+@pytest.mark.parametrize('encoder', ['png', 'jpeg', 'g4'])
+@pytest.mark.parametrize('encode_threads', [1, 2])
+def test_output_size_does_not_depend_on_flush_interval(tmp_path, encoder, encode_threads):
+    options = CleaningOptions(page_encoder=encoder, encode_threads=encode_threads)
+    sizes = {}
+    streams = {}
+    for flush_every in (1, 16, 1000):
+        path = str(tmp_path / f"salida-{flush_every}.pdf")
+        sizes[flush_every] = _write(path, options, flush_every)
+        with fitz.open(path) as doc:
+            assert len(doc) == PAGES
+            # Ningún stream se queda sin comprimir por los guardados incrementales
+            for xref in range(1, doc.xref_length()):
+                if doc.xref_is_stream(xref):
+                    assert doc.xref_get_key(xref, 'Filter')[0] != 'null', xref
+            streams[flush_every] = _page_streams(doc)
+    assert streams[1] == streams[16] == streams[1000]
+    assert max(sizes.values()) - min(sizes.values()) <= SIZE_TOLERANCE, sizes
+    assert sorted(os.listdir(tmp_path)) == sorted(f"salida-{n}.pdf" for n in sizes)
+
+
+def _failing_on_height(monkeypatch, height):
+    """Hacer que falle la codificación de las páginas de `height` píxeles de alto"""
+    real = writer_module.encode_page
+
+    def encode_page(img, options):
+        if img.shape[0] == height:
+            raise ValueError("fallo de prueba")
+        return real(img, options)
+
+    monkeypatch.setattr(writer_module, 'encode_page', encode_page)
+
+
+@pytest.mark.parametrize('encode_threads', [1, 2])
+def test_failed_encoding_is_not_counted_as_written(tmp_path, monkeypatch, encode_threads):
+    _failing_on_height(monkeypatch, 310)
+    source = fitz.open()
+    for height in (300, 310, 300):
+        source.new_page(width=200, height=height)
+    source_path = str(tmp_path / "entrada.pdf")
+    source.save(source_path)
+    source.close()
+
+    options = CleaningOptions(remove_seals=False, remove_signatures=False, render_scale=1.0,
+                              encode_threads=encode_threads)
+    output_path = str(tmp_path / "salida.pdf")
+    result = clean_file_to_path(source_path, output_path, options)
+    assert result.ok
+    assert result.pages == 2
+    with fitz.open(output_path) as doc:
+        assert len(doc) == 2
+
+
+def test_all_pages_failing_is_an_error(tmp_path, monkeypatch):
+    _failing_on_height(monkeypatch, 300)
+    source = fitz.open()
+    source.new_page(width=200, height=300)
+    source_path = str(tmp_path / "entrada.pdf")
+    source.save(source_path)
+    source.close()
+
+    result = clean_file_to_path(source_path, str(tmp_path / "salida.pdf"),
+                                CleaningOptions(render_scale=1.0, encode_threads=2))
+    assert not result.ok
+    assert result.pages == 0
+    assert sorted(os.listdir(tmp_path)) == ["entrada.pdf"]